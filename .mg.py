@@ -19,17 +19,21 @@ def run_shell(cmd, verbose=True):
     return 0
 
 
-def capture_output(cmd, verbose=False):
-    # type: (str,bool) -> str
-    if verbose:
-        print(f"--> {cmd}")
-    try:
-        r = subprocess.run(cmd, shell=True, capture_output=True)
-    except (TypeError, AttributeError):  # For python<=3.6
-        with os.popen(cmd) as p:
-            return p.read().strip()
-    else:
-        return r.stdout.decode(errors="ignore").strip()
+try:
+    from runner import capture_output
+except ImportError:  # Copied to home directory without carstino
+
+    def capture_output(cmd, verbose=False):
+        # type: (str,bool) -> str
+        if verbose:
+            print(f"--> {cmd}")
+        try:
+            r = subprocess.run(cmd, shell=True, capture_output=True)
+        except (TypeError, AttributeError):  # For python<=3.6
+            with os.popen(cmd) as p:
+                return p.read().strip()
+        else:
+            return r.stdout.decode(errors="ignore").strip()
 
 
 def get_python_version(not_windows, parent=".venv"):
@@ -30,22 +30,25 @@ TEXT = """
 """
 
 
-def run_and_echo(cmd):
-    # type: (str) -> int
-    print("--> " + cmd)
-    sys.stdout.flush()
-    return os.system(cmd)
+try:
+    from runner import capture_output, run_and_echo
+except ImportError:  # Copied to home directory without carstino
 
+    def run_and_echo(cmd):
+        # type: (str) -> int
+        print("--> " + cmd)
+        sys.stdout.flush()
+        return os.system(cmd)
 
-def capture_output(cmd):
-    # type: (str) -> str
-    try:
-        r = subprocess.run(cmd, shell=True, capture_output=True)
-    except (TypeError, AttributeError):  # For python<=3.6
-        with os.popen(cmd) as p:
-            return p.read().strip()
-    else:
-        return r.stdout.decode().strip()
+    def capture_output(cmd):
+        # type: (str) -> str
+        try:
+            r = subprocess.run(cmd, shell=True, capture_output=True)
+        except (TypeError, AttributeError):  # For python<=3.6
+            with os.popen(cmd) as p:
+                return p.read().strip()
+        else:
+            return r.stdout.decode().strip()
 
 
 def patch_it(filename, tip="pip i package-name"):
@@ -11,10 +11,11 @@ Usage:
 """
 
 import os
-import subprocess
 import sys
 from pathlib import Path
 
+from runner import capture_output
+
 SETTINGS_ENV = "DJANGO_SETTINGS_MODULE"
 SQL = "create database {} CHARACTER SET {}"
 
@@ -28,17 +29,6 @@ def secho(*args, **kw):
         secho(" ".join(map(str, args)), **kw)
 
 
-def capture_output(cmd):
-    # type: (str) -> str
-    try:
-        r = subprocess.run(cmd, shell=True, capture_output=True)
-    except (TypeError, AttributeError):  # For python<=3.6
-        with os.popen(cmd) as p:
-            return p.read().strip()
-    else:
-        return r.stdout.decode().strip()
-
-
 def configure_settings():
     p = Path("manage.py")
     MAX_NESTED = 5  # make `mg` work at sub directory
@@ -15,6 +15,8 @@ import platform
 import shutil
 import sys
 
+from runner import capture_output
+
 try:
     from functools import cache
 except ImportError:
@@ -32,21 +34,6 @@ except ImportError:
         return runner
 
 
-def capture_output(command):
-    # type: (str) -> str
-    with os.popen(command) as fp:
-        if not hasattr(fp, "_stream"):  # For python2
-            return fp.read().strip()
-        buffer = getattr(fp._stream, "buffer", None)
-        if buffer is None:
-            return ""
-        bf = buffer.read().strip()
-    try:
-        return bf.decode()
-    except UnicodeDecodeError:
-        return bf.decode("gbk")
-
-
 run_cmd = capture_output  # Leave it here for compatibility
 
 
@@ -81,8 +68,11 @@ def is_controlled_by_ssh():
 @cache
 def is_poetry_project(filename):
     # type: (str) -> bool
-    text = read_content(filename)
-    return b'build-backend = "poetry' in text
+    try:
+        from pip_conf import PyprojectScanner
+    except ImportError:
+        return b'build-backend = "poetry' in read_content(filename)
+    return PyprojectScanner.scan(filename)[0] == "poetry"
 
 
 def source_activate(venv_dir, is_windows=False):
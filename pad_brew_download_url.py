@@ -9,9 +9,10 @@ Usage::
 
 import datetime
 import os
-import subprocess
 import sys
 
+from runner import capture_output
+
 # PROXY = "https://ghfast.top/"
 PROXY = "https://hub.gitmirror.com/"
 PY_HOST = "https://mirrors.huaweicloud.com/python/"
@@ -42,17 +43,6 @@ def say_done():
         console.log("[bold magenta]Done.[/bold magenta]", ":vampire:")
 
 
-def capture_output(cmd):
-    # type: (str) -> str
-    try:
-        r = subprocess.run(cmd, shell=True, capture_output=True)
-    except (TypeError, AttributeError):  # For python<=3.6
-        with os.popen(cmd) as p:
-            return p.read().strip()
-    else:
-        return r.stdout.decode().strip()
-
-
 def remove_old_pad(text, s):
     # type: (str, str) -> tuple[str, str, bool]
     s_index = text.index(s)
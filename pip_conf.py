@@ -17,11 +17,13 @@ Or:
     $ python pip_conf.py https://pypi.mirrors.ustc.edu.cn/simple  # conf with full url
 
     $ python pip_conf.py --list  # show choices
+    $ python pip_conf.py --fastest  # benchmark mirrors and use the fastest one
     $ python pip_conf.py --poetry  # set mirrors in poetry's config.toml
     $ python pip_conf.py --pdm     # set pypi.url for pdm
     $ python pip_conf.py --uv      # set mirror for uv
     $ python pip_conf.py --pip     # set mirror for pip
     $ python pip_conf.py --tool=auto # find out manage tool at current directory and set mirror for it
+    $ python pip_conf.py --tool=all  # set mirror for all of the installed tools
 
     $ sudo python pip_conf.py --etc  # Set conf to /etc/pip.[conf|ini]
 
@@ -32,25 +34,17 @@ If there is any bug or feature request, report it to:
 __author__ = "waketzheng@gmail.com"
 __updated_at__ = "2026.04.28"
 __version__ = "0.9.1"
-import contextlib
 import functools
 import os
-import platform
-import pprint
 import re
-import shutil
-import socket
-import subprocess
 import sys
 
-try:
-    import typing
-except ImportError:
-    pass
-else:
-    if typing.TYPE_CHECKING:
-        from argparse import Namespace  # NOQA:F401
-        from typing import Literal, Optional  # NOQA:F401
+# Heavy modules(argparse/subprocess/socket/...) are imported where they are
+# needed, so that `--url/--list/--version` can be answered in a blink.
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from argparse import Namespace  # NOQA:F401
+    from typing import Any, Iterator, Literal, Optional  # NOQA:F401
 
 """
 A sample of the pip.conf/pip.ini:
@@ -90,7 +84,17 @@ _hw_inner_source = (
 )
 CONF_PIP = "pip config set global.index-url "
 INDEX_URL = "https://{}/simple/"
-socket.setdefaulttimeout(5)
+PROBE_TIMEOUT = 5
+CACHE_TTL = 3600  # Seconds to keep the probe results in ~/.cache/pip-conf/
+DNS_TIMEOUT = 2  # Seconds to wait for the A/AAAA answers of a domain
+MAX_LAG = 2  # Files a mirror may lag behind the reference, as sync delay
+MAX_SERIAL_LAG = 10000  # `_last-serial` counts all events of PyPI, hours of uploads
+WATCH_INTERVAL = 60  # Seconds between two rounds of probes in watch mode
+PROXY_PORT = 3141  # Port of the caching proxy started by `pip_conf.py serve`
+PROXY_CACHE_SIZE = 4096  # Megabytes of wheels and pages kept by the proxy
+FLEET_SSH = "ssh -o BatchMode=yes -o ConnectTimeout=10"
+FLEET_TIMEOUT = 300  # Seconds for each host to finish in fleet mode
+USER_AGENT = "pip-conf-mirror/" + __version__
 
 
 class PipConfError(Exception):
@@ -113,7 +117,17 @@ class System:
         # type: () -> str
         system = cls._system
         if system is None:
-            system = cls._system = platform.system()
+            if sys.platform == "win32":
+                system = "Windows"
+            elif sys.platform == "darwin":
+                system = "Darwin"
+            elif sys.platform.startswith("linux"):
+                system = "Linux"
+            else:
+                import platform
+
+                system = platform.system()
+            cls._system = system
         return system
 
     @classmethod
@@ -132,9 +146,303 @@ class System:
         return cls.get_system() == "Linux"
 
 
+class ProbeCache:
+    """Probe results that persist across runs, stored at ~/.cache/pip-conf/
+
+    Entries are keyed by network fingerprint, kind and host, and expire after
+    `ttl` seconds (env: PIP_CONF_CACHE_TTL, set it to 0 to disable caching).
+    Failures expire after `negative_ttl` seconds, so that a transient one does
+    not hide the mirror for long.
+    """
+
+    ttl = None  # type: Optional[float]
+    negative_ttl = 60.0
+    filename = "probes.json"
+    _data = None  # type: Optional[dict[str, dict]]
+    _fingerprint = None  # type: Optional[str]
+    _dirty = False
+    _lock = None  # type: Any
+
+    @classmethod
+    def get_ttl(cls):
+        # type: () -> float
+        if cls.ttl is None:
+            try:
+                cls.ttl = float(os.getenv("PIP_CONF_CACHE_TTL", CACHE_TTL))
+            except ValueError:
+                cls.ttl = CACHE_TTL
+        return cls.ttl
+
+    @staticmethod
+    def get_dirpath():
+        # type: () -> str
+        path = os.getenv("PIP_CONF_CACHE_DIR")
+        if path:
+            return path
+        if System.is_win():
+            parent = os.getenv("LOCALAPPDATA") or os.path.expanduser("~")
+        else:
+            parent = os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+        return os.path.join(parent, "pip-conf")
+
+    @classmethod
+    def get_path(cls):
+        # type: () -> str
+        return os.path.join(cls.get_dirpath(), cls.filename)
+
+    @classmethod
+    def fingerprint(cls):
+        # type: () -> str
+        """Hostname, outbound ip and nameservers, changed when network changed"""
+        if cls._fingerprint is None:
+            import hashlib
+            import socket
+
+            parts = [socket.gethostname()]
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                s.connect(("8.8.8.8", 53))  # No packet will be sent for udp
+                parts.append(s.getsockname()[0])
+            except Exception:
+                parts.append("offline")
+            finally:
+                s.close()
+            resolv = "/etc/resolv.conf"
+            if os.path.exists(resolv):
+                with open(resolv) as f:
+                    parts += [i for i in f.read().splitlines() if "nameserver" in i]
+            text = "|".join(parts).encode("utf-8")
+            cls._fingerprint = hashlib.sha1(text).hexdigest()[:12]
+        return cls._fingerprint
+
+    @classmethod
+    def load(cls):
+        # type: () -> dict[str, dict]
+        if cls._data is None:
+            import json
+            import threading
+
+            cls._lock = threading.Lock()
+            data = {}  # type: dict[str, dict]
+            path = cls.get_path()
+            if os.path.exists(path):
+                try:
+                    with open(path) as f:
+                        data = json.load(f)
+                except (ValueError, IOError, OSError):
+                    pass
+            cls._data = data
+        return cls._data
+
+    @classmethod
+    def build_key(cls, kind, host):
+        # type: (str, str) -> str
+        return "{}|{}|{}".format(cls.fingerprint(), kind, host)
+
+    @classmethod
+    def get(cls, kind, host):
+        # type: (str, str) -> Any
+        """Return the cached value, or None if missing or expired"""
+        ttl = cls.get_ttl()
+        if ttl <= 0:
+            return None
+        item = cls.load().get(cls.build_key(kind, host))
+        if item is None:
+            return None
+        if cls.is_expired(item["time"], bool(item.get("failed")), ttl=ttl):
+            return None
+        return item["value"]
+
+    @classmethod
+    def is_expired(cls, saved_at, failed=False, now=None, ttl=None):
+        # type: (float, bool, Optional[float], Optional[float]) -> bool
+        import time
+
+        ttl = cls.get_ttl() if ttl is None else ttl
+        if failed:
+            ttl = min(ttl, cls.negative_ttl)
+        return (time.time() if now is None else now) - saved_at > ttl
+
+    @classmethod
+    def set(cls, kind, host, value, failed=False):
+        # type: (str, str, Any, bool) -> None
+        if cls.get_ttl() <= 0:
+            return
+        import time
+
+        item = {"time": time.time(), "value": value}  # type: dict[str, Any]
+        if failed:
+            item["failed"] = True
+        data = cls.load()
+        with cls._lock:
+            data[cls.build_key(kind, host)] = item
+            if not cls._dirty:
+                import atexit
+
+                cls._dirty = True
+                atexit.register(cls.save)
+
+    @classmethod
+    def save(cls):
+        # type: () -> None
+        if not cls._dirty or cls._data is None:
+            return
+        import json
+        import time
+
+        now, ttl = time.time(), cls.get_ttl()
+        with cls._lock:
+            data = {
+                k: v
+                for k, v in cls._data.items()
+                if not cls.is_expired(v["time"], bool(v.get("failed")), now, ttl)
+            }
+            cls._dirty = False
+        dirpath = cls.get_dirpath()
+        path = cls.get_path()
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            with Tracer.span("write", path, entries=len(data)):
+                if not os.path.exists(dirpath):
+                    os.makedirs(dirpath)
+                with open(tmp, "w") as f:
+                    json.dump(data, f)
+                replace_file(tmp, path)
+        except (IOError, OSError) as e:
+            print("WARNING: failed to save probe cache: {}".format(e))
+
+
+def replace_file(src, dst):
+    # type: (str, str) -> None
+    try:
+        os.replace(src, dst)
+    except AttributeError:  # For python2
+        if os.path.exists(dst) and System.is_win():
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+class Span(object):
+    """Start/end time of an operation, `args` tell what happened in it"""
+
+    def __init__(self, kind, name, args):
+        # type: (str, str, dict[str, Any]) -> None
+        self.kind = kind
+        self.name = name
+        self.args = args
+        self.start = self.end = 0.0
+        self.thread = ""
+
+    def set(self, **kw):
+        # type: (Any) -> None
+        self.args.update(kw)
+
+    def __enter__(self):
+        # type: () -> Span
+        import threading
+        import time
+
+        self.thread = threading.current_thread().name
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # type: (Any, Any, Any) -> None
+        import time
+
+        self.end = time.time()
+        if exc_type is not None:
+            self.args["error"] = "{}: {}".format(exc_type.__name__, exc)
+        Tracer.spans.append(self)
+
+
+class NullSpan(Span):
+    def set(self, **kw):
+        # type: (Any) -> None
+        pass
+
+    def __enter__(self):
+        # type: () -> Span
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # type: (Any, Any, Any) -> None
+        pass
+
+
+class Tracer:
+    """Spans of probes, subprocesses and file writes, enabled by `--trace`.
+
+    They are saved when exit, as Chrome trace format if the filename ends
+    with `.json` (load it at chrome://tracing or ui.perfetto.dev), or as json
+    lines otherwise.
+    """
+
+    path = ""
+    spans = []  # type: list[Span]
+    null = NullSpan("", "", {})
+
+    @classmethod
+    def enable(cls, path):
+        # type: (str) -> None
+        if not cls.path:
+            import atexit
+
+            atexit.register(cls.save)
+        cls.path = path
+
+    @classmethod
+    def span(cls, kind, name, **args):
+        # type: (str, str, Any) -> Span
+        if not cls.path:
+            return cls.null
+        return Span(kind, name, args)
+
+    @classmethod
+    def dumps(cls):
+        # type: () -> str
+        import json
+
+        spans = sorted(cls.spans, key=lambda i: i.start)
+        if not cls.path.endswith(".json"):
+            lines = []
+            for i in spans:
+                item = {"start": i.start, "end": i.end}  # type: dict[str, Any]
+                item.update(kind=i.kind, name=i.name, thread=i.thread)
+                item.update(duration=i.end - i.start)
+                item.update(i.args)
+                lines.append(json.dumps(item, sort_keys=True))
+            return "\n".join(lines)
+        pid = os.getpid()
+        threads = []  # type: list[str]
+        events = []  # type: list[dict[str, Any]]
+        for i in spans:
+            if i.thread not in threads:
+                threads.append(i.thread)
+                meta = {"name": "thread_name", "ph": "M", "args": {"name": i.thread}}
+                events.append(dict(meta, pid=pid, tid=len(threads)))
+            event = {"ph": "X", "args": i.args}  # type: dict[str, Any]
+            event.update(name=i.name, cat=i.kind)
+            event.update(ts=int(i.start * 1e6), dur=int((i.end - i.start) * 1e6))
+            events.append(dict(event, pid=pid, tid=threads.index(i.thread) + 1))
+        return json.dumps({"traceEvents": events, "displayTimeUnit": "ms"})
+
+    @classmethod
+    def save(cls):
+        # type: () -> None
+        if not cls.path:
+            return
+        text = cls.dumps()
+        with open(cls.path, "w") as f:
+            f.write(text + "\n" if text else text)
+        print("Trace of {} spans saved to {}".format(len(cls.spans), cls.path))
+
+
 def is_command_exists(tool):
     # type: (str) -> bool
     # tool: Literal['uv', 'pdm', 'poetry']
+    import shutil
+
     try:
         return shutil.which(tool) is not None
     except AttributeError:  # For Python2
@@ -184,8 +492,8 @@ def get_python(check_download_command=False, verbose=False):
     return "python"
 
 
-def check_mirror_by_pip_download(domain, tmp=False, verbose=False):
-    # type: (str, bool, bool) -> bool
+def build_pip_download_command(domain, tmp=False):
+    # type: (str, bool) -> tuple[str, str]
     if "/" not in domain:
         domain = "http://{0}/pypi/simple/ --trusted-host {0}".format(domain)
     elif "https:" not in domain:
@@ -210,19 +518,51 @@ def check_mirror_by_pip_download(domain, tmp=False, verbose=False):
     else:
         if tmp:
             cmd += " -d /tmp"
+    return cmd, domain
+
+
+def remove_downloaded_six(tmp=False):
+    # type: (bool) -> None
+    dirname = "/tmp" if tmp else "."
+    for name in os.listdir(dirname):
+        if name.startswith("six-") and name.endswith(".whl"):
+            os.remove(os.path.join(dirname, name))
+
+
+def check_mirror_by_pip_download(domain, tmp=False, verbose=False):
+    # type: (str, bool, bool) -> bool
+    cmd, domain = build_pip_download_command(domain, tmp)
     print("Checking whether {} reachable...".format(repr(domain)))
     if verbose:
         print("Command: {}".format(cmd))
     if os.system(cmd) == 0:
         if not cmd.startswith("ping"):
-            dirname = "/tmp" if tmp else "."
-            for name in os.listdir(dirname):
-                if name.startswith("six-") and name.endswith(".whl"):
-                    os.remove(os.path.join(dirname, name))
+            remove_downloaded_six(tmp)
         return True
     return False
 
 
+def check_mirror_by_http(host, timeout=PROBE_TIMEOUT, verbose=False):
+    # type: (str, float, bool) -> bool
+    """Fetch /simple/six/ from the mirror, it's OK if an index page responded"""
+    url = build_mirror_url(host).rstrip("/") + "/six/"
+    if verbose:
+        print("Checking whether {} reachable...".format(repr(url)))
+    try:
+        status, content_type, body, _ = http_get(url, timeout)
+    except Exception as e:
+        if verbose:
+            print("URL {} is not readable: {}".format(url, e))
+        return False
+    if verbose:
+        print("GET {} -> {} ({})".format(url, status, content_type))
+    if status != 200:
+        return False
+    if "html" not in content_type and "json" not in content_type:
+        return False
+    return b"six-" in body
+
+
 def ensure_domain_name(host):
     # type: (str) -> str
     if "/" not in host:
@@ -248,6 +588,8 @@ def is_pip_ready(py="python"):
 
 def check_url_reachable(url, verbose=False):
     # type: (str,bool) -> bool
+    import contextlib
+
     try:
         from urllib.request import urlopen as _urlopen
 
@@ -300,32 +642,298 @@ def ping_command(domain):
     return "ping -c 1 {}".format(domain)
 
 
+class Resolver:
+    """Resolve domains by A and AAAA lookups racing each other
+
+    Answers are shared by all callers in one run and kept at ProbeCache, so
+    that a slow resolver is paid for only once. They expire after the TTL of
+    ProbeCache too, so that long running `--watch`/`serve` see changed ips.
+    The first answered family waits a short resolution delay for the other
+    one (RFC 8305), and the whole lookup is bounded by `timeout` (env:
+    PIP_CONF_DNS_TIMEOUT).
+    """
+
+    timeout = None  # type: Optional[float]
+    resolution_delay = 0.05
+    _answers = {}  # type: dict[str, tuple[float, list[str]]]  # (time, ips)
+    _pending = {}  # type: dict[str, Any]
+    _locks = {}  # type: dict[str, Any]
+
+    @classmethod
+    def get_timeout(cls):
+        # type: () -> float
+        if cls.timeout is None:
+            try:
+                cls.timeout = float(os.getenv("PIP_CONF_DNS_TIMEOUT", DNS_TIMEOUT))
+            except ValueError:
+                cls.timeout = DNS_TIMEOUT
+        return cls.timeout
+
+    @staticmethod
+    def lookup(domain, family):
+        # type: (str, int) -> list[str]
+        import socket
+
+        try:
+            infos = socket.getaddrinfo(domain, None, family, socket.SOCK_STREAM)
+        except Exception:
+            return []
+        ips = []  # type: list[str]
+        for _family, _type, _proto, _name, sockaddr in infos:
+            ip = sockaddr[0]  # (host, port, ...) of AF_INET/AF_INET6
+            if isinstance(ip, str) and ip not in ips:
+                ips.append(ip)
+        return ips
+
+    @classmethod
+    def race(cls, domain):
+        # type: (str) -> tuple[list[str], bool]
+        """:return: ip addresses(IPv6 first) and whether all lookups finished"""
+        import socket
+        import threading
+        import time
+
+        families = [socket.AF_INET6, socket.AF_INET]
+        if not socket.has_ipv6:
+            families = families[1:]
+        results = {}  # type: dict[int, list[str]]
+        cond = threading.Condition()
+
+        def run(family):
+            # type: (int) -> None
+            ips = cls.lookup(domain, family)
+            with cond:
+                results[family] = ips
+                cond.notify_all()
+
+        for family in families:
+            t = threading.Thread(target=run, args=(family,))
+            t.daemon = True  # getaddrinfo can not be cancelled
+            t.start()
+        deadline = time.time() + cls.get_timeout()
+        with cond:
+            while len(results) < len(families):
+                if any(results.values()):
+                    deadline = min(deadline, time.time() + cls.resolution_delay)
+                remain = deadline - time.time()
+                if remain <= 0:
+                    break
+                cond.wait(remain)
+            answers = dict(results)
+        ips = []  # type: list[str]
+        for family in families:
+            ips += answers.get(family, [])
+        return ips, len(answers) == len(families)
+
+    @classmethod
+    def resolve(cls, domain):
+        # type: (str) -> list[str]
+        import threading
+        import time
+
+        lock = cls._locks.setdefault("lock", threading.Lock())
+        with lock:
+            answer = cls._answers.get(domain)
+            if answer and not ProbeCache.is_expired(answer[0], not answer[1]):
+                return answer[1]
+            pending = cls._pending.get(domain)
+            if pending is None:
+                cached = ProbeCache.get("dns", domain)
+                if cached is not None:
+                    cls._answers[domain] = (time.time(), cached)
+                    return cached
+                event = cls._pending[domain] = threading.Event()
+        if pending is not None:  # Same domain is being resolved by other thread
+            pending.wait(cls.get_timeout() + 1)
+            return cls._answers.get(domain, (0, []))[1]
+        with Tracer.span("dns", domain) as span:
+            ips, finished = cls.race(domain)
+            span.set(ips=ips, finished=finished)
+        with lock:
+            cls._answers[domain] = (time.time(), ips)
+            del cls._pending[domain]
+        event.set()
+        if ips or finished:  # Do not persist a failure caused by timeout
+            ProbeCache.set("dns", domain, ips, failed=not ips)
+        return ips
+
+
+def resolve_host(domain):
+    # type: (str) -> list[str]
+    """Return ip addresses of the domain, empty list if it can not be resolved"""
+    return Resolver.resolve(domain)
+
+
 def is_pingable(host="", is_windows=False, domain="", verbose=False):
     # type: (str,bool,str,bool) -> bool
     host = host or domain
+    cached = ProbeCache.get("probe", host)
+    if cached is not None:
+        if verbose:
+            print("Use cached probe result of {}: {}".format(host, cached))
+        return cached["ok"]
+    import time
+
+    start = time.time()
+    with Tracer.span("probe", host) as span:
+        ok = _is_pingable(host, is_windows, verbose)
+        span.set(ok=ok)
+    latency = time.time() - start
+    ProbeCache.set("probe", host, {"ok": ok, "latency": latency}, failed=not ok)
+    return ok
+
+
+def _is_pingable(host, is_windows=False, verbose=False):
+    # type: (str,bool,bool) -> bool
     if is_windows:
         # 2024.12.23 Windows may need administrator to run `ping -c 1 xxx`
         # So use `pip download ...` instead.
-        if is_pip_ready():
+        if is_strict_probe() and is_pip_ready():
             return check_mirror_by_pip_download(host, verbose=verbose)
-        else:
-            url = build_mirror_url(host)
-            return check_url_reachable(url, verbose=verbose)
+        return check_mirror_by_http(host, verbose=verbose)
     domain = ensure_domain_name(host)
-    try:
-        socket.gethostbyname(domain)
-    except Exception:
+    if not resolve_host(split_port(domain)[0]):
         return False
-    else:
+    if is_strict_probe():
         py = get_python(verbose=verbose)
         if is_pip_ready(py):
             if verbose:
-                print("pip ready, going to check readable by pip download ...")
+                print("Strict mode, going to check readable by pip download ...")
             return check_mirror_by_pip_download(host, tmp=True, verbose=verbose)
         if verbose:
-            print("pip not available, check readable by urlopen ...")
-        return check_url_reachable(build_mirror_url(host), verbose=verbose)
-    return os.system(ping_command(domain)) == 0
+            print("pip not available, check readable by http request ...")
+    return check_mirror_by_http(host, verbose=verbose)
+
+
+def is_strict_probe():
+    # type: () -> bool
+    """Whether to check mirror by `pip download` instead of http request"""
+    return "--strict-probe" in sys.argv or load_bool("PIP_CONF_STRICT_PROBE")
+
+
+def is_fresh_check():
+    # type: () -> bool
+    """Whether to rank mirrors that lag behind the reference index lower"""
+    return "--check-fresh" in sys.argv or load_bool("PIP_CONF_CHECK_FRESH")
+
+
+class Freshness:
+    """Compare the project page of mirrors with the reference index.
+
+    PEP 691 json pages tell `_last-serial` in meta, and the html pages from
+    PyPI/bandersnatch contain a `<!--SERIAL n-->` comment. When any side has
+    no serial, count the files of the reference that the mirror misses.
+    Reference is pypi.org, or the index url of env PIP_CONF_REFERENCE.
+    Mirrors that lag more than `max_lag` files (env: PIP_CONF_MAX_LAG) or
+    `max_serial_lag` serials (env: PIP_CONF_MAX_SERIAL_LAG) are stale, the
+    serial is a global event counter of PyPI so it needs a much larger one.
+    """
+
+    package = "pip"  # Releases often, so lag of mirrors can be seen soon
+    max_lag = None  # type: Optional[int]
+    max_serial_lag = None  # type: Optional[int]
+    accept = "application/vnd.pypi.simple.v1+json, text/html;q=0.1"
+    _reference = {}  # type: dict[str, Any]
+    _locks = {}  # type: dict[str, Any]
+
+    @classmethod
+    def reference_url(cls):
+        # type: () -> str
+        return os.getenv("PIP_CONF_REFERENCE") or INDEX_URL.format(SOURCES["pypi"])
+
+    @classmethod
+    def snapshot(cls, index_url, timeout=PROBE_TIMEOUT):
+        # type: (str, float) -> Optional[tuple[Optional[int], set[str]]]
+        """:return: (serial, filenames) of the project page, None if failed"""
+        url = urljoin(index_url.rstrip("/") + "/", cls.package + "/")
+        headers = {"Accept": cls.accept}
+        try:
+            status, content_type, body, _ = http_get(url, timeout, headers=headers)
+        except Exception:
+            return None
+        if status != 200:
+            return None
+        text = body.decode("utf-8", "replace")
+        if "json" in content_type:
+            import json
+
+            try:
+                data = json.loads(text)
+                files = {i["filename"] for i in data.get("files", [])}
+                return data.get("meta", {}).get("_last-serial"), files
+            except (ValueError, KeyError, TypeError, AttributeError):
+                return None  # Not a PEP 691 page, e.g.: captive portal
+        m = re.search(r"<!--\s*SERIAL\s+(\d+)\s*-->", text)
+        files = set(re.findall(r">\s*([^<>]+?)\s*</a>", text))
+        return (int(m.group(1)) if m else None), files
+
+    @classmethod
+    def reference(cls):
+        # type: () -> Optional[tuple[Optional[int], set[str]]]
+        import threading
+
+        with cls._locks.setdefault("lock", threading.Lock()):
+            url = cls.reference_url()
+            if url not in cls._reference:
+                cls._reference[url] = cls.snapshot(url)
+            return cls._reference[url]
+
+    @classmethod
+    def measure(cls, index_url):
+        # type: (str) -> Optional[tuple[int, bool]]
+        """:return: (lag, whether it is counted by serial), None if unknown"""
+        cached = ProbeCache.get("fresh", index_url)
+        if cached is not None and "serial" in cached:
+            return cached["behind"], cached["serial"]
+        reference = cls.reference()
+        if reference is None:
+            return None
+        current = cls.snapshot(index_url)
+        if current is None:
+            return None
+        (serial, files), (current_serial, current_files) = reference, current
+        by_serial = serial is not None and current_serial is not None
+        if serial is not None and current_serial is not None:
+            lag = max(serial - current_serial, 0)
+        else:
+            lag = len(files - current_files)
+        ProbeCache.set("fresh", index_url, {"behind": lag, "serial": by_serial})
+        return lag, by_serial
+
+    @classmethod
+    def behind(cls, index_url):
+        # type: (str) -> Optional[int]
+        """How far the mirror lags behind, None if unknown"""
+        measured = cls.measure(index_url)
+        return None if measured is None else measured[0]
+
+    @classmethod
+    def get_max_lag(cls, by_serial=False):
+        # type: (bool) -> int
+        if by_serial:
+            if cls.max_serial_lag is None:
+                cls.max_serial_lag = load_int("PIP_CONF_MAX_SERIAL_LAG", MAX_SERIAL_LAG)
+            return cls.max_serial_lag
+        if cls.max_lag is None:
+            cls.max_lag = load_int("PIP_CONF_MAX_LAG", MAX_LAG)
+        return cls.max_lag
+
+    @classmethod
+    def is_stale(cls, index_url):
+        # type: (str) -> bool
+        measured = cls.measure(index_url)
+        if measured is None:
+            return False
+        lag, by_serial = measured
+        return lag > cls.get_max_lag(by_serial)
+
+
+def load_int(name, default):
+    # type: (str, int) -> int
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
 
 
 def load_bool(name):
@@ -351,92 +959,741 @@ def is_hw_inner(is_windows=False, verbose=False):
     return is_pingable(_hw_inner_source, is_windows=is_windows, verbose=verbose)
 
 
-def parse_host(url):
+def get_source_host(source):
     # type: (str) -> str
-    return url.split("://", 1)[-1].split("/", 1)[0]
+    if source in ("hw_inner", "hw_ecs"):
+        return _hw_inner_source
+    return SOURCES[source]
 
 
-def printf(msg):
-    # type: (str) -> None
-    print(msg)
-    sys.stdout.flush()
+def split_port(netloc):
+    # type: (str) -> tuple[str, Optional[int]]
+    host, sep, port = netloc.rpartition(":")
+    if sep and port.isdigit() and "]" not in port:
+        return host.strip("[]"), int(port)
+    return netloc.strip("[]"), None
 
 
-def run_and_echo(cmd, dry=False):
-    # type: (str, bool) -> int
-    printf("--> " + cmd)
-    if dry:
-        if "--verbose" in sys.argv:
-            print("Exit without actually run the shell command!")
-        return 1
-    return os.system(cmd)
+def import_httplib():
+    try:
+        import http.client as httplib
+    except ImportError:  # For python2
+        import httplib  # type:ignore
+    return httplib
 
 
-def capture_output(cmd, verbose=False):
-    # type: (str,bool) -> str
-    if verbose:
-        print("--> {}".format(cmd))
-    try:
-        r = subprocess.run(cmd, shell=True, capture_output=True)
-    except (TypeError, AttributeError):  # For python<=3.6
-        with os.popen(cmd) as p:
-            return p.read().strip()
+def http_connection(url, timeout=PROBE_TIMEOUT):
+    # type: (str, float) -> tuple[Any, str]
+    """Return a not yet connected http(s) connection and the request path"""
+    httplib = import_httplib()
+    scheme, _, rest = url.partition("://")
+    netloc, _, path = rest.partition("/")
+    if scheme == "https":
+        conn = httplib.HTTPSConnection(netloc, timeout=timeout)
     else:
-        return r.stdout.decode(errors="ignore").strip()
+        conn = httplib.HTTPConnection(netloc, timeout=timeout)
+    return conn, "/" + path
 
 
-def config_by_cmd(url, is_windows=False, verbose=False, extra_info=None):
-    # type: (str, bool, bool, Optional[tuple[str,str]]) -> None
-    sudo = load_bool("PIP_CONF_SUDO")
-    _config_by_cmd(
-        url,
-        sudo=sudo,
-        is_windows=is_windows,
-        verbose=verbose,
-        extra_info=extra_info,
-    )
+def urljoin(base, url):
+    # type: (str, str) -> str
+    try:
+        from urllib.parse import urljoin as _urljoin
+    except ImportError:  # For python2
+        from urlparse import urljoin as _urljoin  # type:ignore
+    return _urljoin(base, url)
 
 
-class ExtraIndex:
-    caching = {}  # type: dict[str, Optional[tuple[str, str]]]
+def head_status(url, timeout=PROBE_TIMEOUT):
+    # type: (str, float) -> Optional[int]
+    """Send a HEAD request and return the status code, None if unreachable"""
+    conn, path = http_connection(url, timeout)
+    with Tracer.span("http", "HEAD " + url) as span:
+        try:
+            conn.request("HEAD", path, headers={"User-Agent": USER_AGENT})
+            status = conn.getresponse().status
+        except Exception as e:
+            span.set(error=str(e))
+            return None
+        finally:
+            conn.close()
+        span.set(status=status)
+        return status
 
-    def __init__(self, host, force=False):
-        self._host = host
-        self._force = force
 
-    def get(self):
-        # type: () -> Optional[tuple[str, str]]
-        host = self._host
-        if not host:
-            return None
-        if host in self.caching:
-            return self.caching[host]
-        value = self.caching[host] = self.get_extra_index(host, self._force)
-        return value
+def http_get(url, timeout=PROBE_TIMEOUT, redirects=3, headers=None, fileobj=None):
+    # type: (str, float, int, Optional[dict[str, str]], Any) -> tuple[int, str, bytes, str]
+    """GET the url and follow redirects.
 
-    @staticmethod
-    def get_extra_index(host, force=False):
-        # type: (str, bool) -> Optional[tuple[str, str]]
-        extra_host = ensure_domain_name(host)
-        if not force:
+    :param fileobj: write the body of 200 response to it in chunks if given
+    :return: (status, content type, body, final url), body is empty if written
+    """
+    headers = dict(headers or {}, **{"User-Agent": USER_AGENT})
+    for _ in range(redirects + 1):
+        conn, path = http_connection(url, timeout)
+        with Tracer.span("http", "GET " + url) as span:
             try:
-                socket.gethostbyname(extra_host)
-            except socket.gaierror:
-                print("Ignore {} as it's not pingable".format(extra_host))
-                return None
-        if "/" not in host:
-            extra_index_url = INDEX_URL.format(host)
+                conn.request("GET", path, headers=headers)
+                r = conn.getresponse()
+                span.set(status=r.status)
+                location = r.getheader("Location")
+                if r.status in (301, 302, 303, 307, 308) and location:
+                    url = urljoin(url, location)
+                    continue
+                content_type = r.getheader("Content-Type") or ""
+                if fileobj is None or r.status != 200:
+                    body = r.read()
+                    span.set(bytes=len(body))
+                    return r.status, content_type, body, url
+                size = 0
+                while True:
+                    chunk = r.read(64 * 1024)
+                    if not chunk:
+                        break
+                    fileobj.write(chunk)
+                    size += len(chunk)
+                span.set(bytes=size)
+                return r.status, content_type, b"", url
+            finally:
+                conn.close()
+    raise ConfigError("Too many redirects: {}".format(url))
+
+
+class MirrorProbe(object):
+    """Check reachability of several mirrors at the same time.
+
+    Every candidate runs `DNS resolve -> HEAD /simple/ -> GET /simple/six/` in
+    its own thread (`pip download` instead of http requests in strict mode).
+    The first candidate (by priority) that passes is the winner, once it is
+    known the probes still running are cancelled, so the worst case costs one
+    timeout instead of the sum of them (`strict_factor` timeouts in strict
+    mode, as `pip download` has to start an interpreter and resolve first).
+    """
+
+    strict_factor = 6
+
+    def __init__(self, candidates, timeout=PROBE_TIMEOUT, verbose=False):
+        # type: (list[tuple[str, str]], float, bool) -> None
+        import threading
+
+        self.candidates = candidates  # [(source_name, host)] in priority order
+        self.timeout = timeout
+        self.verbose = verbose
+        self.results = {}  # type: dict[str, bool]
+        self.stale = set()  # type: set[str]
+        self._cond = threading.Condition()
+        self._cancelled = threading.Event()
+        self._threading = threading
+
+    def log(self, msg):
+        # type: (str) -> None
+        if self.verbose:
+            printf(msg)
+
+    def resolve(self, host):
+        # type: (str) -> bool
+        domain, _ = split_port(ensure_domain_name(host))
+        return bool(resolve_host(domain))
+
+    def pip_download(self, host):
+        # type: (str) -> bool
+        import subprocess
+
+        if not is_pip_ready(get_python()):
+            return False
+        cmd, _ = build_pip_download_command(host, tmp=True)
+        self.log("Command: {}".format(cmd))
+        with open(os.devnull, "w") as devnull, Tracer.span("subprocess", cmd) as span:
+            p = subprocess.Popen(cmd, shell=True, stdout=devnull, stderr=devnull)
+            while p.poll() is None:
+                if self._cancelled.wait(0.1):
+                    p.kill()
+                    p.wait()
+                    span.set(cancelled=True)
+                    return False
+            span.set(rc=p.returncode)
+        if p.returncode == 0:
+            if not cmd.startswith("ping"):
+                remove_downloaded_six(tmp=True)
+            return True
+        return False
+
+    def check(self, host):
+        # type: (str) -> bool
+        if not self.resolve(host):
+            self.log("{} can not be resolved".format(host))
+            return False
+        if self._cancelled.is_set():
+            return False
+        url = build_mirror_url(host)
+        status = head_status(url, self.timeout)
+        self.log("HEAD {} -> {}".format(url, status))
+        if status is None or self._cancelled.is_set():
+            return False
+        if is_strict_probe():
+            return self.pip_download(host)
+        if status < 400:
+            return True
+        # Server is there but refuse HEAD request, try to get a project page
+        return check_mirror_by_http(host, self.timeout, verbose=self.verbose)
+
+    def _work(self, name, host):
+        # type: (str, str) -> None
+        cached = ProbeCache.get("probe", host)
+        if cached is not None:
+            self.log("Use cached probe result of {}: {}".format(host, cached))
+            ok = cached["ok"]
         else:
-            if not host.startswith("http"):
-                host = "https://" + host
-            if host.endswith("/pypi"):
-                host += "/simple"
-            extra_index_url = host
-        return extra_host, extra_index_url
+            import time
 
+            start = time.time()
+            with Tracer.span("probe", host) as span:
+                try:
+                    ok = self.check(host)
+                except Exception as e:
+                    self.log("Failed to probe {}: {}".format(host, e))
+                    ok = False
+                span.set(ok=ok, cancelled=self._cancelled.is_set())
+            if not self._cancelled.is_set():  # Result of cancelled one is unknown
+                latency = time.time() - start
+                value = {"ok": ok, "latency": latency}
+                ProbeCache.set("probe", host, value, failed=not ok)
+        if ok and is_fresh_check() and Freshness.is_stale(build_mirror_url(host)):
+            self.log("{} is reachable but stale".format(host))
+            self.stale.add(name)
+        with self._cond:
+            self.results[name] = ok
+            self._cond.notify_all()
 
-def _config_by_cmd(url, sudo=False, is_windows=False, verbose=False, extra_info=None):
-    # type: (str, bool, bool, bool, Optional[tuple[str,str]]) -> int
+    def _pick(self):
+        # type: () -> tuple[Optional[str], bool]
+        """Return (winner, finished), stale ones lose to any fresh one"""
+        fallback = None
+        for name, _ in self.candidates:
+            ok = self.results.get(name)
+            if ok is None:
+                return None, False
+            if ok and name not in self.stale:
+                return name, True
+            if ok and fallback is None:
+                fallback = name
+        return fallback, True
+
+    def run(self):
+        # type: () -> Optional[str]
+        import time
+
+        for name, host in self.candidates:
+            self.log("Checking whether {} reachable...".format(repr(host)))
+            t = self._threading.Thread(target=self._work, args=(name, host))
+            t.daemon = True
+            t.start()
+        timeout = self.timeout
+        if is_strict_probe():
+            timeout *= self.strict_factor
+        deadline = time.time() + timeout
+        with self._cond:
+            winner, finished = self._pick()
+            while not finished:
+                remain = deadline - time.time()
+                if remain <= 0:
+                    # Slow candidates are treated as unreachable
+                    passed = [n for n, _ in self.candidates if self.results.get(n)]
+                    fresh = [n for n in passed if n not in self.stale]
+                    winner = next(iter(fresh or passed), None)
+                    break
+                self._cond.wait(remain)
+                winner, finished = self._pick()
+        self._cancelled.set()
+        return winner
+
+
+class MirrorSpeed(object):
+    """Connect time, TTFB of `/simple/` and download speed of a small wheel"""
+
+    package = "six"
+    wheel = "six-1.17.0-py2.py3-none-any.whl"
+
+    def __init__(self, name, url):
+        # type: (str, str) -> None
+        self.name = name
+        self.url = url
+        self.connect = self.ttfb = self.download = 0.0
+        self.size = 0
+        self.error = ""
+        self.stale = False
+
+    @property
+    def throughput(self):
+        # type: () -> float
+        """Bytes per second"""
+        return self.size / self.download if self.download else 0.0
+
+    @property
+    def cost(self):
+        # type: () -> float
+        if self.error:
+            return float("inf")
+        return self.connect + self.ttfb + self.download
+
+    def pick_wheel(self, html):
+        # type: (str) -> str
+        links = re.findall(r'href="([^"]+\.whl)[^"]*"', html)
+        for link in links:
+            if link.rsplit("/", 1)[-1] == self.wheel:
+                return link
+        if not links:
+            raise ConfigError("No wheel found for " + self.package)
+        return links[-1]
+
+    def measure(self, timeout=PROBE_TIMEOUT):
+        # type: (float) -> MirrorSpeed
+        import time
+
+        try:
+            conn, path = http_connection(self.url, timeout)
+            try:
+                start = time.time()
+                conn.connect()
+                self.connect = time.time() - start
+                start = time.time()
+                conn.request("GET", path, headers={"User-Agent": USER_AGENT})
+                status = conn.getresponse().status
+                self.ttfb = time.time() - start
+            finally:
+                conn.close()
+            if status >= 400:
+                raise ConfigError("GET {} -> {}".format(self.url, status))
+            page_url = urljoin(self.url.rstrip("/") + "/", self.package + "/")
+            status, _, body, page_url = http_get(page_url, timeout)
+            if status >= 400:
+                raise ConfigError("GET {} -> {}".format(page_url, status))
+            wheel_url = urljoin(page_url, self.pick_wheel(body.decode("utf-8")))
+            start = time.time()
+            status, _, body, _ = http_get(wheel_url, timeout)
+            self.download = time.time() - start
+            if status >= 400:
+                raise ConfigError("GET {} -> {}".format(wheel_url, status))
+            self.size = len(body)
+        except Exception as e:
+            self.error = str(e) or e.__class__.__name__
+        return self
+
+    def check_fresh(self):
+        # type: () -> None
+        self.stale = Freshness.is_stale(self.url)
+
+    fields = ("connect", "ttfb", "download", "size", "error")
+
+    def load_cached(self):
+        # type: () -> bool
+        cached = ProbeCache.get("speed", self.url)
+        if cached is None:
+            return False
+        for field in self.fields:
+            setattr(self, field, cached[field])
+        return True
+
+    def dump_cache(self):
+        # type: () -> None
+        value = {field: getattr(self, field) for field in self.fields}
+        ProbeCache.set("speed", self.url, value, failed=bool(self.error))
+
+    def __repr__(self):
+        # type: () -> str
+        if self.error:
+            return "{:<10} {}  ERROR: {}".format(self.name, self.url, self.error)
+        return "{:<10} connect={:.0f}ms ttfb={:.0f}ms speed={:.1f}KB/s  {}{}".format(
+            self.name,
+            self.connect * 1000,
+            self.ttfb * 1000,
+            self.throughput / 1024,
+            self.url,
+            "  (stale)" if self.stale else "",
+        )
+
+
+def speed_test_candidates(extra=""):
+    # type: (str) -> list[tuple[str, str]]
+    """Every mirror in SOURCES(without aliases), hw inner and the extra index"""
+    names = {}  # type: dict[str, str]
+    for name in sorted(list(SOURCES) + ["hw_inner"], key=len, reverse=True):
+        names[get_source_host(name)] = name  # Prefer the short one of aliases
+    candidates = [
+        (name, build_index_url(name, force=True)) for name in sorted(names.values())
+    ]
+    if extra:
+        extra_info = ExtraIndex.get_extra_index(extra, force=True)
+        if extra_info is not None and extra_info[1] not in [i for _, i in candidates]:
+            candidates.append(("extra", extra_info[1]))
+    return candidates
+
+
+def rank_mirrors(candidates, timeout=PROBE_TIMEOUT, verbose=False):
+    # type: (list[tuple[str, str]], float, bool) -> list[MirrorSpeed]
+    """Measure the candidates at the same time and sort them from fast to slow"""
+    import threading
+    import time
+
+    speeds = [MirrorSpeed(name, url) for name, url in candidates]
+    todo = [i for i in speeds if not i.load_cached()]
+    workers = []
+    for speed in todo:
+        t = threading.Thread(target=speed.measure, args=(timeout,))
+        t.daemon = True
+        t.start()
+        workers.append((t, speed))
+    deadline = time.time() + timeout * 3
+    for t, speed in workers:
+        t.join(max(deadline - time.time(), 0))
+        if t.is_alive():
+            speed.error = "Timeout"
+        speed.dump_cache()
+    if is_fresh_check():
+        reachable = [i for i in speeds if not i.error]
+        threads = [threading.Thread(target=i.check_fresh) for i in reachable]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        deadline = time.time() + timeout
+        for t in threads:
+            t.join(max(deadline - time.time(), 0))
+    speeds.sort(key=lambda i: (i.stale, i.cost))
+    if verbose:
+        print("Mirrors ranked by speed:")
+        for index, speed in enumerate(speeds, 1):
+            print("{:>2}. {}".format(index, speed))
+    return speeds
+
+
+def fastest_index_url(extra=""):
+    # type: (str) -> str
+    ranked = rank_mirrors(speed_test_candidates(extra), verbose=True)
+    best = ranked[0]
+    if best.error:
+        print("No mirror reachable, use default: {}".format(DEFAULT))
+        return build_index_url(DEFAULT, force=True)
+    print("The fastest mirror is {}: {}".format(best.name, best.url))
+    return best.url
+
+
+class MirrorHealth(object):
+    """Rolling window of (ok, latency) probe results of a mirror"""
+
+    def __init__(self, name, url, window=10):
+        # type: (str, str, int) -> None
+        from collections import deque
+
+        self.name = name
+        self.url = url
+        self.samples = deque(maxlen=window)  # type: deque[tuple[bool, float]]
+
+    def probe(self, timeout=PROBE_TIMEOUT):
+        # type: (float) -> bool
+        import time
+
+        start = time.time()
+        ok = check_mirror_by_http(self.url, timeout)
+        self.samples.append((ok, time.time() - start))
+        return ok
+
+    @property
+    def error_rate(self):
+        # type: () -> float
+        if not self.samples:
+            return 1.0
+        return sum(1 for ok, _ in self.samples if not ok) / float(len(self.samples))
+
+    @property
+    def latency(self):
+        # type: () -> float
+        """Median latency of the successful probes"""
+        costs = sorted(cost for ok, cost in self.samples if ok)
+        if not costs:
+            return float("inf")
+        return costs[len(costs) // 2]
+
+    def __repr__(self):
+        # type: () -> str
+        latency = self.latency
+        cost = "-" if latency == float("inf") else "{:.0f}ms".format(latency * 1000)
+        return "{:<10} errors={:.0%} latency={}  {}".format(
+            self.name, self.error_rate, cost, self.url
+        )
+
+
+class MirrorWatcher(object):
+    """Probe the active index and its alternatives periodically, switch to the
+    best one when the active mirror degraded.
+
+    To avoid flapping, the active mirror must be degraded for `patience`
+    rounds in a row before switching, and no switch happens again until the
+    window is refilled with samples of the new active mirror.
+    """
+
+    window = 10
+    patience = 3
+    max_error_rate = 0.3
+    slowdown = 3.0  # Degraded when latency is N times of the best mirror
+
+    def __init__(
+        self,
+        active,
+        candidates,
+        apply,
+        interval=WATCH_INTERVAL,
+        timeout=PROBE_TIMEOUT,
+        verbose=False,
+    ):
+        # type: (str, list[tuple[str, str]], Any, float, float, bool) -> None
+        self.healths = [MirrorHealth(n, u, self.window) for n, u in candidates]
+        for health in self.healths:
+            if health.url.rstrip("/") == active.rstrip("/"):
+                active = health.url
+                break
+        else:
+            self.healths.insert(0, MirrorHealth("active", active, self.window))
+        self.active = active
+        self.apply = apply
+        self.interval = interval
+        self.timeout = timeout
+        self.verbose = verbose
+        self.strikes = 0
+        self.cooldown = 0
+        self.switches = []  # type: list[tuple[str, str]]
+
+    def log(self, msg):
+        # type: (str) -> None
+        import time
+
+        printf("{} {}".format(time.strftime("%Y-%m-%d %H:%M:%S"), msg))
+
+    def probe_all(self):
+        # type: () -> None
+        import threading
+        import time
+
+        threads = []
+        for health in self.healths:
+            t = threading.Thread(target=health.probe, args=(self.timeout,))
+            t.daemon = True
+            t.start()
+            threads.append((t, health))
+        deadline = time.time() + self.timeout * 2
+        for t, health in threads:
+            t.join(max(deadline - time.time(), 0))
+            if t.is_alive():
+                health.samples.append((False, float(self.timeout)))
+
+    def is_degraded(self, health, best):
+        # type: (MirrorHealth, MirrorHealth) -> bool
+        if health.error_rate > self.max_error_rate:
+            return True
+        return health.latency > best.latency * self.slowdown
+
+    def step(self):
+        # type: () -> Optional[str]
+        """Probe once, return the new index url if switched"""
+        self.probe_all()
+        if self.verbose:
+            for health in self.healths:
+                self.log(repr(health))
+        if self.cooldown:
+            self.cooldown -= 1
+            return None
+        current = [i for i in self.healths if i.url == self.active][0]
+        best = min(self.healths, key=lambda i: (i.error_rate, i.latency))
+        if (
+            best is current
+            or not self.is_degraded(current, best)
+            or self.is_degraded(best, best)
+        ):
+            self.strikes = 0
+            return None
+        self.strikes += 1
+        self.log("{} degraded ({}/{})".format(current, self.strikes, self.patience))
+        if self.strikes < self.patience:
+            return None
+        self.log("Switch index url to {}".format(best))
+        self.apply(best.url)
+        self.switches.append((self.active, best.url))
+        self.active = best.url
+        self.strikes = 0
+        self.cooldown = self.window
+        return best.url
+
+    def run(self, rounds=0):
+        # type: (int) -> None
+        """Keep watching until interrupted, or `rounds` rounds finished"""
+        import time
+
+        tip = "Watching {} mirrors, active: {}"
+        self.log(tip.format(len(self.healths), self.active))
+        count = 0
+        try:
+            while True:
+                start = time.time()
+                self.step()
+                count += 1
+                if rounds and count >= rounds:
+                    break
+                time.sleep(max(self.interval - (time.time() - start), 0))
+        except KeyboardInterrupt:
+            self.log("Stopped.")
+
+
+def watch_mirrors(url, extra="", interval=WATCH_INTERVAL, uv=False, **kw):
+    # type: (str, str, float, bool, Any) -> None
+    """Keep the index url of pip(and uv) pointing to a healthy mirror"""
+    configured = PipConfig.list().get("global.index-url")
+
+    def apply(index_url):
+        # type: (str) -> None
+        init_pip_conf(index_url, replace=True, **kw)
+        if uv:
+            init_pip_conf(index_url, replace=True, uv=True, **kw)
+
+    if not configured:
+        apply(url)
+    candidates = speed_test_candidates(extra)
+    verbose = kw.get("verbose", False)
+    MirrorWatcher(configured or url, candidates, apply, interval, verbose=verbose).run()
+
+
+def parse_host(url):
+    # type: (str) -> str
+    return url.split("://", 1)[-1].split("/", 1)[0]
+
+
+def printf(msg):
+    # type: (str) -> None
+    print(msg)
+    sys.stdout.flush()
+
+
+def run_and_echo(cmd, dry=False):
+    # type: (str, bool) -> int
+    printf("--> " + cmd)
+    if dry:
+        if "--verbose" in sys.argv:
+            print("Exit without actually run the shell command!")
+        return 1
+    with Tracer.span("subprocess", cmd) as span:
+        rc = os.system(cmd)
+        span.set(rc=rc)
+    return rc
+
+
+def capture_output(cmd, verbose=False):
+    # type: (str,bool) -> str
+    import subprocess
+
+    if verbose:
+        print("--> {}".format(cmd))
+    with Tracer.span("subprocess", cmd) as span:
+        try:
+            r = subprocess.run(cmd, shell=True, capture_output=True)
+        except (TypeError, AttributeError):  # For python<=3.6
+            with os.popen(cmd) as p:
+                out = p.read().strip()
+            span.set(bytes=len(out))
+            return out
+        span.set(rc=r.returncode, bytes=len(r.stdout))
+        return r.stdout.decode(errors="ignore").strip()
+
+
+def capture_status(cmd):
+    # type: (str) -> tuple[int, str]
+    """Run command by shell, return its exit code and stdout"""
+    import subprocess
+
+    with Tracer.span("subprocess", cmd) as span:
+        p = subprocess.Popen(
+            cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        out = p.communicate()[0]
+        span.set(rc=p.returncode, bytes=len(out))
+    text = out if isinstance(out, str) else out.decode(errors="ignore")
+    return p.returncode, text.strip()
+
+
+def run_concurrently(cmds, verbose=True):
+    # type: (list[str], bool) -> list[tuple[int, str]]
+    """Run independent commands at the same time, results are in the same order.
+
+    Same as `runner.run_many` of carstino, which is not imported here
+    because pip_conf.py should work as a single file.
+    """
+    import threading
+
+    results = [(0, "")] * len(cmds)  # type: list[tuple[int, str]]
+
+    def work(index, cmd):
+        # type: (int, str) -> None
+        results[index] = capture_status(cmd)
+
+    threads = []
+    for index, cmd in enumerate(cmds):
+        if verbose:
+            printf("--> " + cmd)
+        t = threading.Thread(target=work, args=(index, cmd))
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    return results
+
+
+def config_by_cmd(url, is_windows=False, verbose=False, extra_info=None):
+    # type: (str, bool, bool, Optional[tuple[str,str]]) -> None
+    sudo = load_bool("PIP_CONF_SUDO")
+    _config_by_cmd(
+        url,
+        sudo=sudo,
+        is_windows=is_windows,
+        verbose=verbose,
+        extra_info=extra_info,
+    )
+
+
+class ExtraIndex:
+    caching = {}  # type: dict[str, Optional[tuple[str, str]]]
+
+    def __init__(self, host, force=False):
+        self._host = host
+        self._force = force
+
+    def get(self):
+        # type: () -> Optional[tuple[str, str]]
+        host = self._host
+        if not host:
+            return None
+        if host in self.caching:
+            return self.caching[host]
+        value = self.caching[host] = self.get_extra_index(host, self._force)
+        return value
+
+    @staticmethod
+    def get_extra_index(host, force=False):
+        # type: (str, bool) -> Optional[tuple[str, str]]
+        extra_host = ensure_domain_name(host)
+        if not force and not resolve_host(split_port(extra_host)[0]):
+            print("Ignore {} as it's not pingable".format(extra_host))
+            return None
+        if "/" not in host:
+            extra_index_url = INDEX_URL.format(host)
+        else:
+            if not host.startswith("http"):
+                host = "https://" + host
+            if host.endswith("/pypi"):
+                host += "/simple"
+            extra_index_url = host
+        return extra_host, extra_index_url
+
+
+def _config_by_cmd(url, sudo=False, is_windows=False, verbose=False, extra_info=None):
+    # type: (str, bool, bool, bool, Optional[tuple[str,str]]) -> int
     cmd = CONF_PIP + url
     trusted_host = ""
     if extra_info is not None:
@@ -465,38 +1722,41 @@ def smart_detect(source, is_windows, verbose=False):
     if is_windows:
         if verbose:
             printf("Going to detect hw inner ...")
-        if is_hw_inner(True, verbose=verbose):
-            return "hw_inner", True
+        candidates = ["hw_inner"]
     elif not System.is_mac():
         if verbose:
             printf("Going to detect all inner source because of not special ...")
         mirror_map = {
-            "huawei": (is_hw_inner, "hw_inner"),
-            "tencent": (is_tx_cloud_server, "tx_ecs"),
-            "aliyun": (is_ali_cloud_server, "ali_ecs"),
+            "huawei": "hw_inner",
+            "tencent": "tx_ecs",
+            "aliyun": "ali_ecs",
         }
-        mirrors = []
+        candidates = []
         welcome_file = "/etc/motd"
         if os.path.exists(welcome_file):
             with open(welcome_file) as f:
                 msg = f.read().strip()
         else:
-            msg = capture_output(
-                "{} -m pip config list".format(get_python(verbose=verbose))
-            )
+            msg = PipConfig.list_text()
         if msg:
-            mirrors = [v for k, v in mirror_map.items() if k in msg.lower()]
-        if not mirrors:
-            mirrors = list(mirror_map.values())
-        for detect_func, source_name in mirrors:
-            if detect_func(False, verbose=verbose):
-                return source_name, True
+            candidates = [v for k, v in mirror_map.items() if k in msg.lower()]
+        if not candidates:
+            candidates = list(mirror_map.values())
+    else:
+        return source, False
+    pairs = [(name, get_source_host(name)) for name in candidates]
+    if is_fresh_check() and source in SOURCES:
+        pairs.append((source, SOURCES[source]))  # Better than stale inner ones
+    winner = MirrorProbe(pairs, verbose=verbose).run()
+    if winner is not None and winner != source:
+        return winner, True
     return source, False
 
 
 def detect_inner_net(source, verbose=False, is_windows=False):
     # type: (str, bool, bool) -> str
     inner = False
+    origin = source
     is_linux = System.is_linux()
     sys_args = sys.argv[1:]
     if not sys_args or all(i.startswith("-") for i in sys_args):
@@ -520,6 +1780,14 @@ def detect_inner_net(source, verbose=False, is_windows=False):
                 printf("Going to detect tx inner ...")
             inner = is_tx_cloud_server(is_windows, verbose=verbose)
             source = "tx_ecs" if inner else "tx"
+    if (
+        inner
+        and origin != source
+        and is_fresh_check()
+        and Freshness.is_stale(build_index_url(source, force=True))
+    ):
+        print("{} is stale, fallback to {}".format(source, origin))
+        return origin
     if verbose and inner:
         print("Use {} as it's pingable".format(source))
     return source
@@ -570,61 +1838,435 @@ def get_conf_path(is_windows, at_etc):
     return conf_file
 
 
-class PdmMirror:
+class PipConfig:
+    """Read and write pip config files directly, like `pip config` does.
+
+    Running `pip config set` costs one pip startup per key, it's much faster
+    to resolve the file that pip would modify and update it by configparser.
+    """
+
+    section = "global"
+
     @staticmethod
-    def set(url, verify_ssl=False, extra_info=None):
-        # type: (str, bool, Optional[tuple[str,str]]) -> int
-        cmd = "pdm config pypi.url " + url
-        if not verify_ssl:
-            cmd = "pdm config pypi.verify_ssl false && " + cmd
+    def files():
+        # type: () -> list[tuple[str, str]]
+        """Return [(kind, path)] in the order pip loads them, latter wins"""
+        home = os.path.expanduser("~")
+        filename = "pip.ini" if System.is_win() else "pip.conf"
+        if System.is_win():
+            program_data = os.getenv("PROGRAMDATA", r"C:\ProgramData")
+            global_files = [os.path.join(program_data, "pip", filename)]
+            appdata = os.getenv("APPDATA", home)
+            user_files = [os.path.join(appdata, "pip", filename)]
+        else:
+            if System.is_mac():
+                global_files = ["/Library/Application Support/pip/pip.conf"]
+            else:
+                dirs = os.getenv("XDG_CONFIG_DIRS", "/etc/xdg").split(os.pathsep)
+                global_files = [os.path.join(i, "pip", filename) for i in dirs if i]
+            global_files.append(os.path.join("/etc", filename))
+            config_home = os.getenv("XDG_CONFIG_HOME", os.path.join(home, ".config"))
+            new_config = os.path.join(config_home, "pip", filename)
+            if System.is_mac():
+                mac_config = os.path.join(home, "Library/Application Support/pip")
+                if os.path.isdir(mac_config):
+                    new_config = os.path.join(mac_config, filename)
+            user_files = [os.path.join(home, ".pip", filename), new_config]
+        files = [("global", i) for i in global_files]
+        files += [("user", i) for i in user_files]
+        files.append(("site", os.path.join(sys.prefix, filename)))
+        env_file = os.getenv("PIP_CONFIG_FILE")
+        if env_file and env_file != os.devnull:
+            files.append(("env", env_file))
+        return files
+
+    @classmethod
+    def target(cls, at_etc=False):
+        # type: (bool) -> str
+        """The file that `pip config set` will modify"""
+        files = cls.files()
+        if at_etc:
+            return [path for kind, path in files if kind == "global"][-1]
+        site_file = [path for kind, path in files if kind == "site"][0]
+        if os.path.exists(site_file):
+            return site_file
+        return [path for kind, path in files if kind == "user"][-1]
+
+    @staticmethod
+    def load(path):
+        # type: (str) -> Any
+        try:
+            from configparser import RawConfigParser
+        except ImportError:  # For python2
+            from ConfigParser import RawConfigParser  # type:ignore
+        parser = RawConfigParser()
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                text = f.read().decode("utf-8")
+            try:
+                parser.read_string(text)
+            except AttributeError:  # For python2
+                from StringIO import StringIO  # type:ignore
+
+                parser.readfp(StringIO(text))
+        return parser
+
+    @classmethod
+    def list(cls):
+        # type: () -> dict[str, str]
+        """Same as `pip config list`, but without subprocess"""
+        items = {}  # type: dict[str, str]
+        for _, path in cls.files():
+            if os.path.exists(path):
+                parser = cls.load(path)
+                for section in parser.sections():
+                    for key, value in parser.items(section):
+                        items["{}.{}".format(section, key)] = value
+        return items
+
+    @classmethod
+    def list_text(cls):
+        # type: () -> str
+        items = sorted(cls.list().items())
+        return "\n".join("{}={}".format(k, repr(v)) for k, v in items)
+
+    @classmethod
+    def build(cls, path, values):
+        # type: (str, dict[str, str]) -> tuple[str, bool]
+        """Update values of the [global] section, return (text, changed)"""
+        try:
+            from StringIO import StringIO  # type:ignore  # python2
+        except ImportError:
+            from io import StringIO
+        parser = cls.load(path)
+        if not parser.has_section(cls.section):
+            parser.add_section(cls.section)
+        changed = False
+        for key, value in values.items():
+            if key == "trusted-host" and parser.has_option(cls.section, key):
+                hosts = parser.get(cls.section, key).split()
+                hosts += [i for i in value.split() if i not in hosts]
+                value = " ".join(hosts)
+            if not parser.has_option(cls.section, key) or (
+                parser.get(cls.section, key) != value
+            ):
+                parser.set(cls.section, key, value)
+                changed = True
+        buf = StringIO()
+        parser.write(buf)
+        return buf.getvalue().strip(), changed
+
+    @classmethod
+    def plan(cls, url, at_etc=False, extra_info=None):
+        # type: (str, bool, Optional[tuple[str,str]]) -> ConfigPlan
+        values = {"index-url": url}
+        trusted_hosts = []
+        if not url.startswith("https"):
+            trusted_hosts.append(parse_host(url))
         if extra_info is not None:
             extra_host, extra_index_url = extra_info
-            cmd += " && pdm config pypi.extra.url " + extra_index_url
-            if extra_index_url.startswith("https:") and not verify_ssl:
-                cmd += " && pdm config pypi.extra.verify_ssl false"
-        return run_and_echo(cmd, dry="--dry" in sys.argv)
+            values["extra-index-url"] = extra_index_url
+            if not extra_index_url.startswith("https"):
+                trusted_hosts.append(extra_host)
+        if trusted_hosts:
+            values["trusted-host"] = " ".join(trusted_hosts)
+        path = cls.target(at_etc)
+        text, changed = cls.build(path, values)
+        if not changed:
+            return ConfigPlan("pip", path, skip="already set")
+        return ConfigPlan("pip", path, text)
 
 
-class Mirror:
-    def __init__(self, url, is_windows, replace, extra_info=None, verbose=False):
-        # type: (str, bool, bool, Optional[tuple[str, str]], bool) -> None
-        self.url = url
-        self.is_windows = is_windows
-        self.replace = replace
-        self._version = ""
-        self._extra_info = extra_info
-        self.verbose = verbose
+def config_by_file(url, at_etc=False, verbose=False, extra_info=None):
+    # type: (str, bool, bool, Optional[tuple[str,str]]) -> bool
+    """Set index url to the pip config file that `pip config set` would use
+
+    :return: False if the file can not be parsed or written
+    """
+    try:
+        plan = PipConfig.plan(url, at_etc, extra_info)
+    except Exception as e:
+        if verbose:
+            print("Failed to parse pip config file: {}".format(e))
+        return False
+    if plan.skip:
+        print("Pip source already be configured as expected.\nSkip!")
+        return True
+    if "--dry" in sys.argv:
+        print("Will write lines to `{}` as below:\n{}\n".format(plan.path, plan.text))
+        return True
+    try:
+        plan.apply()
+    except (IOError, OSError) as e:
+        if verbose:
+            print("Failed to write {}: {}".format(plan.path, e))
+        return False
+    return True
+
+
+class TomlSection(object):
+    """A `[table]`/`[[array]]` (or the root one, whose name is '') of toml"""
+
+    key_pattern = re.compile(r"""\s*([\w.-]+|"[^"]*")\s*=\s*(.*)$""")
+
+    def __init__(self, name="", is_array=False, lines=None):
+        # type: (str, bool, Optional[list[str]]) -> None
+        self.name = name
+        self.is_array = is_array
+        self.lines = lines if lines is not None else []  # Without the header
 
     @property
-    def tool(self):
+    def header(self):
         # type: () -> str
-        return self.__class__.__name__.replace("Mirror", "").lower()
+        if not self.name:
+            return ""
+        return "[[{}]]".format(self.name) if self.is_array else "[{}]".format(self.name)
 
-    def prompt_y(self, filename, content):
-        print("The {}'s {} content:".format(self.tool, filename))
-        print(content)
-        print('If you want to replace it, rerun with "-y" in args.')
-        print("Exit!")
+    def find(self, key):
+        # type: (str) -> tuple[int, int]
+        """Return (start, end) line index of the key, (-1, -1) if not found"""
+        index = 0
+        while index < len(self.lines):
+            line = self.lines[index]
+            m = None if line.lstrip().startswith("#") else self.key_pattern.match(line)
+            end = index + 1
+            if m is not None:
+                value = m.group(2)
+                if value.startswith("["):  # Multi-line array
+                    depth = value.count("[") - value.count("]")
+                    while depth > 0 and end < len(self.lines):
+                        depth += self.lines[end].count("[") - self.lines[end].count("]")
+                        end += 1
+                elif value[:3] in ('"""', "'''") and value.count(value[:3]) == 1:
+                    while end < len(self.lines) and value[:3] not in self.lines[end]:
+                        end += 1
+                    end += 1
+                if m.group(1).strip('"') == key:
+                    return index, end
+            index = end
+        return -1, -1
 
-    def check_installed(self):
-        # type: () -> Optional[bool]
-        if self.tool == "poetry":
-            not_install = run_and_echo(self.tool + " check --quiet") > 256
+    def get(self, key):
+        # type: (str) -> Any
+        start, end = self.find(key)
+        if start < 0:
+            return None
+        text = "\n".join(self.lines[start:end]).split("=", 1)[1]
+        return load_toml_value(text)
+
+    def set(self, key, value):
+        # type: (str, Any) -> bool
+        """Set value of the key, return True if anything changed"""
+        start, end = self.find(key)
+        if start >= 0 and self.get(key) == value:
+            return False
+        line = "{} = {}".format(key, dump_toml_value(value))
+        if start >= 0:
+            self.lines[start:end] = [line]
         else:
-            not_install = run_and_echo(self.tool + " --version") != 0
-        if not_install:
-            setup_pipx = "pip install --user --upgrade pipx"
-            if System.is_linux():
-                for command in ("apt", "yum"):
-                    if is_command_exists(command):
-                        setup_pipx = "sudo {} install -y pipx".format(command)
-                        break
-            msg = (
-                "{0} not found!\n"
-                "You can install it by:\n"
-                "    {1}\n"
-                "    pipx install {0}\n"
-            )
+            index = len(self.lines)
+            while index and not self.lines[index - 1].strip():
+                index -= 1  # Keep blank lines between sections
+            self.lines.insert(index, line)
+        return True
+
+
+def load_toml_value(text):
+    # type: (str) -> Any
+    text = re.sub(r"\s+#[^\"\']*$", "", text.strip())
+    if text in ("true", "false"):
+        return text == "true"
+    if text.startswith("["):
+        return [i or j for i, j in re.findall(r'"([^"]*)"|\'([^\']*)\'', text)]
+    if text[:1] in ('"', "'"):
+        return text[1:-1]
+    return text
+
+
+def dump_toml_value(value):
+    # type: (Any) -> str
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (list, tuple)):
+        return "[{}]".format(", ".join(dump_toml_value(i) for i in value))
+    return '"{}"'.format(str(value).replace("\\", "\\\\").replace('"', '\\"'))
+
+
+class TomlDocument(object):
+    """Minimal toml editor that only touches the changed keys.
+
+    Comments, blank lines and unrelated keys are kept as they are, so that
+    config files written by users can be updated safely.
+    """
+
+    header_pattern = re.compile(r"\s*(\[\[?)\s*([^\]]+?)\s*\]\]?\s*(#.*)?$")
+
+    def __init__(self, text=""):
+        # type: (str) -> None
+        self.sections = [TomlSection()]
+        for line in text.splitlines():
+            m = self.header_pattern.match(line)
+            if m is None:
+                self.sections[-1].lines.append(line)
+            else:
+                section = TomlSection(m.group(2), m.group(1) == "[[")
+                self.sections.append(section)
+        self.changed = False
+
+    @classmethod
+    def load(cls, path):
+        # type: (str) -> TomlDocument
+        if not os.path.exists(path):
+            return cls()
+        with open(path, "rb") as f:
+            return cls(f.read().decode("utf-8"))
+
+    @property
+    def root(self):
+        # type: () -> TomlSection
+        return self.sections[0]
+
+    def tables(self, name):
+        # type: (str) -> list[TomlSection]
+        return [i for i in self.sections if i.name == name]
+
+    def table(self, name, is_array=False):
+        # type: (str, bool) -> TomlSection
+        """Get the table, add a new one if not found (or `is_array` is True)"""
+        if not is_array:
+            for section in self.tables(name):
+                return section
+        section = TomlSection(name, is_array)
+        last = self.sections[-1]
+        if last.lines and last.lines[-1].strip():
+            last.lines.append("")
+        self.sections.append(section)
+        self.changed = True
+        return section
+
+    def set(self, section, key, value):
+        # type: (TomlSection, str, Any) -> None
+        if section.set(key, value):
+            self.changed = True
+
+    def dumps(self):
+        # type: () -> str
+        lines = []  # type: list[str]
+        for section in self.sections:
+            if section.header:
+                lines.append(section.header)
+            lines.extend(section.lines)
+        return "\n".join(lines).strip("\n")
+
+
+class ConfigPlan(object):
+    """A pending change of mirror config: a file to write or a command to run"""
+
+    def __init__(self, tool, path="", text="", command="", skip="", failed=False):
+        # type: (str, str, str, str, str, bool) -> None
+        self.echo = True  # Print the content that written to file
+        self.tool = tool
+        self.path = path
+        self.text = text
+        self.command = command
+        self.skip = skip  # Reason of not to change anything
+        self.failed = failed
+        self.status = ""
+
+    def apply(self):
+        # type: () -> Optional[int]
+        if self.failed:
+            self.status = "failed: " + self.skip
+            return 1
+        if self.skip:
+            self.status = "skipped: " + self.skip
+            return None
+        if "--dry" in sys.argv:
+            if self.command:
+                run_and_echo(self.command, dry=True)
+            else:
+                tip = "Will write lines to `{}` as below:\n{}\n"
+                print(tip.format(self.path, self.text))
+            self.status = "dry-run"
+            return None
+        if self.command:
+            rc = run_and_echo(self.command)
+            self.status = "failed" if rc else "configured"
+            return rc
+        dirpath = os.path.dirname(self.path)
+        if dirpath and not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+        do_write(self.path, self.text, self.echo)
+        self.status = "written"
+        return None
+
+
+class PdmMirror:
+    @staticmethod
+    def plan(url, verify_ssl=False, extra_info=None):
+        # type: (str, bool, Optional[tuple[str,str]]) -> ConfigPlan
+        cmd = "pdm config pypi.url " + url
+        if not verify_ssl:
+            cmd = "pdm config pypi.verify_ssl false && " + cmd
+        if extra_info is not None:
+            extra_host, extra_index_url = extra_info
+            cmd += " && pdm config pypi.extra.url " + extra_index_url
+            if extra_index_url.startswith("https:") and not verify_ssl:
+                cmd += " && pdm config pypi.extra.verify_ssl false"
+        return ConfigPlan("pdm", command=cmd)
+
+    @classmethod
+    def set(cls, url, verify_ssl=False, extra_info=None):
+        # type: (str, bool, Optional[tuple[str,str]]) -> Optional[int]
+        return cls.plan(url, verify_ssl, extra_info).apply()
+
+
+class Mirror:
+    def __init__(self, url, is_windows, replace, extra_info=None, verbose=False):
+        # type: (str, bool, bool, Optional[tuple[str, str]], bool) -> None
+        self.url = url
+        self.is_windows = is_windows
+        self.replace = replace
+        self._version = ""
+        self._extra_info = extra_info
+        self.verbose = verbose
+        self.detected = False  # Set to be True if command was found by detect_tools
+
+    @property
+    def tool(self):
+        # type: () -> str
+        return self.__class__.__name__.replace("Mirror", "").lower()
+
+    def prompt_y(self, filename, content):
+        print("The {}'s {} content:".format(self.tool, filename))
+        print(content)
+        print('If you want to replace it, rerun with "-y" in args.')
+        print("Exit!")
+
+    def check_installed(self, rc=None):
+        # type: (Optional[int]) -> Optional[bool]
+        """:param rc: exit code of the check command if it has been run"""
+        if self.detected:
+            return None
+        if rc is not None:
+            not_install = rc > 1 if self.tool == "poetry" else rc != 0
+        elif self.tool == "poetry":
+            not_install = run_and_echo(self.tool + " check --quiet") > 256
+        else:
+            not_install = run_and_echo(self.tool + " --version") != 0
+        if not_install:
+            setup_pipx = "pip install --user --upgrade pipx"
+            if System.is_linux():
+                for command in ("apt", "yum"):
+                    if is_command_exists(command):
+                        setup_pipx = "sudo {} install -y pipx".format(command)
+                        break
+            msg = (
+                "{0} not found!\n"
+                "You can install it by:\n"
+                "    {1}\n"
+                "    pipx install {0}\n"
+            )
             print(msg.format(self.tool, setup_pipx))
             return True
 
@@ -635,16 +2277,8 @@ class UvMirror(Mirror):
     PYTHON_DOWNLOAD_URL = (
         "https://github.com/astral-sh/python-build-standalone/releases/download"
     )
-    TEMPLATE = 'python-install-mirror = "{}"'
     _python = False
 
-    @staticmethod
-    def allow_insecure(url):
-        # type: (str) -> str
-        if url.startswith("https"):
-            return ""
-        return '\nallow-insecure-host=["{}"]'.format(parse_host(url))
-
     @classmethod
     def _get_python_mirror(cls, default):
         # type: (str) -> str
@@ -677,94 +2311,82 @@ class UvMirror(Mirror):
     def python_install_mirror(cls):
         # type: () -> str
         default = cls.GITHUB_PROXY + cls.PYTHON_DOWNLOAD_URL
-        return cls.TEMPLATE.format(cls._get_python_mirror(default))
-
-    def build_content(self, url=None, extra_index=None):
-        # type: (Optional[str], Optional[str]) -> str
-        if url is None:
-            url = self.url
-        text = '[[index]]\nurl = "{}"\ndefault = true'.format(
-            url
-        ) + self.allow_insecure(url)
-        if extra_index is None and self._extra_info is not None:
-            _, extra_index = self._extra_info
-        if extra_index:
-            text += '\n[[index]]\nurl = "{}"'.format(extra_index) + self.allow_insecure(
-                extra_index
-            )
-        return self.set_python(text)
+        return cls._get_python_mirror(default)
 
-    def set_python(self, text):
-        # type: (str) -> str
+    def update(self, doc, table=""):
+        # type: (TomlDocument, str) -> Optional[str]
+        """Apply the mirror settings to the uv.toml document
+
+        :param table: 'tool.uv' to update the pyproject.toml of a project
+        :return: the index url that is going to be replaced
+        """
+        # The [tool.uv] table is only added when a key is going to be set to it
+        found = doc.tables(table) if table else [doc.root]
+        root = found[0] if found else TomlSection(table)
+        index_name = table + ".index" if table else "index"
+        urls = [self.url]
+        extra_index = self._extra_info[1] if self._extra_info is not None else ""
+        if root.get("index-url") is not None:  # Legacy style
+            already = root.get("index-url")
+            doc.set(root, "index-url", self.url)
+            if extra_index:
+                doc.set(root, "extra-index-url", [extra_index])
+        else:
+            indexes = doc.tables(index_name)
+            defaults = [i for i in indexes if i.get("default")]
+            if defaults:
+                index = defaults[0]
+                already = index.get("url")
+            else:
+                index = doc.table(index_name, is_array=True)
+                already = None
+            doc.set(index, "url", self.url)
+            doc.set(index, "default", True)
+            if extra_index and extra_index not in [i.get("url") for i in indexes]:
+                doc.set(doc.table(index_name, is_array=True), "url", extra_index)
+        if extra_index:
+            urls.append(extra_index)
+        hosts = root.get("allow-insecure-host") or []
+        for url in urls:
+            if not url.startswith("https") and parse_host(url) not in hosts:
+                hosts.append(parse_host(url))
+        if hosts or self._python:
+            root = doc.table(table) if table else root
+        if hosts:
+            doc.set(root, "allow-insecure-host", hosts)
         if self._python:
-            py_mirror = self.python_install_mirror()
-            if py_mirror not in text:
-                item_key = self.TEMPLATE.split("=")[0].strip()
-                lines = text.splitlines()
-                for idx, line in enumerate(lines):
-                    if line.startswith(item_key):
-                        lines[idx] = py_mirror
-                        text = "\n".join(lines)
-                        break
-                else:
-                    text = py_mirror + "\n\n" + text
-        return text
+            doc.set(root, "python-install-mirror", self.python_install_mirror())
+        return already if already != self.url else None
 
-    def set(self, set_python_mirror=False):
-        # type: (bool) -> Optional[int]
-        verbose = self.verbose
+    def build_content(self):
+        # type: () -> str
+        doc = TomlDocument()
+        self.update(doc)
+        return doc.dumps()
+
+    def plan(self, set_python_mirror=False):
+        # type: (bool) -> ConfigPlan
         self._python = set_python_mirror
         filename = "uv.toml"
         dirpath = self.get_dirpath(self.is_windows, self.url, filename)
         if not dirpath:
-            return 1
+            return ConfigPlan(self.tool, skip="not installed", failed=True)
         config_toml_path = os.path.join(dirpath, filename)
-        text = self.build_content()
-        if os.path.exists(config_toml_path):
-            with open(config_toml_path, "rb") as f:
-                content = f.read().strip().decode("utf-8")
-            if text in content:
-                print("uv mirror set as expected. Skip!")
-                return None
-            if "index-url" in content:
-                pattern = r'index-url\s*=\s*"([^"]*)"'
-                m = re.search(pattern, content, re.S)
-                if m:
-                    already = m.group(1)
-                    if not self.replace:
-                        self.prompt_y(filename, m.group())
-                        return None
-                    if self.url.startswith("https"):
-                        text = self.set_python(content.replace(already, self.url))
-            elif "[[index]]" in content:
-                pattern = r'url\s*=\s*"([^"]*)"'
-                m = re.search(pattern, content, re.S)
-                if m:
-                    already = m.group(1)
-                    if not self.replace:
-                        if verbose:
-                            print("\nExpected config:\n```\n{}\n```\n".format(text))
-                        self.prompt_y(filename, m.group())
-                        return None
-                    if content.count("[[index]]") == text.count("[[index]]") == 1:
-                        text = self.set_python(content.replace(already, self.url))
-                    else:
-                        py_mirror_key = self.TEMPLATE.split("=")[0].strip()
-                        if py_mirror_key not in text and py_mirror_key in content:
-                            for line in content.splitlines():
-                                if line.startswith(py_mirror_key):
-                                    text = line + "\n\n" + text
-                                    break
-        elif not os.path.exists(dirpath):
-            parent = get_parent_path(dirpath)
-            if not os.path.exists(parent):
-                os.mkdir(parent)
-                if verbose:
-                    print("{} created.".format(parent))
-            os.mkdir(dirpath)
-            if verbose:
-                print("{} created.".format(dirpath))
-        do_write(config_toml_path, text)
+        doc = TomlDocument.load(config_toml_path)
+        already = self.update(doc)
+        if not doc.changed:
+            print("uv mirror set as expected. Skip!")
+            return ConfigPlan(self.tool, config_toml_path, skip="already set")
+        if already and not self.replace:
+            if self.verbose:
+                print("\nExpected config:\n```\n{}\n```\n".format(doc.dumps()))
+            self.prompt_y(filename, 'url = "{}"'.format(already))
+            return ConfigPlan(self.tool, config_toml_path, skip="exists")
+        return ConfigPlan(self.tool, config_toml_path, doc.dumps())
+
+    def set(self, set_python_mirror=False):
+        # type: (bool) -> Optional[int]
+        return self.plan(set_python_mirror).apply()
 
     def _get_dirpath(self, is_windows, filename, is_etc=False):
         # type: (bool, str, bool) -> str
@@ -842,166 +2464,1126 @@ class PoetryMirror(Mirror):
         self.fix_poetry_v1_6_error(self._version)
         return self._version
 
-    @staticmethod
-    def get_poetry_version():
-        # type: () -> str
-        v = capture_output("poetry --version")
-        return v.replace("Poetry (version ", "")
+    @staticmethod
+    def get_poetry_version(output=None):
+        # type: (Optional[str]) -> str
+        if output is None:
+            output = capture_output("poetry --version")
+        return output.replace("Poetry (version ", "")
+
+    @staticmethod
+    def unset():
+        # type: () -> None
+        print("By pipx:\n", "pipx runpip poetry uninstall <plugin-name>")
+        print("By poetry self:\n", "poetry self remove <plugin-name>")
+
+    def set_self_pypi_mirror(self, is_windows, url):
+        # type: (bool, str) -> None
+        config_path = self._get_dirpath(is_windows)
+        if not os.path.exists(os.path.join(config_path, "pyproject.toml")):
+            try:
+                from poetry.console.commands.self.self_command import (  # type:ignore
+                    SelfCommand,
+                )
+            except ImportError:
+                pass
+            else:
+                SelfCommand().generate_system_pyproject()
+        cmds = [
+            "cd {}".format(config_path),
+            "poetry source add -v --priority=default pypi_mirror {}".format(url),
+        ]
+        run_and_echo(" && ".join(cmds), dry="--dry" in sys.argv)
+
+    def get_dirpath(self, is_windows, url):
+        # type: (bool, str) -> Optional[str]
+        # Each poetry command takes a while to start, so run them together
+        checks = ["poetry self show plugins", "pipx --version"]
+        if not self.detected:
+            checks.append("poetry check --quiet")
+        if not self._version and System.is_mac():
+            checks.append("poetry --version")
+        results = dict(zip(checks, run_concurrently(checks)))  # NOQA:B905 python2
+        if "poetry --version" in results:
+            self._version = self.get_poetry_version(results["poetry --version"][1])
+        rc = None if self.detected else results["poetry check --quiet"][0]
+        if self.check_installed(rc):
+            return None
+        plugins = results["poetry self show plugins"][1]
+        mirror_plugin = self.plugin_name
+        if mirror_plugin not in plugins:
+            if results["pipx --version"][0] == 0:
+                install_plugin = "pipx inject poetry "
+            else:
+                self.set_self_pypi_mirror(is_windows, url)
+                install_plugin = "poetry self add "
+            dry = "--dry" in sys.argv
+            if run_and_echo(install_plugin + mirror_plugin, dry=dry) != 0:
+                print("Failed to install plugin: {}".format(repr(mirror_plugin)))
+                return None
+            if not load_bool("PIP_CONF_NO_EXTRA_POETRY_PLUGINS"):
+                cmd = install_plugin + " ".join(self.extra_plugins)
+                run_and_echo(cmd, dry=dry)
+        return self._get_dirpath(is_windows)
+
+    def _get_dirpath(self, is_windows):
+        # type: (bool) -> str
+        dirpath = "~/Library/Application Support/pypoetry/"
+        if is_windows:
+            dirpath = os.getenv("APPDATA", "") + "/pypoetry/"
+        elif not System.is_mac():
+            dirpath = "~/.config/pypoetry/"
+        elif self.poetry_version < "1.5":
+            dirpath = "~/Library/Preferences/pypoetry/"
+        return os.path.expanduser(dirpath)
+
+    def plan(self):
+        # type: () -> ConfigPlan
+        filename = "config.toml"
+        dirpath = self.get_dirpath(self.is_windows, self.url)
+        if not dirpath:
+            return ConfigPlan(self.tool, skip="not installed", failed=True)
+        config_toml_path = os.path.join(dirpath, filename)
+        doc = TomlDocument.load(config_toml_path)
+        table = doc.table("plugins.pypi_mirror")
+        already = table.get("url")
+        doc.set(table, "url", self.url)
+        if not doc.changed:
+            print("poetry mirror set as expected. Skip!")
+            return ConfigPlan(self.tool, config_toml_path, skip="already set")
+        if already and not self.replace:
+            content = '{}\nurl = "{}"'.format(table.header, already)
+            self.prompt_y(filename, content)
+            return ConfigPlan(self.tool, config_toml_path, skip="exists")
+        return ConfigPlan(self.tool, config_toml_path, doc.dumps())
+
+    def set(self):
+        # type: () -> Optional[int]
+        return self.plan().apply()
+
+
+def init_pip_conf(
+    url,
+    replace=False,
+    at_etc=False,
+    write=False,
+    poetry=False,
+    pdm=False,
+    verbose=False,
+    uv=False,
+    is_windows=False,
+    verify_ssl=False,
+    set_python_mirror=False,
+    extra_info=None,
+):
+    # type: (str, bool, bool, bool, bool, bool, bool, bool, bool, bool, bool, Optional[tuple[str,str]]) -> Optional[int]
+    if poetry:
+        return PoetryMirror(url, is_windows, replace, extra_info=extra_info).set()
+    poetry_set_env = "SET_POETRY"
+    if load_bool(poetry_set_env):
+        env_name = "PIP_CONF_POETRY_MIRROR"
+        v = os.getenv(env_name)
+        if v:
+            tip = "Poetry mirror source will be set to {}"
+            print(tip.format(repr(v)))
+            url = build_index_url(
+                v, force=True, verbose=True, strict=True, is_windows=is_windows
+            )
+            replace = True
+        elif verbose:
+            tip = "Going to configure poetry mirror source, because {} was set to {}"
+            print(tip.format(repr(poetry_set_env), os.getenv(poetry_set_env)))
+        return PoetryMirror(url, is_windows, replace, extra_info=extra_info).set()
+    if pdm or load_bool("PIP_CONF_SET_PDM"):
+        return PdmMirror.set(url, verify_ssl, extra_info=extra_info)
+    if uv or load_bool("PIP_CONF_SET_UV"):
+        set_python_mirror = set_python_mirror or load_bool("PIP_CONF_PYTHON_MIRROR")
+        return UvMirror(
+            url, is_windows, replace, extra_info=extra_info, verbose=verbose
+        ).set(set_python_mirror)
+    if not write and (not at_etc or is_windows):
+        if not load_bool("PIP_CONF_SUDO") and config_by_file(
+            url, at_etc, verbose=verbose, extra_info=extra_info
+        ):
+            return None
+        if can_set_global():  # Fallback to `pip config set ...`
+            config_by_cmd(url, is_windows, verbose=verbose, extra_info=extra_info)
+            return None
+    return plan_pip_conf(url, replace, at_etc, is_windows, extra_info).apply()
+
+
+def plan_pip_conf(url, replace=False, at_etc=False, is_windows=False, extra_info=None):
+    # type: (str, bool, bool, bool, Optional[tuple[str,str]]) -> ConfigPlan
+    text = TEMPLATE.format(url, parse_host(url))
+    if extra_info is not None:
+        extra_host, extra_index_url = extra_info
+        text = text.replace(
+            "\ntrusted-host = {}".format(parse_host(url)),
+            "\nextra-index-url = {}\ntrusted-host = {} {}".format(
+                extra_index_url, parse_host(url), extra_host
+            ),
+        )
+    conf_file = get_conf_path(is_windows, at_etc)
+    if os.path.exists(conf_file):
+        with open(conf_file, "rb") as fp:
+            s = fp.read().decode("utf-8")
+        if text in s:
+            print("Pip source already be configured as expected.\nSkip!")
+            return ConfigPlan("pip", conf_file, skip="already set")
+        if not replace:
+            print("The pip file {} exists! content:".format(conf_file))
+            print(s)
+            print('If you want to replace it, rerun with "-y" in args.\nExit!')
+            return ConfigPlan("pip", conf_file, skip="exists")
+    return ConfigPlan("pip", conf_file, text)
+
+
+def shell_quote(s):
+    # type: (str) -> str
+    try:
+        from shlex import quote
+    except ImportError:  # For python2
+        from pipes import quote  # type:ignore
+    return quote(s)
+
+
+class FleetHost(object):
+    def __init__(self, line, args):
+        # type: (str, list[str]) -> None
+        parts = line.split()
+        self.host = parts[0]
+        self.args = parts[1:] or args  # Args at the inventory line win
+        self.returncode = None  # type: Optional[int]
+        self.output = ""
+        self.cost = 0.0
+
+    def build_command(self, ssh):
+        # type: (str) -> list[str]
+        import shlex
+
+        cmd = shlex.split(ssh)
+        host, port = split_port(self.host)
+        if port is not None:
+            cmd += ["-p", str(port)]
+        env = "PIP_CONF_ARGS={}".format(shell_quote(" ".join(self.args)))
+        remote = "{} $(command -v python3 || command -v python) -".format(env)
+        return cmd + [host, remote]
+
+    def to_dict(self):
+        # type: () -> dict[str, Any]
+        return {
+            "host": self.host,
+            "args": self.args,
+            "returncode": self.returncode,
+            "cost": round(self.cost, 3),
+            "output": self.output,
+        }
+
+
+class Fleet(object):
+    """Run this script on many hosts at the same time through ssh.
+
+    The script is sent by stdin and its arguments by env `PIP_CONF_ARGS`, so
+    nothing need to be uploaded to the remote hosts. Inventory file contains
+    one host per line: `[user@]host[:port] [args for this host]`
+    """
+
+    timeout = FLEET_TIMEOUT
+
+    def __init__(self, inventory, args, ssh="", jobs=10, verbose=False):
+        # type: (str, list[str], str, int, bool) -> None
+        self.hosts = []  # type: list[FleetHost]
+        for line in read_lines(inventory):
+            line = line.split("#", 1)[0].strip()
+            if line:
+                self.hosts.append(FleetHost(line, args))
+        self.ssh = ssh or os.getenv("PIP_CONF_SSH") or FLEET_SSH
+        self.jobs = max(jobs, 1)
+        self.verbose = verbose
+        with open(os.path.abspath(__file__), "rb") as f:
+            self.script = f.read()
+
+    def run_one(self, item):
+        # type: (FleetHost) -> None
+        import subprocess
+        import threading
+        import time
+
+        cmd = item.build_command(self.ssh)
+        if self.verbose:
+            printf("--> " + " ".join(shell_quote(i) for i in cmd))
+        start = time.time()
+        with Tracer.span("subprocess", item.host) as span:
+            try:
+                p = subprocess.Popen(
+                    cmd,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                )
+            except OSError as e:
+                item.returncode, item.output = 127, str(e)
+            else:
+                timer = threading.Timer(self.timeout, p.kill)
+                timer.start()
+                try:
+                    out, _ = p.communicate(self.script)
+                finally:
+                    timer.cancel()
+                item.returncode = p.returncode
+                item.output = out.decode("utf-8", "replace").strip()
+            span.set(rc=item.returncode, bytes=len(item.output))
+        item.cost = time.time() - start
+        status = "OK" if item.returncode == 0 else "FAILED"
+        printf("[{}] {} ({:.1f}s)".format(status, item.host, item.cost))
+
+    def run(self):
+        # type: () -> list[FleetHost]
+        import threading
+
+        try:
+            from queue import Empty, Queue
+        except ImportError:  # For python2
+            from Queue import Empty, Queue  # type:ignore
+
+        q = Queue()  # type: Queue[FleetHost]
+        for item in self.hosts:
+            q.put(item)
+
+        def worker():
+            # type: () -> None
+            while True:
+                try:
+                    item = q.get_nowait()
+                except Empty:
+                    return
+                self.run_one(item)
+
+        threads = [threading.Thread(target=worker) for _ in range(self.jobs)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return self.hosts
+
+    def report(self, path=""):
+        # type: (str) -> int
+        failed = [i for i in self.hosts if i.returncode != 0]
+        print("Summary: {} hosts, {} failed".format(len(self.hosts), len(failed)))
+        for item in self.hosts:
+            lines = item.output.splitlines()
+            line = "  {:<30}{:<6}{:>7.1f}s  {}".format(
+                item.host, item.returncode, item.cost, lines[-1] if lines else ""
+            )
+            print(line.rstrip())
+        if path:
+            import json
+
+            with open(path, "w") as f:
+                json.dump([i.to_dict() for i in self.hosts], f, indent=2)
+            print("Report saved to {}".format(path))
+        return 1 if failed else 0
+
+
+def strip_options(argv, options):
+    # type: (list[str], tuple[str, ...]) -> list[str]
+    """Remove options and their values from argv"""
+    args = []  # type: list[str]
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg.split("=", 1)[0] in options:
+            skip = arg in options  # Value is the next arg when no '='
+        else:
+            args.append(arg)
+    return args
+
+
+def normalize_name(name):
+    # type: (str) -> str
+    """PEP 503 normalized project name"""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+class ProxyCache(object):
+    """Pages and files of the proxy stored on disk, the least recently used
+    ones are removed when the total size exceeds `max_bytes`.
+    """
+
+    def __init__(self, dirpath, max_bytes):
+        # type: (str, int) -> None
+        import threading
+        from collections import OrderedDict
+
+        self.dirpath = dirpath
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # type: OrderedDict[str, int]
+        self.size = 0
+        self.lock = threading.Lock()
+        if not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+        names = [i for i in os.listdir(dirpath) if i.endswith(".json")]
+        metas = [os.path.join(dirpath, i) for i in names]
+        for meta in sorted(metas, key=os.path.getmtime):  # Oldest first
+            name = meta[: -len(".json")]
+            if os.path.exists(name):
+                self.entries[name] = os.path.getsize(name)
+                self.size += self.entries[name]
+
+    def path(self, key):
+        # type: (str) -> str
+        import hashlib
+
+        return os.path.join(self.dirpath, hashlib.sha1(key.encode()).hexdigest())
+
+    def open(self, key):
+        # type: (str) -> Optional[tuple[dict[str, Any], Any]]
+        """:return: (meta, opened file) of the key, the caller should close it"""
+        import json
+
+        path = self.path(key)
+        with self.lock:
+            if path not in self.entries:
+                return None
+            self.entries[path] = self.entries.pop(path)  # Most recently used
+        try:
+            with open(path + ".json") as f:
+                meta = json.load(f)
+            os.utime(path + ".json", None)  # Keep the order after restart
+            return meta, open(path, "rb")
+        except (IOError, OSError, ValueError):
+            return None
+
+    def get(self, key):
+        # type: (str) -> Optional[tuple[dict[str, Any], bytes]]
+        cached = self.open(key)
+        if cached is None:
+            return None
+        meta, fileobj = cached
+        with fileobj:
+            return meta, fileobj.read()
+
+    def tmp_path(self):
+        # type: () -> str
+        """A new file to write the body into before `commit` it"""
+        import tempfile
+
+        fd, tmp = tempfile.mkstemp(".tmp", dir=self.dirpath)
+        os.close(fd)
+        return tmp
+
+    def set(self, key, body, meta):
+        # type: (str, bytes, dict[str, Any]) -> dict[str, Any]
+        tmp = self.tmp_path()
+        with open(tmp, "wb") as f:
+            f.write(body)
+        return self.commit(key, tmp, meta)
+
+    def commit(self, key, tmp, meta, sha256=""):
+        # type: (str, str, dict[str, Any], str) -> dict[str, Any]
+        """Move the written tmp file to the cache of key, and evict old ones"""
+        import contextlib
+        import json
+
+        etag = (sha256 or file_sha256(tmp))[:32]
+        meta = dict(meta, key=key, etag=etag)
+        path = self.path(key)
+        size = os.path.getsize(tmp)
+        with self.lock:
+            replace_file(tmp, path)
+            with open(tmp, "w") as f:
+                json.dump(meta, f)
+            replace_file(tmp, path + ".json")
+            self.size += size - self.entries.pop(path, 0)
+            self.entries[path] = size
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                oldest = next(iter(self.entries))
+                self.size -= self.entries.pop(oldest)
+                for name in (oldest, oldest + ".json"):
+                    # Not exists, or being served on Windows
+                    with contextlib.suppress(OSError):
+                        os.remove(name)
+        return meta
+
+
+class PypiProxy(object):
+    """Pull-through cache of the simple index of upstream mirrors.
+
+    Links of project pages are rewritten to `/packages/<project>/<filename>`,
+    so that a file can be fetched from any of the upstreams: the first one
+    that responds wins, the others are tried in order if it failed. Project
+    pages are refreshed after `page_ttl` seconds, and the stale one is still
+    served when no upstream is reachable. Files are immutable once cached.
+    """
+
+    page_ttl = 600
+    accept = "text/html"
+
+    def __init__(
+        self, upstreams, cache, timeout=PROBE_TIMEOUT * 6, verbose=False, wheelhouse=""
+    ):
+        # type: (list[str], ProxyCache, float, bool, str) -> None
+        self.upstreams = upstreams
+        self.cache = cache
+        self.timeout = timeout
+        self.verbose = verbose
+        self.wheelhouse = wheelhouse  # Files prefetched from lock files
+
+    def log(self, msg):
+        # type: (str) -> None
+        if self.verbose:
+            printf(msg)
+
+    def fetch(self, url, fileobj=None):
+        # type: (str, Any) -> Optional[tuple[bytes, str, str]]
+        """:return: (body, content type, final url), None if not found"""
+        headers = {"Accept": self.accept}
+        status, content_type, body, url = http_get(
+            url, self.timeout, headers=headers, fileobj=fileobj
+        )
+        self.log("GET {} -> {}".format(url, status))
+        if status != 200:
+            return None
+        return body, content_type, url
+
+    def fetch_upstreams(self, path):
+        # type: (str) -> Optional[tuple[bytes, str, str]]
+        for base in self.upstreams:
+            try:
+                result = self.fetch(urljoin(base, path))
+            except Exception as e:
+                self.log("Failed to fetch {} from {}: {}".format(path, base, e))
+                continue
+            if result is not None:
+                return result
+        return None
+
+    def rewrite(self, project, page_url, html):
+        # type: (str, str, str) -> tuple[str, dict[str, str]]
+        """Point links to this proxy, return the page and {filename: url}"""
+        links = {}  # type: dict[str, str]
+
+        def repl(m):
+            # type: (Any) -> str
+            href, _, fragment = m.group(1).partition("#")
+            url = urljoin(page_url, href.replace("&amp;", "&"))
+            filename = url.split("?")[0].rstrip("/").rsplit("/", 1)[-1]
+            links[filename] = url
+            new = "/packages/{}/{}".format(project, filename)
+            return 'href="{}"'.format(new + "#" + fragment if fragment else new)
+
+        return re.sub(r'href="([^"]+)"', repl, html), links
+
+    def get_root(self):
+        # type: () -> Optional[tuple[dict[str, Any], bytes]]
+        return self.get_page("", "simple/")
+
+    def get_project(self, project, refresh=False):
+        # type: (str, bool) -> Optional[tuple[dict[str, Any], bytes]]
+        path = "{}/".format(project)
+        return self.get_page(project, path, refresh)
+
+    def get_page(self, project, path, refresh=False):
+        # type: (str, str, bool) -> Optional[tuple[dict[str, Any], bytes]]
+        import time
+
+        key = "page:" + path
+        cached = self.cache.get(key)
+        if (
+            cached is not None
+            and not refresh
+            and time.time() - cached[0]["time"] < self.page_ttl
+        ):
+            return cached
+        result = self.fetch_upstreams(path if project else "")
+        if result is None:
+            return cached  # Stale page is better than nothing
+        body, content_type, url = result
+        html = body.decode("utf-8", "replace")
+        if project:
+            html, links = self.rewrite(project, url, html)
+        else:  # Root index
+            html = re.sub(r'href="([^"]*?)([^"/]+)/?"', r'href="/simple/\2/"', html)
+            links = {}
+        meta = {"time": time.time(), "content_type": content_type, "links": links}
+        body = html.encode("utf-8")
+        return self.cache.set(key, body, meta), body
+
+    def get_file(self, project, filename):
+        # type: (str, str) -> Optional[tuple[dict[str, Any], Any]]
+        """Files are streamed to disk and served from there, never held in memory
+
+        :return: (meta, opened file), the caller should close it
+        """
+        if self.wheelhouse:
+            path = os.path.join(self.wheelhouse, filename)
+            if os.path.isfile(path):
+                size, mtime = os.path.getsize(path), int(os.path.getmtime(path))
+                meta = {"etag": "{:x}-{:x}".format(size, mtime)}
+                meta["content_type"] = "application/octet-stream"
+                return meta, open(path, "rb")
+        key = "file:" + filename
+        cached = self.cache.open(key)
+        if cached is not None:
+            return cached
+        for refresh in (False, True):
+            page = self.get_project(project, refresh)
+            if page is None:
+                return None
+            links = page[0]["links"]
+            name = filename
+            if name not in links and name.endswith(".metadata"):
+                name = name[: -len(".metadata")]  # PEP 658 metadata file
+            if name in links:
+                break
+        else:
+            return None
+        expected = self.expected_sha256(page[1], filename)
+        tried = set()  # type: set[str]
+        for link in self.file_links(project, name, links[name]):
+            url = link + filename[len(name) :]
+            if url in tried:
+                continue
+            tried.add(url)
+            tmp = self.cache.tmp_path()
+            try:
+                with open(tmp, "wb") as f:
+                    result = self.fetch(url, f)
+                if result is None:
+                    continue
+                sha256 = file_sha256(tmp)
+                if expected and expected != sha256:
+                    self.log("Hash mismatch of {}".format(url))
+                    continue
+                self.cache.commit(key, tmp, {"content_type": result[1]}, sha256)
+            except Exception as e:
+                self.log("Failed to fetch {}: {}".format(url, e))
+                continue
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            return self.cache.open(key)
+        return None
+
+    def file_links(self, project, name, link):
+        # type: (str, str, str) -> Iterator[str]
+        """Yield the link of the cached page first, then the ones of each
+        upstream in rank order, which are only fetched when the former failed.
+        """
+        yield link
+        for base in self.upstreams:
+            try:
+                result = self.fetch(urljoin(base, project + "/"))
+            except Exception as e:
+                self.log("Failed to fetch {} from {}: {}".format(project, base, e))
+                continue
+            if result is not None:
+                body, _, url = result
+                html = body.decode("utf-8", "replace")
+                links = self.rewrite(project, url, html)[1]
+                if name in links:
+                    yield links[name]
+
+    @staticmethod
+    def expected_sha256(page, filename):
+        # type: (bytes, str) -> str
+        pattern = r'/{}#sha256=([0-9a-f]{{64}})"'.format(re.escape(filename))
+        m = re.search(pattern, page.decode("utf-8", "replace"))
+        return m.group(1) if m else ""
+
+    def handle(self, path, etag=""):
+        # type: (str, str) -> tuple[int, dict[str, str], Any]
+        """:return: (status, headers, body) of the request, body of a file is
+        an opened file object which should be closed by the caller.
+        """
+        path = path.split("?")[0]
+        parts = [i for i in path.split("/") if i]
+        result = None
+        if parts == ["simple"]:
+            result = self.get_root()
+        elif len(parts) == 2 and parts[0] == "simple":
+            project = normalize_name(parts[1])
+            if project != parts[1]:
+                return 301, {"Location": "/simple/{}/".format(project)}, b""
+            result = self.get_project(project)
+        elif len(parts) == 3 and parts[0] == "packages":
+            result = self.get_file(normalize_name(parts[1]), parts[2])
+        if result is None:
+            return 404, {"Content-Type": "text/plain"}, b"Not Found"
+        meta, body = result
+        headers = {"ETag": '"{}"'.format(meta["etag"])}
+        if etag and meta["etag"] in etag:
+            if not isinstance(body, bytes):
+                body.close()
+            return 304, headers, b""
+        headers["Content-Type"] = meta["content_type"] or "application/octet-stream"
+        if parts[0] == "packages":
+            headers["Cache-Control"] = "max-age=31536000, immutable"
+        else:
+            headers["Cache-Control"] = "max-age={}".format(self.page_ttl)
+        return 200, headers, body
+
+
+LOCK_FILES = ("uv.lock", "pdm.lock", "poetry.lock")
+
+
+def is_compatible_wheel(filename, version=None, platform=""):
+    # type: (str, Optional[tuple[int, int]], str) -> bool
+    """Rough check of wheel tags against the running python and platform"""
+    parts = filename[: -len(".whl")].split("-")
+    if len(parts) < 5:
+        return False
+    pys, abis, plats = [set(i.split(".")) for i in parts[-3:]]
+    major, minor = version or sys.version_info[:2]
+    cp = "cp{}{}".format(major, minor)
+
+    def is_py_ok(tag):
+        # type: (str) -> bool
+        if tag in ("py{}".format(major), "py{}{}".format(major, minor)):
+            return True
+        if tag == cp:
+            return True
+        if "abi3" in abis and tag.startswith("cp{}".format(major)):
+            return tag[3:].isdigit() and int(tag[3:]) <= minor
+        return False
+
+    if not any(is_py_ok(i) for i in pys):
+        return False
+    if abis - {"none", "abi3"} and not any(i.startswith(cp) for i in abis):
+        return False
+    if "any" in plats:
+        return True
+    if not platform:
+        import sysconfig
+
+        platform = sysconfig.get_platform()  # e.g.: linux-x86_64, win-amd64
+    arch = platform.rsplit("-", 1)[-1].replace(".", "_")
+    for tag in plats:
+        if platform.startswith("linux"):
+            if tag.startswith(("manylinux", "linux_")) and tag.endswith(arch):
+                return True
+        elif platform.startswith("macosx"):
+            if tag.startswith("macosx") and tag.endswith((arch, "universal2")):
+                return True
+        elif tag == platform.replace("-", "_"):  # win_amd64/win32
+            return True
+    return False
+
+
+class LockedFile(object):
+    def __init__(self, project, filename, url, sha256):
+        # type: (str, str, str, str) -> None
+        self.project = project
+        self.filename = filename
+        self.url = url
+        self.sha256 = sha256
+        self.status = ""
+
+
+def parse_lock_file(path):
+    # type: (str) -> list[LockedFile]
+    """Artifacts of uv.lock/pdm.lock/poetry.lock that could be installed here
+
+    All of them keep files in inline tables of `[[package]]`: uv.lock has
+    `{ url = ..., hash = "sha256:..." }`, pdm and poetry use `file` instead of
+    `url`. Compatible wheels are picked, or the sdist if there is none.
+    """
+    items = []  # type: list[LockedFile]
+    for section in TomlDocument.load(path).tables("package"):
+        name = section.get("name")
+        if not name:
+            continue
+        text = "\n".join(section.lines)
+        wheels, sdists = [], []  # type: tuple[list[LockedFile], list[LockedFile]]
+        for table in re.findall(r"\{([^{}]*)\}", text):
+            kw = dict(re.findall(r'([\w-]+)\s*=\s*"([^"]*)"', table))
+            sha256 = kw.get("hash", "")
+            if not sha256.startswith("sha256:"):
+                continue
+            url = kw.get("url", "")
+            filename = kw.get("file") or url.split("#")[0].rsplit("/", 1)[-1]
+            item = LockedFile(normalize_name(name), filename, url, sha256[7:])
+            if filename.endswith(".whl"):
+                if is_compatible_wheel(filename):
+                    wheels.append(item)
+            else:
+                sdists.append(item)
+        items += wheels or sdists[:1]
+    return items
+
+
+def download_file(url, path, timeout=PROBE_TIMEOUT * 6, redirects=3):
+    # type: (str, str, float, int) -> None
+    """Download to `path`, continue from the `.part` file of last time"""
+    part = path + ".part"
+    for _ in range(redirects + 1):
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {"User-Agent": USER_AGENT}
+        if offset:
+            headers["Range"] = "bytes={}-".format(offset)
+        conn, req_path = http_connection(url, timeout)
+        with Tracer.span("download", url, offset=offset) as span:
+            try:
+                conn.request("GET", req_path, headers=headers)
+                r = conn.getresponse()
+                span.set(status=r.status)
+                location = r.getheader("Location")
+                if r.status in (301, 302, 303, 307, 308) and location:
+                    url = urljoin(url, location)
+                    continue
+                if r.status != 416:  # 416: the part file is complete already
+                    if r.status not in (200, 206):
+                        raise ConfigError("GET {} -> {}".format(url, r.status))
+                    size = 0
+                    with open(part, "ab" if r.status == 206 else "wb") as f:
+                        while True:
+                            chunk = r.read(64 * 1024)
+                            if not chunk:
+                                break
+                            f.write(chunk)
+                            size += len(chunk)
+                    span.set(bytes=size)
+            finally:
+                conn.close()
+        replace_file(part, path)
+        return
+    raise ConfigError("Too many redirects: {}".format(url))
+
+
+def file_sha256(path):
+    # type: (str) -> str
+    import hashlib
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Prefetch(object):
+    """Download the pinned artifacts of a lock file into a wheelhouse.
+
+    Files are looked up at the project pages of the chosen mirror (the urls
+    in uv.lock are used if not found there), downloaded by `jobs` threads and
+    verified by the hashes of the lock file.
+    """
+
+    def __init__(self, lock_file, index_url, dest, jobs=10, verbose=False):
+        # type: (str, str, str, int, bool) -> None
+        import threading
+
+        self.lock_file = lock_file
+        self.index_url = index_url
+        self.dest = dest
+        self.jobs = max(jobs, 1)
+        self.verbose = verbose
+        self.items = parse_lock_file(lock_file)
+        self._pages = {}  # type: dict[str, dict[str, str]]
+        self._lock = threading.Lock()
+
+    def links(self, project):
+        # type: (str) -> dict[str, str]
+        """{filename: url} of the project page at the mirror"""
+        with self._lock:
+            if project in self._pages:
+                return self._pages[project]
+        page = urljoin(self.index_url.rstrip("/") + "/", project + "/")
+        links = {}  # type: dict[str, str]
+        try:
+            status, _, body, page = http_get(page, PROBE_TIMEOUT * 2)
+        except Exception:
+            status = 0
+        if status == 200:
+            html = body.decode("utf-8", "replace")
+            for href in re.findall(r'href="([^"]+)"', html):
+                url = urljoin(page, href.replace("&amp;", "&")).split("#")[0]
+                links[url.rsplit("/", 1)[-1]] = url
+        with self._lock:
+            self._pages[project] = links
+        return links
+
+    def fetch(self, item):
+        # type: (LockedFile) -> None
+        path = os.path.join(self.dest, item.filename)
+        if os.path.exists(path) and file_sha256(path) == item.sha256:
+            item.status = "cached"
+            return
+        urls = [self.links(item.project).get(item.filename), item.url]
+        error = "not found"
+        for url in [i for i in urls if i]:
+            try:
+                download_file(url, path)
+            except Exception as e:
+                error = str(e) or e.__class__.__name__
+                continue
+            if file_sha256(path) == item.sha256:
+                item.status = "downloaded"
+                if self.verbose:
+                    printf("Downloaded {}".format(url))
+                return
+            os.remove(path)
+            error = "hash mismatch"
+        item.status = "failed: " + error
+        printf("Failed to fetch {}: {}".format(item.filename, error))
+
+    def run(self):
+        # type: () -> int
+        import threading
+        import time
+
+        try:
+            from queue import Empty, Queue
+        except ImportError:  # For python2
+            from Queue import Empty, Queue  # type:ignore
+
+        if not os.path.exists(self.dest):
+            os.makedirs(self.dest)
+        q = Queue()  # type: Queue[LockedFile]
+        for item in self.items:
+            q.put(item)
+
+        def worker():
+            # type: () -> None
+            while True:
+                try:
+                    item = q.get_nowait()
+                except Empty:
+                    return
+                self.fetch(item)
+
+        start = time.time()
+        threads = [threading.Thread(target=worker) for _ in range(self.jobs)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        counts = {}  # type: dict[str, int]
+        for item in self.items:
+            status = item.status.split(":")[0]
+            counts[status] = counts.get(status, 0) + 1
+        print(
+            "Prefetched {} files of {} in {:.1f}s: {}".format(
+                len(self.items),
+                self.lock_file,
+                time.time() - start,
+                ", ".join("{} {}".format(v, k) for k, v in sorted(counts.items())),
+            )
+        )
+        print("Wheelhouse: {}".format(self.dest))
+        print("It is served by `pip_conf.py serve`, or install from it by:")
+        tip = "    PIP_FIND_LINKS={0} UV_FIND_LINKS={0} <install command>"
+        print(tip.format(self.dest))
+        return 1 if counts.get("failed") else 0
+
+
+def find_lock_file(dirpath="."):
+    # type: (str) -> Optional[str]
+    for name in LOCK_FILES:
+        path = os.path.join(dirpath, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def get_wheelhouse():
+    # type: () -> str
+    return os.getenv("PIP_CONF_WHEELHOUSE") or os.path.join(
+        ProbeCache.get_dirpath(), "wheels"
+    )
+
+
+def build_proxy_server(proxy, port=PROXY_PORT, host="127.0.0.1"):
+    # type: (PypiProxy, int, str) -> Any
+    import shutil
 
-    @staticmethod
-    def unset():
-        # type: () -> None
-        print("By pipx:\n", "pipx runpip poetry uninstall <plugin-name>")
-        print("By poetry self:\n", "poetry self remove <plugin-name>")
+    try:
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from socketserver import ThreadingMixIn
+    except ImportError:  # For python2
+        from BaseHTTPServer import (  # type:ignore
+            BaseHTTPRequestHandler,
+            HTTPServer,
+        )
+        from SocketServer import ThreadingMixIn  # type:ignore
 
-    def set_self_pypi_mirror(self, is_windows, url):
-        # type: (bool, str) -> None
-        config_path = self._get_dirpath(is_windows)
-        if not os.path.exists(os.path.join(config_path, "pyproject.toml")):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def reply(self, with_body=True):
+            # type: (bool) -> None
             try:
-                from poetry.console.commands.self.self_command import (  # type:ignore
-                    SelfCommand,
-                )
-            except ImportError:
-                pass
-            else:
-                SelfCommand().generate_system_pyproject()
-        cmds = [
-            "cd {}".format(config_path),
-            "poetry source add -v --priority=default pypi_mirror {}".format(url),
-        ]
-        run_and_echo(" && ".join(cmds), dry="--dry" in sys.argv)
+                etag = self.headers.get("If-None-Match") or ""
+                status, headers, body = proxy.handle(self.path, etag)
+            except Exception as e:
+                proxy.log("Failed to handle {}: {}".format(self.path, e))
+                status, headers, body = 502, {"Content-Type": "text/plain"}, b"Error"
+            if isinstance(body, bytes):
+                size = len(body)
+            else:  # Opened file, copied in chunks
+                size = os.fstat(body.fileno()).st_size
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            if isinstance(body, bytes):
+                if with_body and body:
+                    self.wfile.write(body)
+                return
+            with body:
+                if with_body:
+                    shutil.copyfileobj(body, self.wfile)
 
-    def get_dirpath(self, is_windows, url):
-        # type: (bool, str) -> Optional[str]
-        if self.check_installed():
-            return None
-        plugins = capture_output("poetry self show plugins")
-        mirror_plugin = self.plugin_name
-        if mirror_plugin not in plugins:
-            if run_and_echo("pipx --version") == 0:
-                install_plugin = "pipx inject poetry "
-            else:
-                self.set_self_pypi_mirror(is_windows, url)
-                install_plugin = "poetry self add "
-            dry = "--dry" in sys.argv
-            if run_and_echo(install_plugin + mirror_plugin, dry=dry) != 0:
-                print("Failed to install plugin: {}".format(repr(mirror_plugin)))
-                return None
-            if not load_bool("PIP_CONF_NO_EXTRA_POETRY_PLUGINS"):
-                cmd = install_plugin + " ".join(self.extra_plugins)
-                run_and_echo(cmd, dry=dry)
-        return self._get_dirpath(is_windows)
+        def do_GET(self):
+            # type: () -> None
+            self.reply()
 
-    def _get_dirpath(self, is_windows):
-        # type: (bool) -> str
-        dirpath = "~/Library/Application Support/pypoetry/"
-        if is_windows:
-            dirpath = os.getenv("APPDATA", "") + "/pypoetry/"
-        elif not System.is_mac():
-            dirpath = "~/.config/pypoetry/"
-        elif self.poetry_version < "1.5":
-            dirpath = "~/Library/Preferences/pypoetry/"
-        return os.path.expanduser(dirpath)
+        def do_HEAD(self):
+            # type: () -> None
+            self.reply(with_body=False)
 
-    def set(self):
-        # type: () -> Optional[int]
-        filename = "config.toml"
-        dirpath = self.get_dirpath(self.is_windows, self.url)
-        if not dirpath:
-            return 1
-        config_toml_path = os.path.join(dirpath, filename)
-        item = "[plugins.pypi_mirror]"
-        text = item + '{}url = "{}"'.format(os.linesep, self.url)
-        if os.path.exists(config_toml_path):
-            with open(config_toml_path, "rb") as f:
-                content = f.read().strip().decode("utf-8")
-            if text in content:
-                print("poetry mirror set as expected. Skip!")
-                return None
-            if item in content:
-                pattern = r'\[plugins\.pypi_mirror\].url = "([^"]*)"'
-                m = re.search(pattern, content, re.S)
-                if m:
-                    already = m.group(1)
-                    if not self.replace:
-                        self.prompt_y(filename, m.group())
-                        return None
-                    text = content.replace(already, self.url)
-            else:
-                text = content + os.linesep + text
-        elif not os.path.exists(dirpath):
-            parent = get_parent_path(dirpath)
-            if not os.path.exists(parent):
-                os.mkdir(parent)
-            os.mkdir(dirpath)
-        do_write(config_toml_path, text)
+        def log_message(self, format, *args):
+            # type: (str, Any) -> None
+            proxy.log(format % args)
 
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
 
-def init_pip_conf(
+    return Server((host, port), Handler)
+
+
+def serve(
+    port=PROXY_PORT, cache_size=PROXY_CACHE_SIZE, extra="", configure=False, **kw
+):
+    # type: (int, int, str, bool, Any) -> Optional[int]
+    """Run a caching proxy of the fastest mirrors.
+
+    :param configure: point the global configs of tools to the proxy, which are
+        left changed after it stopped, so that it must be asked explicitly.
+    """
+    verbose = kw.get("verbose", False)
+    ranked = rank_mirrors(speed_test_candidates(extra), verbose=verbose)
+    upstreams = [i.url for i in ranked if not i.error] or [i.url for i in ranked]
+    dirpath = os.path.join(ProbeCache.get_dirpath(), "proxy")
+    cache = ProxyCache(dirpath, cache_size * 1024 * 1024)
+    proxy = PypiProxy(upstreams, cache, verbose=verbose, wheelhouse=get_wheelhouse())
+    server = build_proxy_server(proxy, port)
+    url = "http://127.0.0.1:{}/simple/".format(server.server_address[1])
+    if configure:
+        configure_all(url, replace=True, **kw)
+    print("Serving {} (cache: {}), press Ctrl+C to stop.".format(url, dirpath))
+    if not configure:
+        print("Use it by: PIP_INDEX_URL={0} UV_DEFAULT_INDEX={0}".format(url))
+        print("Or rerun with `--configure` to point pip/uv/pdm/poetry to it.")
+    print("Upstreams: {}".format(", ".join(upstreams)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return None
+
+
+TOOLS = ("pip", "uv", "pdm", "poetry")
+
+
+def detect_tools(tools=TOOLS):
+    # type: (tuple[str, ...]) -> dict[str, str]
+    """Find out the installed tools and get their versions at the same time
+
+    :return: {tool: version} of the installed ones
+    """
+    import threading
+
+    versions = {}  # type: dict[str, str]
+
+    def detect(tool):
+        # type: (str) -> None
+        if tool == "pip":
+            cmd = get_python() + " -m pip --version"
+        elif is_command_exists(tool):
+            cmd = tool + " --version"
+        else:
+            return
+        m = re.search(r"\d+(\.\w+)+", capture_output(cmd))
+        if m:
+            versions[tool] = m.group()
+
+    threads = [threading.Thread(target=detect, args=(tool,)) for tool in tools]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return versions
+
+
+def configure_all(
     url,
     replace=False,
     at_etc=False,
-    write=False,
-    poetry=False,
-    pdm=False,
-    verbose=False,
-    uv=False,
     is_windows=False,
+    verbose=False,
     verify_ssl=False,
     set_python_mirror=False,
     extra_info=None,
 ):
-    # type: (str, bool, bool, bool, bool, bool, bool, bool, bool, bool, bool, Optional[tuple[str,str]]) -> Optional[int]
-    if poetry:
-        return PoetryMirror(url, is_windows, replace, extra_info=extra_info).set()
-    poetry_set_env = "SET_POETRY"
-    if load_bool(poetry_set_env):
-        env_name = "PIP_CONF_POETRY_MIRROR"
-        v = os.getenv(env_name)
-        if v:
-            tip = "Poetry mirror source will be set to {}"
-            print(tip.format(repr(v)))
-            url = build_index_url(
-                v, force=True, verbose=True, strict=True, is_windows=is_windows
-            )
-            replace = True
-        elif verbose:
-            tip = "Going to configure poetry mirror source, because {} was set to {}"
-            print(tip.format(repr(poetry_set_env), os.getenv(poetry_set_env)))
-        return PoetryMirror(url, is_windows, replace, extra_info=extra_info).set()
-    if pdm or load_bool("PIP_CONF_SET_PDM"):
-        return PdmMirror.set(url, verify_ssl, extra_info=extra_info)
-    if uv or load_bool("PIP_CONF_SET_UV"):
-        set_python_mirror = set_python_mirror or load_bool("PIP_CONF_PYTHON_MIRROR")
-        return UvMirror(
-            url, is_windows, replace, extra_info=extra_info, verbose=verbose
-        ).set(set_python_mirror)
-    if not write and (not at_etc or is_windows) and can_set_global():
-        config_by_cmd(url, is_windows, verbose=verbose, extra_info=extra_info)
-        return None
-    text = TEMPLATE.format(url, parse_host(url))
-    conf_file = get_conf_path(is_windows, at_etc)
-    if os.path.exists(conf_file):
-        with open(conf_file, "rb") as fp:
-            s = fp.read().decode("utf-8")
-        if text in s:
-            print("Pip source already be configured as expected.\nSkip!")
-            return None
-        if not replace:
-            print("The pip file {} exists! content:".format(conf_file))
-            print(s)
-            print('If you want to replace it, rerun with "-y" in args.\nExit!')
-            return None
-    do_write(conf_file, text)
+    # type: (str, bool, bool, bool, bool, bool, bool, Optional[tuple[str,str]]) -> Optional[int]
+    """Set mirror for all of the installed tools in one pass"""
+    versions = detect_tools()
+    if verbose:
+        print("Installed tools: {}".format(versions))
+    plans = []  # type: list[ConfigPlan]
+    for tool in TOOLS:
+        if tool not in versions:
+            plans.append(ConfigPlan(tool, skip="not installed"))
+        elif tool == "pip":
+            plans.append(PipConfig.plan(url, at_etc, extra_info))
+        elif tool == "pdm":
+            plans.append(PdmMirror.plan(url, verify_ssl, extra_info))
+        elif tool == "uv":
+            uv = UvMirror(url, is_windows, replace, extra_info, verbose=verbose)
+            uv.detected = True
+            plans.append(uv.plan(set_python_mirror))
+        else:
+            poetry = PoetryMirror(url, is_windows, replace, extra_info, verbose)
+            poetry.detected = True
+            poetry._version = versions[tool]
+            plans.append(poetry.plan())
+    rc = None
+    for plan in plans:
+        if plan.apply():
+            rc = 1
+    print("Summary:")
+    for plan in plans:
+        line = "  {:<8}{:<10}{:<28}{}".format(
+            plan.tool,
+            versions.get(plan.tool, "-"),
+            plan.status,
+            plan.path or plan.command,
+        )
+        print(line.rstrip())
+    return rc
 
 
-def do_write(conf_file, text):
-    # type: (str, str) -> None
-    with open(conf_file, "w") as fp:
-        fp.write(text + "\n")
-    print("Write lines to `{}` as below:\n{}\n".format(conf_file, text))
-    print("Done.")
+def do_write(conf_file, text, echo=True):
+    # type: (str, str, bool) -> None
+    # Write to a temporary file then rename it, so the config file will never
+    # be half written even if the process is killed.
+    tmp = "{}.{}.tmp".format(conf_file, os.getpid())
+    with Tracer.span("write", conf_file, bytes=len(text) + 1):
+        with open(tmp, "w") as fp:
+            fp.write(text + "\n")
+        if os.path.exists(conf_file):
+            import stat
+
+            os.chmod(tmp, stat.S_IMODE(os.stat(conf_file).st_mode))
+        replace_file(tmp, conf_file)
+    if echo:
+        print("Write lines to `{}` as below:\n{}\n".format(conf_file, text))
+        print("Done.")
 
 
 def can_set_global():
@@ -1020,6 +3602,50 @@ def read_lines(filename):
     return s.splitlines()
 
 
+class PyprojectScanner:
+    """Find out which tool manages the project by streaming pyproject.toml"""
+
+    filename = "pyproject.toml"
+    locks = ("uv.lock", "poetry.lock", "pdm.lock")
+    _patterns = None  # type: Optional[tuple[Any, Any]]
+
+    @classmethod
+    def patterns(cls):
+        # type: () -> tuple[Any, Any]
+        if cls._patterns is None:
+            cls._patterns = (
+                re.compile(b"(uv|pdm|poetry)"),
+                re.compile(b"\\[\\[?tool\\.(uv|pdm|poetry)[.\\]]"),
+            )
+        return cls._patterns
+
+    @classmethod
+    def scan(cls, filename=""):
+        # type: (str) -> tuple[str, set[str]]
+        """Return the tool of build-backend (stop reading once it is found)
+        and the tools that have [tool.*] tables before it
+        """
+        backend_pattern, table_pattern = cls.patterns()
+        tools = set()  # type: set[str]
+        with open(filename or cls.filename, "rb") as f:
+            for line in f:
+                if line.startswith(b"build-backend"):
+                    m = backend_pattern.search(line)
+                    if m:
+                        return m.group(1).decode(), tools
+                elif line.startswith(b"["):
+                    m = table_pattern.match(line)
+                    if m:
+                        tools.add(m.group(1).decode())
+        return "", tools
+
+    @classmethod
+    def find_locks(cls, dirpath="."):
+        # type: (str) -> list[str]
+        """Stat the lock files one by one, instead of listing the directory"""
+        return [i for i in cls.locks if os.path.isfile(os.path.join(dirpath, i))]
+
+
 def auto_detect_tool(args):
     # type: (Namespace) -> Namespace
     if args.tool == "pip":
@@ -1031,33 +3657,21 @@ def auto_detect_tool(args):
     else:
         if args.verbose:
             printf("tool not sepcial. Going to auto detect it by lock/pyproject ...")
-        files = os.listdir(".")
-        pyproject = "pyproject.toml"
-        locks = {"uv.lock", "poetry.lock", "pdm.lock"} & set(files)
+        locks = PyprojectScanner.find_locks()
         if len(locks) == 1:
-            lock_file = list(locks)[0]
+            lock_file = locks[0]
             tool = lock_file.split(".")[0]
             if args.verbose:
                 printf("Only {} exists, use tool={}".format(lock_file, tool))
-        elif pyproject not in files:
+        elif not os.path.isfile(PyprojectScanner.filename):
             if args.verbose:
-                msg = "Multi lock files detected({}) ".format(list(locks))
+                msg = "Multi lock files detected({}) ".format(locks)
                 printf(msg + "without pyproject.toml, use tool=pip")
             return args  # Same as args.tool == 'pip'
         else:
-            tools = set()  # type: set[str]
-            for line in read_lines(pyproject):
-                if not line:
-                    continue
-                elif line.startswith("build-backend"):
-                    m = re.search(r"(uv|pdm|poetry)", line)
-                    if m:
-                        tools = {m.group(1)}
-                        break
-                else:
-                    m = re.match(r"\[\[?tool\.(uv|pdm|poetry)[.\]]", line)
-                    if m:
-                        tools.add(m.group(1))
+            backend, tools = PyprojectScanner.scan()
+            if backend:
+                tools = {backend}
             if len(tools) == 1:
                 tool = list(tools)[0]
                 if args.verbose:
@@ -1072,12 +3686,203 @@ def auto_detect_tool(args):
     return args
 
 
+class Monorepo(object):
+    """Set mirror for all of the sub-projects under a directory in one batch.
+
+    The tree is walked once (hidden directories, node_modules and virtual
+    environments are skipped) and the tools of projects are detected at the
+    same time, then the mirror that was probed only once is written to each
+    project: `[[tool.uv.index]]` of pyproject.toml for uv, pdm.toml for pdm.
+    """
+
+    skip_dirs = {"node_modules", "venv", "site-packages", "__pycache__"}
+
+    def __init__(
+        self,
+        root,
+        url,
+        replace=False,
+        extra_info=None,
+        verify_ssl=False,
+        jobs=10,
+        verbose=False,
+    ):
+        # type: (str, str, bool, Optional[tuple[str,str]], bool, int, bool) -> None
+        self.root = root
+        self.url = url
+        self.replace = replace
+        self.extra_info = extra_info
+        self.verify_ssl = verify_ssl
+        self.jobs = max(jobs, 1)
+        self.verbose = verbose
+
+    def find_projects(self):
+        # type: () -> list[tuple[str, list[str]]]
+        """Return (dirpath, lock files) of the directories with pyproject.toml"""
+        projects = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = sorted(
+                i for i in dirnames if i[:1] != "." and i not in self.skip_dirs
+            )
+            if PyprojectScanner.filename in filenames:
+                locks = [i for i in PyprojectScanner.locks if i in filenames]
+                projects.append((dirpath, locks))
+        return projects
+
+    @staticmethod
+    def detect(dirpath, locks):
+        # type: (str, list[str]) -> str
+        """Same rules as `auto_detect_tool`, empty string if undetermined"""
+        if len(locks) == 1:
+            return locks[0].split(".")[0]
+        path = os.path.join(dirpath, PyprojectScanner.filename)
+        backend, tools = PyprojectScanner.scan(path)
+        if backend:
+            return backend
+        return list(tools)[0] if len(tools) == 1 else ""
+
+    def plan_uv(self, dirpath):
+        # type: (str) -> ConfigPlan
+        path = os.path.join(dirpath, PyprojectScanner.filename)
+        doc = TomlDocument.load(path)
+        uv = UvMirror(self.url, False, self.replace, self.extra_info)
+        already = uv.update(doc, "tool.uv")
+        if not doc.changed:
+            return ConfigPlan("uv", path, skip="already set")
+        if already and not self.replace:
+            return ConfigPlan("uv", path, skip="exists: " + already)
+        return ConfigPlan("uv", path, doc.dumps())
+
+    def plan_pdm(self, dirpath):
+        # type: (str) -> ConfigPlan
+        """Same settings as `PdmMirror.plan`, but written to pdm.toml directly"""
+        path = os.path.join(dirpath, "pdm.toml")
+        doc = TomlDocument.load(path)
+        pypi = doc.table("pypi")
+        already = pypi.get("url")
+        doc.set(pypi, "url", self.url)
+        if not self.verify_ssl:
+            doc.set(pypi, "verify_ssl", False)
+        if self.extra_info is not None:
+            extra = doc.table("pypi.extra")
+            doc.set(extra, "url", self.extra_info[1])
+            if self.extra_info[1].startswith("https:") and not self.verify_ssl:
+                doc.set(extra, "verify_ssl", False)
+        if not doc.changed:
+            return ConfigPlan("pdm", path, skip="already set")
+        if already and already != self.url and not self.replace:
+            return ConfigPlan("pdm", path, skip="exists: " + already)
+        return ConfigPlan("pdm", path, doc.dumps())
+
+    def plan(self, dirpath, locks):
+        # type: (str, list[str]) -> ConfigPlan
+        tool = self.detect(dirpath, locks)
+        if tool == "uv":
+            return self.plan_uv(dirpath)
+        if tool == "pdm":
+            return self.plan_pdm(dirpath)
+        if tool == "poetry":
+            return ConfigPlan(tool, skip="use global config (--poetry)")
+        return ConfigPlan("pip", skip="use global config")
+
+    def run(self):
+        # type: () -> Optional[int]
+        from multiprocessing.pool import ThreadPool
+
+        projects = self.find_projects()
+        if self.verbose:
+            print("Found {} projects under {}".format(len(projects), self.root))
+
+        def plan_one(project):
+            # type: (tuple[str, list[str]]) -> tuple[str, ConfigPlan]
+            dirpath, locks = project
+            try:
+                return dirpath, self.plan(dirpath, locks)
+            except (IOError, UnicodeDecodeError) as e:
+                return dirpath, ConfigPlan("-", skip=str(e), failed=True)
+
+        pool = ThreadPool(max(min(self.jobs, len(projects)), 1))
+        try:
+            plans = pool.map(plan_one, projects)
+        finally:
+            pool.close()
+            pool.join()
+        rc = None
+        for _, plan in plans:
+            plan.echo = self.verbose
+            if plan.apply():
+                rc = 1
+        print("Summary: {} projects, mirror {}".format(len(projects), self.url))
+        for dirpath, plan in plans:
+            name = os.path.relpath(dirpath, self.root)
+            print("  {:<40}{:<8}{}".format(name, plan.tool, plan.status).rstrip())
+        return rc
+
+
+def set_socket_timeout(timeout=PROBE_TIMEOUT):
+    # type: (float) -> None
+    import socket
+
+    socket.setdefaulttimeout(timeout)
+
+
+def show_sources(verbose=False):
+    # type: (bool) -> None
+    print("There are several mirrors that can be used for pip/uv/pdm/poetry:")
+    sources = (
+        SOURCES
+        if verbose
+        else ({k: v for k, v in SOURCES.items() if len(k) > 3 and k != "tengxun"})
+    )
+    # Same layout as `pprint.pprint(sources)`, but need not to import pprint
+    items = ["{}: {}".format(repr(k), repr(v)) for k, v in sorted(sources.items())]
+    print("{" + ",\n ".join(items) + "}")
+
+
+def show_index_url(source, force=False, verbose=False):
+    # type: (str, bool, bool) -> None
+    if not force:
+        set_socket_timeout()
+    url = build_index_url(source, force, verbose=verbose, is_windows=System.is_win())
+    if verbose:
+        print("Prefer to use the following index url:")
+    print(url)
+
+
+FAST_OPTIONS = {"--url", "--list", "-l", "--version", "--verbose", "-f"}
+
+
+def fast_main(argv):
+    # type: (list[str]) -> bool
+    """Answer `--url/--list/--version` without argparse.
+
+    :return: False if the arguments are not simple enough to be handled here
+    """
+    names = [i for i in argv if not i.startswith("-")]
+    options = set(argv) - set(names)
+    if len(names) > 1 or not options or not options <= FAST_OPTIONS:
+        return False
+    verbose = "--verbose" in options
+    if "--list" in options or "-l" in options:
+        show_sources(verbose)
+    elif "--version" in options:
+        print("pip-conf-mirror {}".format(__version__))
+    elif "--url" in options:
+        show_index_url(names[0] if names else DEFAULT, "-f" in options, verbose)
+    else:
+        return False
+    return True
+
+
 def main():
     # type: () -> Optional[int]
+    if fast_main(sys.argv[1:]):
+        return None
     from argparse import ArgumentParser
 
     parser = ArgumentParser()
     source_help = "the source of pip, ali/douban/hw/qinghua or tx(default)"
+    source_help += ", or `serve` to run a local caching proxy of the fastest ones"
     parser.add_argument("name", nargs="?", default="", help=source_help)
     # Be compatible with old version
     parser.add_argument("-s", "--source", default=DEFAULT, help=source_help)
@@ -1105,14 +3910,115 @@ def main():
     )
     parser.add_argument("--pip", action="store_true", help="Set index url for pip")
     parser.add_argument(
-        "-t", "--tool", default="auto", help="Choices: pip/uv/pdm/poetry"
+        "-t", "--tool", default="auto", help="Choices: pip/uv/pdm/poetry/all"
     )
     parser.add_argument("--url", action="store_true", help="Show mirrors url")
+    parser.add_argument(
+        "--strict-probe",
+        action="store_true",
+        help="Check mirror by `pip download` instead of http request (slower)",
+    )
+    parser.add_argument(
+        "--check-fresh",
+        action="store_true",
+        help="Rank mirrors that lag behind pypi.org lower",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not use the probe results cached at ~/.cache/pip-conf/",
+    )
+    parser.add_argument(
+        "--fastest",
+        action="store_true",
+        help="Benchmark all mirrors and use the fastest one",
+    )
     parser.add_argument(
         "--dry",
         action="store_true",
         help="Display cmd command without actually executing",
     )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep probing mirrors and switch index url when it degraded",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=WATCH_INTERVAL,
+        help="Seconds between two rounds of probes in watch mode",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=PROXY_PORT,
+        help="Port to listen for `serve`",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=PROXY_CACHE_SIZE,
+        help="Max megabytes to cache for `serve`",
+    )
+    parser.add_argument(
+        "--configure",
+        action="store_true",
+        help="Point pip/uv/pdm/poetry to the proxy of `serve` (kept after it stopped)",
+    )
+    parser.add_argument(
+        "--prefetch",
+        action="store_true",
+        help="Download files pinned by uv.lock/pdm.lock/poetry.lock from mirror",
+    )
+    parser.add_argument(
+        "--lock-file",
+        default="",
+        help="The lock file to prefetch (default: found in current directory)",
+    )
+    parser.add_argument(
+        "--wheelhouse",
+        default="",
+        help="Where to save prefetched files (env: PIP_CONF_WHEELHOUSE)",
+    )
+    parser.add_argument(
+        "--fleet",
+        default="",
+        help="Inventory file of hosts to run this script at by ssh concurrently",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=10,
+        help="Max hosts/downloads/projects at the same time",
+    )
+    parser.add_argument(
+        "--recursive",
+        action="store_true",
+        help="Set mirror for each uv/pdm project under the directory",
+    )
+    parser.add_argument(
+        "--recursive-dir",
+        default="",
+        help="The directory to find projects for --recursive (default: .)",
+    )
+    parser.add_argument(
+        "--ssh",
+        default="",
+        help="Command to connect hosts in fleet mode (env: PIP_CONF_SSH)",
+    )
+    parser.add_argument("--report", default="", help="Save fleet results as json")
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Save spans of probes/subprocesses/writes to pip-conf-trace.json",
+    )
+    parser.add_argument(
+        "--trace-file",
+        default="",
+        help="Where to save spans of --trace, json lines unless *.json"
+        " (env: PIP_CONF_TRACE)",
+    )
     parser.add_argument("--verbose", action="store_true", help="Print more info")
     parser.add_argument("--version", action="store_true", help="Show script version")
     parser.add_argument(
@@ -1128,30 +4034,54 @@ def main():
                 print("Got options from env {}".format(repr(name)))
             sys.argv.extend(opts)
     args = parser.parse_args()
+    trace = args.trace_file or os.getenv("PIP_CONF_TRACE")
+    if trace or args.trace:
+        Tracer.enable(trace or "pip-conf-trace.json")
     if args.list:
-        print("There are several mirrors that can be used for pip/uv/pdm/poetry:")
-        sources = (
-            SOURCES
-            if args.verbose
-            else ({k: v for k, v in SOURCES.items() if len(k) > 3 and k != "tengxun"})
-        )
-        pprint.pprint(sources)
+        show_sources(args.verbose)
     elif args.fix:
         PoetryMirror.fix_v1_6_error()
     elif args.version:
         print("pip-conf-mirror {}".format(__version__))
+    elif args.fleet:
+        options = ("--fleet", "--jobs", "--ssh", "--report")
+        remote_args = strip_options(sys.argv[1:], options)
+        fleet = Fleet(args.fleet, remote_args, args.ssh, args.jobs, args.verbose)
+        fleet.run()
+        return fleet.report(args.report)
     else:
+        set_socket_timeout()
+        if args.no_cache:
+            ProbeCache.ttl = 0
+        if args.name == "serve":
+            return serve(
+                args.port,
+                args.cache_size,
+                args.extra or os.getenv("PIP_CONF_EXTRA", ""),
+                args.configure,
+                at_etc=args.etc,
+                is_windows=System.is_win(),
+                verbose=args.verbose,
+                verify_ssl=args.verify_ssl,
+            )
         source = args.name or args.source
         is_windows = System.is_win()
         verbose = args.verbose
-        url = build_index_url(source, args.f, verbose=verbose, is_windows=is_windows)
+        extra_env_name = "PIP_CONF_EXTRA"
+        if args.fastest:
+            url = fastest_index_url(args.extra or os.getenv(extra_env_name, ""))
+        else:
+            url = build_index_url(
+                source, args.f, verbose=verbose, is_windows=is_windows
+            )
         if args.url:  # Only display prefer source url, but not config
             if verbose:
                 print("Prefer to use the following index url:")
             print(url)
             return None
-        extra_env_name = "PIP_CONF_EXTRA"
         extra_info = ExtraIndex(args.extra or os.getenv(extra_env_name), args.f).get()
+        if extra_info is not None and extra_info[1] == url:
+            extra_info = None  # The extra index was picked as the fastest one
         if verbose:
             if args.extra:
                 print("Get extra url from args with value: {}".format(args.extra))
@@ -1169,12 +4099,54 @@ def main():
             is_windows=is_windows,
             extra_info=extra_info,
         )
+        if args.recursive or args.recursive_dir:
+            return Monorepo(
+                args.recursive_dir or ".",
+                url,
+                replace=args.y,
+                extra_info=extra_info,
+                verify_ssl=args.verify_ssl,
+                jobs=args.jobs,
+                verbose=verbose,
+            ).run()
+        if args.prefetch or args.lock_file:
+            lock_file = args.lock_file
+            if not lock_file:
+                lock_file = find_lock_file()
+                if lock_file is None:
+                    print("No lock file found: {}".format(", ".join(LOCK_FILES)))
+                    return 1
+            dest = args.wheelhouse or get_wheelhouse()
+            return Prefetch(lock_file, url, dest, args.jobs, verbose).run()
+        if args.watch:
+            watch_mirrors(
+                url,
+                args.extra or os.getenv(extra_env_name, ""),
+                args.interval,
+                uv=args.uv or is_command_exists("uv"),
+                at_etc=args.etc,
+                verbose=verbose,
+                is_windows=is_windows,
+                extra_info=extra_info,
+            )
+            return 0
+        if args.tool == "all":
+            return configure_all(
+                url,
+                replace=args.y,
+                at_etc=args.etc,
+                is_windows=is_windows,
+                verbose=verbose,
+                verify_ssl=args.verify_ssl,
+                set_python_mirror=args.python,
+                extra_info=extra_info,
+            )
         if not args.poetry and not args.pdm and not args.uv and not args.pip:
             args = auto_detect_tool(args)
             if (
                 args.tool == "auto"
                 and any([args.poetry, args.pdm, args.uv])
-                and ("index-url" not in capture_output("pip config list"))
+                and ("index-url" not in PipConfig.list_text())
             ):
                 # Config mirror for pip before configure mirror of manage tool
                 set_conf()
@@ -1189,7 +4161,7 @@ def main():
 
 
 if __name__ == "__main__":
-    if "--url" not in sys.argv and "--list" not in sys.argv:
+    if "--verbose" in sys.argv and "--url" not in sys.argv and "--list" not in sys.argv:
         try:
             from asynctor import timeit
         except (ImportError, SyntaxError, AttributeError):
@@ -15,6 +15,10 @@ Usage::
     $ rstrip -t .py src/  # rstrip all python files in src/
     $ rstrip -r -t .py src/  # rstrip all python files in src/ and its sub directories
     $ rstrip a.py b.txt  # rstrip the two files
+    $ rstrip -j 8 -r src/  # rstrip files in src/ by 8 processes
+    $ rstrip -i -r .  # skip files that not changed since last run
+    $ rstrip --changed .  # rstrip files that changed according to git
+    $ cat a.log | rstrip - > b.log  # rstrip stdin to stdout, chunk by chunk
 
 """
 
@@ -22,6 +26,7 @@ import argparse
 import os
 import re
 import sys
+import time
 
 try:
     from enum import StrEnum  # ty: ignore[unresolved-import]
@@ -53,28 +58,494 @@ class LineBreakChoices(StrEnum):
 
 
 class ContentException(Exception):
-    pass
+    def __init__(self, message, content=None):
+        super(ContentException, self).__init__(message)
+        self.content = content  # Bytes of the file if it has been read
 
 
-def rstrip_file(fname, newlines=1, linesep=None):
-    try:
-        with open(fname) as fp:
-            s = fp.read()
-    except UnicodeDecodeError:
-        with open(fname, encoding="utf8") as fp:
-            s = fp.read()
-    if not s:
-        raise ContentException("Empty file.")
+MMAP_THRESHOLD = 1024 * 1024  # Map files larger than this instead of reading
+STREAM_CHUNK = 64 * 1024
+SNIFF_SIZE = 8000  # Same as git, NUL in the first bytes means binary
+BOMS = (b"\xff\xfe", b"\xfe\xff", b"\x00\x00\xfe\xff")  # UTF-16/32
+# Ascii chars that `str.rstrip` strips, `bytes.rstrip()` does not strip \x1c-\x1f
+WHITESPACE = b" \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f"
+# Escaped instead of raw, python2 does not accept the `rb` prefix of ruff format
+NON_ASCII = re.compile(b"[\\x80-\\xff]")
+SPACE = b"[ \\t\\x0b\\x0c\\x1c-\\x1f]"
+# Each of them starts with a literal, which is searched much faster by `re`
+# than an alternation or a char set
+DIRTY_PATTERNS = {
+    "\n": [re.compile(b"\\r"), re.compile(b"\\n(?<=" + SPACE + b"\\n)")],
+    "\r\n": [
+        re.compile(b"\\r(?!\\n)"),
+        re.compile(b"\\n(?<!\\r\\n)"),
+        re.compile(b"\\r(?<=" + SPACE + b"\\r)"),
+    ],
+}
+
+
+def is_ascii(data):
+    """Check bytes or mmap, the latter chunk by chunk to keep memory low"""
+    if not hasattr(bytes, "isascii"):  # For python<3.7
+        return NON_ASCII.search(data) is None
+    step = MMAP_THRESHOLD
+    return all(data[i : i + step].isascii() for i in range(0, len(data), step))
+
+
+def needs_rewrite(data, linesep, newlines=1):
+    """Check the bytes(or mmap) without building new content
+
+    :return: None if it is not ascii, which should be checked as text
+    """
+    if not is_ascii(data):
+        return None
+    if any(p.search(data) for p in DIRTY_PATTERNS[linesep]):
+        return True
+    end = linesep.encode() * newlines
+    body_size = len(data) - len(end)
+    if body_size < 0 or data[body_size:] != end:
+        return True
+    return body_size > 0 and data[body_size - 1 : body_size] in WHITESPACE
+
+
+def rstrip_bytes(data, linesep, newlines=1):
+    # Same as `rstrip_text`, bytes.splitlines splits by \r\n, \r and \n only
+    ss = [line.rstrip(WHITESPACE) for line in data.rstrip(WHITESPACE).splitlines()]
+    n = linesep.encode()
+    return n.join(ss) + n * newlines
+
+
+def rstrip_text(s, linesep, newlines=1):
+    s = s.replace("\r\n", "\n").replace("\r", "\n")  # Universal newlines
     ss = [line.rstrip() for line in s.rstrip().split("\n")]
+    return linesep.join(ss) + linesep * newlines
+
+
+def decode_order():
+    """Try the locale encoding first, then utf8"""
+    import codecs
+    import locale
+
+    encoding = locale.getpreferredencoding(False)
+    if codecs.lookup(encoding).name == "utf-8":
+        return [encoding]
+    return [encoding, "utf8"]
+
+
+def decode(data):
+    encodings = decode_order()
+    for encoding in encodings[:-1]:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+    return data.decode(encodings[-1])
+
+
+class LineStripper(object):
+    """Rstrip text that comes chunk by chunk, the result of all chunks is the
+    same as `rstrip_text` of the whole text
+    """
+
+    def __init__(self, linesep, newlines=1):
+        self.linesep = linesep
+        self.newlines = newlines
+        self.pending = 0  # Line breaks held back, dropped if only blank lines follow
+        # Spaces at the end of the unfinished line, and "\r" that may be
+        # followed by "\n" in next chunk
+        self.carry = ""
+
+    def feed(self, s, final=False):
+        s = self.carry + s
+        cr = ""
+        if not final and s.endswith("\r"):
+            s, cr = s[:-1], "\r"
+        raw = s.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+        tail = raw[-1]  # Unfinished line, its spaces may be followed by words
+        lines = [i.rstrip() for i in raw]
+        last = len(lines) - 1
+        while last >= 0 and not lines[last]:
+            last -= 1
+        if last < 0:
+            self.pending += len(lines) - 1
+            self.carry = tail + cr
+            return ""
+        out = self.linesep * self.pending + self.linesep.join(lines[: last + 1])
+        self.pending = len(lines) - 1 - last
+        self.carry = (tail[len(lines[-1]) :] if self.pending == 0 else tail) + cr
+        return out
+
+    def close(self):
+        return self.feed("", final=True) + self.linesep * self.newlines
+
+
+def rstrip_stream(src, dst, linesep, newlines=1, encoding=None):
+    """Rstrip binary file object `src` into `dst`, memory is constant no
+    matter how large the input is.
+
+    It is decoded by `encoding` and written as utf8, same as `rstrip_text`
+    of the whole content then `.encode()`
+    """
+    import codecs
+
+    encoding = encoding or decode_order()[0]
+    decoder = codecs.getincrementaldecoder(encoding)()
+    stripper = LineStripper(linesep, newlines)
+    read = getattr(src, "read1", src.read)  # Not to wait for a full chunk of pipe
+    empty = True
+    for chunk in iter(lambda: read(STREAM_CHUNK), b""):
+        empty = False
+        dst.write(stripper.feed(decoder.decode(chunk)).encode("utf8"))
+        dst.flush()
+    if not empty:
+        text = stripper.feed(decoder.decode(b"", final=True))
+        dst.write((text + stripper.close()).encode("utf8"))
+        dst.flush()
+
+
+def rewrite_file(fname, linesep, newlines=1, compare=False):
+    """Rstrip file by streaming into a temp file, which replaces the origin"""
+    import filecmp
+    import shutil
+    import tempfile
+
+    dirpath, name = os.path.split(os.path.abspath(fname))
+    encodings = decode_order()
+    for encoding in encodings:
+        fd, tmp = tempfile.mkstemp(prefix="." + name, suffix=".tmp", dir=dirpath)
+        try:
+            with open(fname, "rb") as src, os.fdopen(fd, "wb") as dst:
+                rstrip_stream(src, dst, linesep, newlines, encoding)
+            if compare and filecmp.cmp(tmp, fname, shallow=False):
+                raise ContentException("Already meet requirement.")
+            shutil.copymode(fname, tmp)
+            os.replace(tmp, fname)
+            return
+        except UnicodeDecodeError:
+            os.remove(tmp)
+            if encoding == encodings[-1]:
+                raise
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+
+class BinarySniffer(object):
+    """Reject binary files by name or by the first bytes, before reading the
+    whole of them to find out that they can not be decoded
+    """
+
+    extensions = set(
+        (".png", ".jpg", ".jpeg", ".gif", ".ico", ".webp", ".pdf")
+        + (".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".whl", ".egg", ".jar")
+        + (".pyc", ".pyo", ".so", ".dylib", ".dll", ".exe", ".o", ".a", ".class")
+        + (".db", ".sqlite3", ".woff", ".woff2", ".ttf", ".mp3", ".mp4")
+    )
+    learn = 3  # Reject extension after so many binary files and no text file
+    seen = {}  # type: dict  # ext -> [binary, text] counts of sniffed files
+    attributes = {}  # type: dict  # dirpath -> rules of .gitattributes
+
+    @classmethod
+    def check_name(cls, fname):
+        """:return: reason to skip the file, or empty string"""
+        ext = os.path.splitext(fname)[1].lower()
+        if ext in cls.extensions:
+            return "Binary file extension."
+        binary, text = cls.seen.get(ext, (0, 0))
+        if ext and binary >= cls.learn and not text:
+            return "Binary file extension(learned)."
+        if cls.is_binary_attribute(fname):
+            return "Binary file by .gitattributes."
+        return ""
+
+    @classmethod
+    def check_head(cls, fname, head):
+        """:return: reason to skip the file, or empty string"""
+        reason = ""
+        if head.startswith(BOMS):
+            reason = "Not utf8 file(UTF-16/32 BOM)."
+        elif b"\x00" in head:
+            reason = "Binary file."
+        ext = os.path.splitext(fname)[1].lower()
+        if ext:
+            # UTF-16/32 files are text, only NUL makes extension learned binary
+            binary = reason == "Binary file."
+            cls.seen.setdefault(ext, [0, 0])[0 if binary else 1] += 1
+        return reason
+
+    @classmethod
+    def gitattributes(cls, dirpath):
+        """[(regex, binary), ...] of .gitattributes in dirpath and its parents
+        until the root of git repo, the deeper the later
+        """
+        rules = cls.attributes.get(dirpath)
+        if rules is not None:
+            return rules
+        rules = []
+        parent = os.path.dirname(dirpath)
+        if parent != dirpath and not os.path.isdir(os.path.join(dirpath, ".git")):
+            rules = list(cls.gitattributes(parent))
+        path = os.path.join(dirpath, ".gitattributes")
+        if os.path.isfile(path):
+            prefix = re.escape(dirpath.replace(os.sep, "/").rstrip("/")) + "/"
+            with open(path) as f:
+                for line in f:
+                    parts = line.split()
+                    if not parts or parts[0].startswith("#"):
+                        continue
+                    pattern, attrs = parts[0], parts[1:]
+                    if "binary" in attrs or "-text" in attrs:
+                        binary = True
+                    elif "text" in attrs:
+                        binary = False
+                    else:
+                        continue
+                    if "/" not in pattern.rstrip("/"):  # Match name in any dir
+                        pattern = "**/" + pattern
+                    regex = re.compile(prefix + glob_to_regex(pattern) + "$")
+                    rules.append((regex, binary))
+        cls.attributes[dirpath] = rules
+        return rules
+
+    @classmethod
+    def is_binary_attribute(cls, fname):
+        path = os.path.abspath(fname)
+        rules = cls.gitattributes(os.path.dirname(path))
+        path = path.replace(os.sep, "/")
+        for regex, binary in reversed(rules):
+            if regex.match(path):
+                return binary
+        return False
+
+
+def decode_head(head):
+    """Raise UnicodeDecodeError if the first bytes of file can not be decoded"""
+    import codecs
+
+    error = None
+    for encoding in decode_order():
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(head)
+        except UnicodeDecodeError as e:
+            error = e
+        else:
+            return
+    raise error  # type:ignore
+
+
+def rstrip_file(fname, newlines=1, linesep=None):
+    """:return: the new content, None if it was rewritten by streaming"""
     n = linesep or os.linesep
-    required = n.join(ss) + n * newlines
+    reason = BinarySniffer.check_name(fname)
+    if reason:
+        raise ContentException(reason)
     with open(fname, "rb") as fp:
-        byt = fp.read()
-    new_byt = required.encode()
-    if byt == new_byt:
-        raise ContentException("Already meet requirement.")
+        size = os.fstat(fp.fileno()).st_size
+        if not size:
+            raise ContentException("Empty file.")
+        head = fp.read(SNIFF_SIZE)
+        reason = BinarySniffer.check_head(fname, head)
+        if reason:
+            raise ContentException(reason)
+        if not is_ascii(head):
+            decode_head(head)
+        if size >= MMAP_THRESHOLD:
+            import mmap
+
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                dirty = needs_rewrite(mapped, n, newlines)
+            finally:
+                mapped.close()
+            if dirty is False:
+                raise ContentException("Already meet requirement.")
+            # Not to load large file into memory
+            return rewrite_file(fname, n, newlines, compare=dirty is None)
+        data = head + fp.read()
+    dirty = needs_rewrite(data, n, newlines)
+    if dirty is None:  # Not ascii
+        required = rstrip_text(decode(data), n, newlines).encode()
+        dirty = required != data
+    elif dirty:
+        required = rstrip_bytes(data, n, newlines)
+    if not dirty:
+        raise ContentException("Already meet requirement.", data)
     with open(fname, "wb") as fp:
-        fp.write(new_byt)
+        fp.write(required)
+    return required
+
+
+def process_file(item):
+    """Rstrip one file, return (filename, status, reason, stat)
+
+    It runs in the worker processes of `-j`, so exceptions are converted to
+    status instead of being raised. `stat` is the record of FileIndex if
+    required, so that the content is hashed in workers instead of being read
+    again by the main process.
+    """
+    fn, linesep, indexed = item
+    content = None
+    try:
+        content = rstrip_file(fn, linesep=linesep)
+    except ContentException as e:
+        status, reason, content = "skip", str(e), e.content
+    except UnicodeDecodeError as e:
+        status, reason = "failed", str(e)
+    else:
+        status, reason = "rstriped", ""
+    stat = None
+    if indexed:
+        import hashlib
+
+        sha1 = "" if content is None else hashlib.sha1(content).hexdigest()
+        stat = FileIndex.stat(fn, sha1)
+    return fn, status, reason, stat
+
+
+def process_files(files, linesep=None, jobs=1, indexed=False):
+    """Yield results of `process_file` in the same order as files, which can
+    be a generator, so that the files are rstriped while still being found
+    """
+    from itertools import chain, islice
+
+    files = iter(files)
+    head = list(islice(files, 2))
+    items = ((i, linesep, indexed) for i in chain(head, files))
+    if jobs == 1 or len(head) < 2:
+        for item in items:
+            yield process_file(item)
+        return
+    from multiprocessing import Pool
+
+    # Bigger chunks cost less IPC, smaller ones balance the load better
+    chunksize = 16
+    pool = Pool(jobs or os.cpu_count() or 1)
+    try:
+        for result in pool.imap(process_file, items, chunksize):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class FileIndex(object):
+    """Results of last runs, to skip the files that have not been changed.
+
+    Saved as json: {abspath: [mtime_ns, size, sha1, linesep, status]}
+    """
+
+    racy = 2  # Seconds, mtime can not be trusted if file changed right after it
+
+    def __init__(self, path=""):
+        self.path = path or self.default_path()
+        self.cwd = os.getcwd()
+        self.files = {}  # type: dict
+        self.changed = False
+        if os.path.exists(self.path):
+            import json
+
+            try:
+                with open(self.path) as f:
+                    self.files = json.load(f)
+            except ValueError:  # Broken file, rebuild it
+                pass
+
+    @staticmethod
+    def default_path():
+        cache_dir = os.getenv("RSTRIP_CACHE_DIR") or os.path.join(
+            os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "rstrip"
+        )
+        return os.path.join(cache_dir, "index.json")
+
+    @staticmethod
+    def sha1(fn):
+        import hashlib
+
+        h = hashlib.sha1()
+        with open(fn, "rb") as f:
+            for chunk in iter(lambda: f.read(MMAP_THRESHOLD), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def key(self, fn):
+        # Cheaper than os.path.abspath, paths from pathlib/git are normalized
+        return os.path.join(self.cwd, str(fn))
+
+    def unchanged(self, fn, linesep):
+        key = self.key(fn)
+        record = self.files.get(key)
+        if record is None or record[3] != linesep:
+            return False
+        st = os.stat(key)
+        if record[1] != st.st_size:
+            return False
+        if record[0] == st.st_mtime_ns:
+            return True
+        if record[2] != self.sha1(key):  # Touched or racy, check the content
+            return False
+        self.update(fn, linesep, record[4], self.stat(key, record[2]))
+        return True
+
+    @classmethod
+    def stat(cls, fn, sha1=""):
+        """[mtime_ns, size, sha1] of file, sha1 is computed if not given"""
+        st = os.stat(fn)
+        mtime = st.st_mtime_ns
+        if time.time() - st.st_mtime < cls.racy:
+            mtime = None
+        return [mtime, st.st_size, sha1 or cls.sha1(fn)]
+
+    def update(self, fn, linesep, status, stat=None):
+        key = self.key(fn)
+        self.files[key] = (stat or self.stat(key)) + [linesep, status]
+        self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        import json
+
+        dirpath = os.path.dirname(self.path)
+        if not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+        tmp = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(self.files, f)
+        os.replace(tmp, self.path)
+        self.changed = False
+
+
+def git_changed_files(paths):
+    """Files that were modified/added according to git, under the paths
+
+    :return: None if it is not in a git repository
+    """
+    import subprocess
+
+    def succeed(cmd):
+        with open(os.devnull, "w") as devnull:
+            try:
+                return subprocess.call(cmd.split(), stdout=devnull, stderr=devnull) == 0
+            except OSError:  # git is not installed
+                return False
+
+    if not succeed("git rev-parse --is-inside-work-tree"):
+        return None
+    # -z: paths are not quoted, otherwise non-ascii ones are escaped
+    if succeed("git rev-parse --quiet --verify HEAD"):
+        tracked = "git diff -z --name-only --relative --diff-filter=d HEAD --"
+    else:  # No commit yet, all of the staged files are new
+        tracked = "git ls-files -z --cached --"
+    cmds = [tracked, "git ls-files -z --others --exclude-standard --"]
+    files = []  # type: list[str]
+    seen = set()
+    for cmd in cmds:
+        out = subprocess.check_output(cmd.split() + list(paths))
+        for name in os.fsdecode(out).split("\0"):
+            if name and name not in seen and os.path.isfile(name):
+                seen.add(name)
+                files.append(name)
+    return files
 
 
 def is_hidden(dir_or_file):
@@ -98,94 +569,178 @@ def parse_args():
     )
     parser.add_argument("-d", "--dir", default="", help="The directory path")
     parser.add_argument("-b", "--br", default="", help=r"Line break(Example: '\r\n')")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes (0 means the number of CPUs)",
+    )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="Skip files whose mtime/size/hash not changed since last run",
+    )
+    parser.add_argument(
+        "--changed",
+        action="store_true",
+        help="Only the files changed according to `git diff --name-only`",
+    )
     parser.add_argument(
         "files",
-        nargs="+",
+        nargs="*",
         default=[],
         metavar="*.py",
-        help="files or directories",
+        help="files or directories, `-` means stdin to stdout",
     )
     return parser.parse_args()
 
 
-def only_files(paths):
-    return [i for i in paths if i.is_file()]
+def glob_to_regex(pattern):
+    """Translate glob of path to regex: `*` does not match `/`, `**` matches
+    any directories(or any files if it's the last part)
+    """
+    parts = pattern.strip("/").split("/")
+    regex = ""
+    for index, part in enumerate(parts):
+        is_last = index == len(parts) - 1
+        if part == "**":
+            regex += ".+" if is_last else "(?:[^/]+/)*"
+            continue
+        i = 0
+        while i < len(part):
+            c = part[i]
+            i += 1
+            if c == "*":
+                regex += "[^/]*"
+            elif c == "?":
+                regex += "[^/]"
+            elif c == "[" and "]" in part[i + 1 :]:
+                end = part.index("]", i + 1)
+                chars = part[i:end]
+                regex += "[{}]".format("^" + chars[1:] if chars[:1] == "!" else chars)
+                i = end + 1
+            else:
+                regex += re.escape(c)
+        if not is_last:
+            regex += "/"
+    return regex
+
+
+class PathMatcher(object):
+    """All of the patterns are compiled into one regex, which is matched with
+    the files found by walking each root directory once
+    """
+
+    def __init__(self):
+        self.roots = {}  # type: dict  # root -> max depth, None for unlimited
+        self.regexes = []  # type: list[str]
+        self.files = []  # type: list[str]  # Given files that need not match
+        self._regex = None
+
+    def add(self, root, pattern):
+        root = os.path.normpath(root)
+        prefix = "" if root == "." else re.escape(root.replace(os.sep, "/")) + "/"
+        self.regexes.append(prefix + glob_to_regex(pattern))
+        depth = None if "**" in pattern else pattern.strip("/").count("/") + 1
+        if root in self.roots:
+            old = self.roots[root]
+            depth = None if old is None or depth is None else max(old, depth)
+        self.roots[root] = depth
+
+    def match(self, path):
+        if self._regex is None:
+            self._regex = re.compile("(?:{})$".format("|".join(self.regexes)))
+        return self._regex.match(path.replace(os.sep, "/")) is not None
+
+    def walk(self, root, depth):
+        """Yield files under root, hidden directories are skipped"""
+        stack = [(root, 1)]
+        while stack:
+            dirpath, level = stack.pop()
+            try:
+                entries = sorted(os.scandir(dirpath), key=lambda e: e.name)
+            except OSError:
+                continue
+            subdirs = []
+            for entry in entries:
+                path = entry.path[2:] if dirpath == "." else entry.path
+                if entry.is_dir(follow_symlinks=False):
+                    if (depth is None or level < depth) and not is_hidden(entry.name):
+                        subdirs.append((path, level + 1))
+                elif entry.is_file():
+                    yield path
+            stack.extend(reversed(subdirs))
+
+    @staticmethod
+    def is_walked(root, walked):
+        """Whether the files of root have been yielded by walking `walked`"""
+        if walked == ".":
+            if os.path.isabs(root) or root == ".." or root.startswith(".." + os.sep):
+                return False
+            relpath = root
+        elif root.startswith(walked + os.sep):
+            relpath = root[len(walked) + 1 :]
+        else:
+            return False
+        return not is_hidden(relpath)  # Hidden directories are not walked
+
+    def find(self):
+        """Yield the matched files without duplication, as soon as found"""
+        seen = set()
+        for path in self.files:
+            if path not in seen:
+                seen.add(path)
+                yield path
+        walked = []  # type: list[str]  # Roots walked without depth limit
+        for root in sorted(self.roots):
+            if any(self.is_walked(root, i) for i in walked):
+                continue
+            depth = self.roots[root]
+            if depth is None:
+                walked.append(root)
+            for path in self.walk(root, depth):
+                if path not in seen and self.match(path):
+                    seen.add(path)
+                    yield path
+
+
+def split_glob(pattern):
+    """'src/*/tests/*.py' -> ('src', '*/tests/*.py')"""
+    parts = pattern.split("/")
+    index = 0
+    while index < len(parts) - 1 and not re.search(r"[*?[]", parts[index]):
+        index += 1
+    root = "/".join(parts[:index]) or ("/" if pattern.startswith("/") else ".")
+    return root, "/".join(parts[index:])
 
 
 def get_filepaths(args):
-    try:
-        from pathlib import Path
-    except ImportError:
-        from pathlib2 import Path  # ty: ignore[unresolved-import]
-
-    fpaths = []
-    if args.dir:
-        parent = Path(args.dir)
-        if not parent.exists():
-            raise Exception("Directory `{}` not exists!".format(args.dir))
-    else:
-        parent = Path()
-    # to be optimize
+    """Yield the files of args, see examples at the docstring of this module"""
+    parent = args.dir or "."
+    if not os.path.exists(parent):
+        raise Exception("Directory `{}` not exists!".format(args.dir))
+    file_type = args.type
+    if file_type != "*":
+        file_type = "*." + file_type.lstrip("*").lstrip(".")
+    matcher = PathMatcher()
     for i in args.files:
         if "*" not in i:
-            p = Path(i) if i.startswith("/") else (parent / i)
-            if p.exists():
-                if p.is_file():
-                    fpaths.append(p)
-                elif p.is_dir():
-                    if args.type != "*":
-                        args.type = "*." + args.type.lstrip("*").lstrip(".")
-                    if args.R:
-                        fpaths += list(p.rglob(args.type))
-                    else:
-                        fpaths += only_files(p.glob(args.type))
-        else:
-            if "**" in i:
-                if i.startswith("**"):
-                    i = i.lstrip("*").lstrip("/") or "*"
-                    fpaths += list(Path().rglob(i))
-                else:
-                    if i.endswith("**") or i.endswith("**/"):
-                        i = i.rstrip("/").rstrip("*")
-                        fpaths += list(Path(i).rglob("*"))
-                    else:
-                        ps = i.split("/**/")
-                        assert len(ps) == 2, (
-                            "Invalid pattern! Must sure only one double `*`."
-                        )
-                        fpaths += list(Path(ps[0]).rglob(ps[1]))
-            else:
-                if i == "*" or i.startswith("*."):
-                    fpaths += only_files(Path().glob(i))
-                elif i.startswith("*/"):
-                    suffix = i.lstrip("*").lstrip("/") or "*"
-                    for j in Path().glob("*"):
-                        if j.is_file():
-                            fpaths.append(j)
-                        elif j.is_dir():
-                            fpaths += only_files(j.glob(suffix))
-                elif i.endswith("*/"):
-                    suffix = "*"
-                    i = i.rstrip("/").rstrip("*")
-                    ps = i.split("/*/")
-                    assert len(ps) < 3, "Too many `*`!"
-                    root = Path(ps[0])
-                    if len(ps) == 1:
-                        fpaths += only_files(root.glob(suffix))
-                    else:
-                        for j in root.glob("*"):
-                            j = j / ps[1]
-                            if j.is_dir():
-                                fpaths += only_files(j.glob(suffix))
-                else:
-                    ps = i.split("/*/")
-                    assert 3 > len(ps) > 1, "Invalid `*` pattern!"
-                    root = Path(ps[0])
-                    suffix = ps[-1]
-                    for j in root.glob("*"):
-                        if j.is_dir():
-                            fpaths += only_files(j.glob(suffix))
-    return fpaths
+            p = os.path.normpath(i if i.startswith("/") else os.path.join(parent, i))
+            if os.path.isfile(p):
+                matcher.files.append(p)
+            elif os.path.isdir(p):
+                matcher.add(p, "**/" + file_type if args.R else file_type)
+            continue
+        if "**" not in i:
+            if i.startswith("*/"):  # Files of current directory and `*/suffix`
+                matcher.add(".", "*")
+                i = "*/" + (i.lstrip("*").lstrip("/") or "*")
+            elif i.endswith("*/"):  # Files in the directory
+                i = i[:-1]
+        matcher.add(*split_glob(i.rstrip("/")))
+    return matcher.find()
 
 
 def main():
@@ -206,20 +761,49 @@ def main():
                 print("br must be one of this: {}".format(choices))
                 return
             linesep = "\r\n" if linesep == LineBreakChoices.win else "\n"
-    files = get_filepaths(args)
+    if args.files == ["-"]:
+        rstrip_stream(sys.stdin.buffer, sys.stdout.buffer, linesep or os.linesep)
+        return
+    if args.changed:
+        files = git_changed_files(args.files)
+        if files is None:
+            print("--changed only works in a git repository.")
+            return 1
+        if args.type != "*":
+            files = [i for i in files if is_required_file_type(i, args.type)]
+    elif not args.files:
+        print("At least one file or directory is required.")
+        return
+    else:
+        files = get_filepaths(args)
     count_skip = count_rstrip = 0
-    for fn in files:
-        try:
-            rstrip_file(fn, linesep=linesep)
-        except ContentException as e:
-            count_skip += 1
-            print("{}: skip! {}".format(fn, e))
-        except UnicodeDecodeError as e:
-            count_skip += 1
-            print("{}: failed! {}".format(fn, e))
-        else:
+    index = None
+    if args.incremental:
+        index = FileIndex()
+        sep = linesep or os.linesep
+        unchanged = []  # type: list[str]
+
+        def changed_files(files):
+            for fn in files:
+                if index.unchanged(fn, sep):
+                    unchanged.append(fn)
+                else:
+                    yield fn
+
+        files = changed_files(files)
+    indexed = index is not None
+    for fn, status, reason, stat in process_files(files, linesep, args.jobs, indexed):
+        if status == "rstriped":
             count_rstrip += 1
             print("{}: rstriped.".format(fn))
+        else:
+            count_skip += 1
+            print("{}: {}! {}".format(fn, status, reason))
+        if index is not None:
+            index.update(fn, sep, status, stat)
+    if index is not None:
+        count_skip += len(unchanged)
+        index.save()
     print("Done! {} skiped, {} rstriped.".format(count_skip, count_rstrip))
 
 
@@ -227,4 +811,4 @@ if __name__ == "__main__":
     if sys.version < "3":
         os.system("python3 " + " ".join(sys.argv))
     else:
-        main()
+        sys.exit(main())
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+"""Run shell commands, shared by the scripts of carstino.
+
+Support Python2.7 and 3.6+ (the asyncio API requires 3.7+)
+
+Usage::
+    >>> from runner import capture_output, run, run_and_echo, run_many
+    >>> capture_output("echo hello")
+    'hello'
+    >>> r = run("pip --version", timeout=10)
+    >>> r.rc, r.stdout, r.elapsed
+    >>> [r.ok for r in run_many(["uv --version", "pdm --version"])]
+    >>> # In a coroutine:
+    >>> results = await arun_many(["uv --version", "pdm --version"])
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Any, Callable, Optional, Sequence, Union  # NOQA:F401
+
+MAX_OUTPUT = 1024 * 1024  # Bytes to keep for each of stdout/stderr
+JOBS = 8
+IS_WINDOWS = sys.platform == "win32"
+
+
+def decode(bf):
+    # type: (bytes) -> str
+    if not isinstance(bf, bytes) or str is bytes:  # For python2
+        return bf  # type:ignore
+    try:
+        return bf.decode()
+    except UnicodeDecodeError:
+        return bf.decode("gbk", errors="ignore")
+
+
+class Result(object):
+    def __init__(self, cmd, rc, stdout="", stderr="", elapsed=0.0, timed_out=False):
+        # type: (Union[str, list[str]], int, str, str, float, bool) -> None
+        self.cmd = cmd
+        self.rc = rc
+        self.stdout = stdout
+        self.stderr = stderr
+        self.elapsed = elapsed
+        self.timed_out = timed_out
+
+    @property
+    def ok(self):
+        # type: () -> bool
+        return self.rc == 0
+
+    def __repr__(self):
+        # type: () -> str
+        return "<Result rc={} elapsed={:.3f}s{} cmd={!r}>".format(
+            self.rc, self.elapsed, " (timeout)" if self.timed_out else "", self.cmd
+        )
+
+
+class Buffer(object):
+    """Keep the last `limit` bytes of a stream"""
+
+    def __init__(self, limit=MAX_OUTPUT):
+        # type: (int) -> None
+        from collections import deque
+
+        self.limit = limit
+        self.chunks = deque()  # type: deque[bytes]
+        self.size = 0
+        self.dropped = 0
+
+    def add(self, chunk):
+        # type: (bytes) -> None
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        while self.size > self.limit and len(self.chunks) > 1:
+            self.size -= len(self.chunks[0])
+            self.dropped += len(self.chunks.popleft())
+
+    def getvalue(self):
+        # type: () -> bytes
+        value = b"".join(self.chunks)
+        return value[-self.limit :] if len(value) > self.limit else value
+
+
+def pump(stream, buffer, on_line=None):
+    # type: (Any, Buffer, Optional[Callable[[str], Any]]) -> None
+    for line in iter(stream.readline, b""):
+        buffer.add(line)
+        if on_line is not None:
+            on_line(decode(line).rstrip("\r\n"))
+    stream.close()
+
+
+def run(
+    cmd,
+    timeout=None,
+    echo=False,
+    on_line=None,
+    max_output=MAX_OUTPUT,
+    cwd=None,
+    env=None,
+):
+    # type: (Union[str, list[str]], Optional[float], bool, Optional[Callable[[str], Any]], int, Optional[str], Optional[dict[str, str]]) -> Result
+    """Run command(by shell if it's a string) and capture its output.
+
+    :param timeout: kill the command after seconds
+    :param on_line: called with each line of stdout when it comes out
+    :param max_output: only the last bytes of stdout/stderr are kept
+    """
+    if echo:
+        print("--> {}".format(" ".join(cmd) if isinstance(cmd, (list, tuple)) else cmd))
+        sys.stdout.flush()
+    start = time.time()
+    # New session, so that timeout kills the children of shell too
+    new_session = timeout is not None and not IS_WINDOWS
+    try:
+        p = subprocess.Popen(
+            cmd,
+            shell=not isinstance(cmd, (list, tuple)),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            env=env,
+            preexec_fn=os.setsid if new_session else None,
+        )
+    except OSError as e:
+        return Result(cmd, 127, "", str(e), time.time() - start)
+    out, err = Buffer(max_output), Buffer(max_output)
+    threads = [
+        threading.Thread(target=pump, args=(p.stdout, out, on_line)),
+        threading.Thread(target=pump, args=(p.stderr, err)),
+    ]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    expired = []  # type: list[bool]
+    timer = None
+    if timeout is not None:
+
+        def kill():
+            # type: () -> None
+            expired.append(True)
+            if new_session:
+                os.killpg(p.pid, signal.SIGKILL)
+            else:
+                p.kill()
+
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+    try:
+        rc = p.wait()
+    finally:
+        if timer is not None:
+            timer.cancel()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    stdout, stderr = decode(out.getvalue()), decode(err.getvalue())
+    return Result(cmd, rc, stdout, stderr, elapsed, timed_out=bool(expired))
+
+
+def run_many(cmds, timeout=None, jobs=JOBS, **kw):
+    # type: (Sequence[Union[str, list[str]]], Optional[float], int, Any) -> list[Result]
+    """Run independent commands at the same time, results are in the same order"""
+    results = [None] * len(cmds)  # type: list[Any]
+    lock = threading.Lock()
+    todo = list(enumerate(cmds))
+
+    def worker():
+        # type: () -> None
+        while True:
+            with lock:
+                if not todo:
+                    return
+                index, cmd = todo.pop(0)
+            results[index] = run(cmd, timeout, **kw)
+
+    threads = [threading.Thread(target=worker) for _ in range(min(jobs, len(cmds)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def arun(cmd, timeout=None, **kw):
+    # type: (Union[str, list[str]], Optional[float], Any) -> Any
+    """Awaitable version of `run`"""
+    import asyncio
+    import functools
+
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(None, functools.partial(run, cmd, timeout, **kw))
+
+
+def arun_many(cmds, timeout=None, jobs=JOBS, **kw):
+    # type: (list[Union[str, list[str]]], Optional[float], int, Any) -> Any
+    """Awaitable version of `run_many`"""
+    import asyncio
+    import functools
+
+    loop = asyncio.get_running_loop()
+    func = functools.partial(run_many, cmds, timeout, jobs, **kw)
+    return loop.run_in_executor(None, func)
+
+
+def capture_output(cmd, verbose=False, timeout=None):
+    # type: (Union[str, list[str]], bool, Optional[float]) -> str
+    return run(cmd, timeout, echo=verbose).stdout.strip()
+
+
+def run_and_echo(cmd, dry=False):
+    # type: (str, bool) -> int
+    """Print the command then run it, output goes to the terminal directly"""
+    print("--> " + cmd)
+    sys.stdout.flush()
+    if dry:
+        return 0
+    return subprocess.call(cmd, shell=True)
+
+
+def main():
+    # type: () -> int
+    """Run the commands of argv concurrently: python runner.py 'uv -V' 'pdm -V'"""
+    results = run_many(sys.argv[1:], echo=True)
+    for r in results:
+        print(r)
+        if r.stdout:
+            print(r.stdout)
+    return 0 if all(r.ok for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
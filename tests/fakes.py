@@ -0,0 +1,86 @@
+"""Fakes shared by the tests of pip_conf"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+
+import pip_conf
+
+WHEEL = pip_conf.MirrorSpeed.wheel
+WHEEL_BODY = b"x" * 10240
+SHA256 = hashlib.sha256(WHEEL_BODY).hexdigest()
+SIX_PAGE = f'<a href="../../packages/{WHEEL}#sha256={SHA256}">{WHEEL}</a>'
+
+
+PIP_FILES = ["pip-25.0.tar.gz", "pip-25.1.tar.gz", "pip-25.2.tar.gz"]
+
+
+class FakeMirror(BaseHTTPRequestHandler):
+    delay = 0.0
+    serial: int | None = 100  # Last serial of project pip
+    releases = len(PIP_FILES)
+    ranges: list[str] = []
+    wheel_status = 200
+    wheel_body = WHEEL_BODY
+
+    def reply(self, status: int, body: bytes = b"", content_type="text/html"):
+        time.sleep(self.delay)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_HEAD(self) -> None:
+        self.reply(200)
+
+    def do_GET(self) -> None:
+        if self.path.endswith("/simple/"):
+            self.reply(200, b"<html></html>")
+        elif self.path.endswith("/simple/six/"):
+            self.reply(200, SIX_PAGE.encode())
+        elif self.path.endswith("/simple/pip/"):
+            self.reply_pip_page()
+        elif self.path.endswith(WHEEL):
+            content_type = "application/octet-stream"
+            if self.headers.get("Range"):
+                self.ranges.append(self.headers["Range"])
+                start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+                self.reply(206, WHEEL_BODY[start:], content_type)
+            else:
+                self.reply(self.wheel_status, self.wheel_body, content_type)
+        else:
+            self.reply(404)
+
+    def reply_pip_page(self) -> None:
+        files = PIP_FILES[: self.releases]
+        if "json" in self.headers.get("Accept", "") and self.serial is not None:
+            data = {
+                "meta": {"api-version": "1.0", "_last-serial": self.serial},
+                "files": [{"filename": i} for i in files],
+            }
+            content_type = "application/vnd.pypi.simple.v1+json"
+            self.reply(200, json.dumps(data).encode(), content_type)
+        else:
+            links = "".join(f'<a href="/packages/{i}">{i}</a>' for i in files)
+            self.reply(200, f"<html>{links}</html>".encode())
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def fake_command(bin_dir: Path, name: str, version: str) -> None:
+    script = bin_dir / name
+    log = bin_dir / "calls.log"
+    script.write_text(
+        "#!/bin/sh\n"
+        f'echo "{name} $*" >> {log}\n'
+        f'[ "$1" = "--version" ] && echo "{name} {version}"\n'
+        "exit 0\n"
+    )
+    script.chmod(0o755)
@@ -0,0 +1,151 @@
+"""Wall time of mirror selection and config writing against a fake network.
+
+The baselines in tests/benchmarks.json were measured on one machine, so the
+costs are only compared with them when PIP_CONF_BENCH=1 (otherwise they are
+printed only). Run with PIP_CONF_BENCH_SAVE=1 to record new baselines after
+an intended change.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from argparse import Namespace
+from collections.abc import Callable, Iterator
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+from random import Random
+
+import pytest
+
+import pip_conf
+from tests.fakes import FakeMirror, fake_command
+
+BASELINE_FILE = Path(__file__).with_name("benchmarks.json")
+TOLERANCE = float(os.getenv("PIP_CONF_BENCH_TOLERANCE", "3"))
+SLACK = 0.05  # Seconds, so that the tiny ones do not fail because of noise
+INNER_HOSTS = {
+    name: pip_conf.get_source_host(name).split("/")[0]
+    for name in ("hw_inner", "tx_ecs", "ali_ecs")
+}
+# Inner mirrors that can be reached in each scenario, with their delay and loss
+SCENARIOS: dict[str, dict[str, dict[str, float]]] = {
+    "inner": {"tx_ecs": {}},
+    "slow_lossy": {"tx_ecs": {"delay": 0.1, "loss": 0.3}},
+    "all_inner": {"hw_inner": {}, "tx_ecs": {}, "ali_ecs": {}},
+    "dns_failed": {},
+}
+
+
+class FlakyMirror(FakeMirror):
+    loss = 0.0  # Probability of a request to be stalled then dropped
+    stall = 0.3
+    random = Random(0)
+
+    def reply(self, status: int, body: bytes = b"", content_type="text/html"):
+        if self.random.random() < self.loss:
+            time.sleep(self.stall)
+            self.close_connection = True
+            return
+        super().reply(status, body, content_type)
+
+
+def measure(name: str, func: Callable[[], object], rounds: int = 3) -> float:
+    costs = []
+    for _ in range(rounds):
+        pip_conf.Resolver._answers = {}
+        start = time.perf_counter()
+        func()
+        costs.append(time.perf_counter() - start)
+    cost = min(costs)
+    saved = json.loads(BASELINE_FILE.read_text())
+    print(f"{name}: {cost:.3f}s (baseline: {saved.get(name)})")
+    if os.getenv("PIP_CONF_BENCH_SAVE"):
+        saved[name] = cost
+        BASELINE_FILE.write_text(json.dumps(saved, indent=2, sort_keys=True) + "\n")
+    elif os.getenv("PIP_CONF_BENCH") and name in saved:
+        assert cost <= saved[name] * TOLERANCE + SLACK, "Slower than baseline"
+    return cost
+
+
+@pytest.fixture(params=SCENARIOS)
+def network(request, monkeypatch, tmp_path) -> Iterator[str]:
+    """Route the inner mirrors of the scenario to local fake mirrors."""
+    monkeypatch.setenv("PIP_CONF_CACHE_DIR", str(tmp_path))
+    monkeypatch.setenv("PIP_CONF_CACHE_TTL", "0")  # Cold path every round
+    monkeypatch.setattr(pip_conf.ProbeCache, "ttl", None)
+    monkeypatch.setattr(sys, "argv", ["pip_conf.py"])
+    servers = {}
+    for name, attrs in SCENARIOS[request.param].items():
+        handler = type("Handler", (FlakyMirror,), dict(attrs, random=Random(0)))
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers[INNER_HOSTS[name]] = server
+    real = socket.getaddrinfo
+
+    def getaddrinfo(host, port, family=0, *args, **kw):
+        if host in ("localhost", "127.0.0.1"):
+            return real(host, port, family, *args, **kw)
+        if host not in servers or family == socket.AF_INET6:
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        addr = ("127.0.0.1", servers[host].server_address[1])
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", addr)]
+
+    monkeypatch.setattr(socket, "getaddrinfo", getaddrinfo)
+    yield request.param
+    for server in servers.values():
+        server.shutdown()
+        server.server_close()
+
+
+def test_smart_detect(request, network):
+    measure(request.node.name, lambda: pip_conf.smart_detect("tx", is_windows=False))
+    if network != "slow_lossy":
+        inner = pip_conf.smart_detect("tx", is_windows=False)[1]
+        assert inner is bool(SCENARIOS[network])
+
+
+def test_build_index_url(request, network):
+    measure(request.node.name, lambda: pip_conf.build_index_url("tx", force=False))
+
+
+@pytest.mark.parametrize("tool", ["pip", "uv", "pdm", "poetry"])
+def test_init_pip_conf(request, tool, tmp_path, monkeypatch):
+    bin_dir, home = tmp_path / "bin", tmp_path / "home"
+    bin_dir.mkdir()
+    for name, version in [("uv", "0.9.0"), ("pdm", "2.26.0"), ("poetry", "2.2.1")]:
+        fake_command(bin_dir, name, version)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("HOME", str(home))
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(home / ".config"))
+    monkeypatch.delenv("PIP_CONFIG_FILE", raising=False)
+    monkeypatch.setattr(pip_conf.sys, "prefix", str(tmp_path / "venv"))
+    monkeypatch.setattr(sys, "argv", ["pip_conf.py"])
+    monkeypatch.chdir(tmp_path)
+    url = "https://pypi.tuna.tsinghua.edu.cn/simple/"
+    kw = {} if tool == "pip" else {tool: True}
+    measure(request.node.name, lambda: pip_conf.init_pip_conf(url, replace=True, **kw))
+
+
+def test_auto_detect_tool(request, tmp_path, monkeypatch):
+    deps = "".join(f'    "package-{i}>={i}.0",\n' for i in range(20_000))
+    (tmp_path / "pyproject.toml").write_text(
+        f'[project]\nname = "big"\ndependencies = [\n{deps}]\n\n'
+        "[tool.ruff]\nline-length = 88\n\n[tool.pdm]\ndistribution = false\n\n"
+        '[build-system]\nrequires = ["pdm-backend"]\n'
+    )
+    (tmp_path / "uv.lock").touch()
+    (tmp_path / "pdm.lock").touch()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(pip_conf, "is_command_exists", lambda tool: True)
+
+    def detect():
+        args = pip_conf.auto_detect_tool(Namespace(tool="auto", verbose=False))
+        assert args.pdm
+
+    measure(request.node.name, detect)
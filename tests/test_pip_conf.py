@@ -0,0 +1,750 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from argparse import Namespace
+from collections.abc import Iterator
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+import pip_conf
+from tests.fakes import SHA256, WHEEL, WHEEL_BODY, FakeMirror, fake_command
+
+ROOT = Path(__file__).parent.parent
+IMPORT_TIME_BUDGET = 50_000  # microseconds, cumulative of `import pip_conf`
+HEAVY_MODULES = {"argparse", "asyncio", "platform", "pprint", "socket", "subprocess"}
+
+
+def start_mirror(delay: float = 0.0, **attrs) -> ThreadingHTTPServer:
+    handler = type("Handler", (FakeMirror,), dict(attrs, delay=delay))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def host_of(server: ThreadingHTTPServer) -> str:
+    return f"127.0.0.1:{server.server_address[1]}/pypi"
+
+
+@pytest.fixture(autouse=True)
+def probe_cache(tmp_path, monkeypatch) -> Iterator[type[pip_conf.ProbeCache]]:
+    monkeypatch.setenv("PIP_CONF_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(pip_conf.ProbeCache, "_data", None)
+    monkeypatch.setattr(pip_conf.ProbeCache, "ttl", None)
+    monkeypatch.setattr(pip_conf.Resolver, "_answers", {})
+    monkeypatch.setattr(pip_conf.Freshness, "_reference", {})
+    yield pip_conf.ProbeCache
+    pip_conf.ProbeCache.save()
+
+
+@pytest.fixture
+def mirrors() -> Iterator[tuple[ThreadingHTTPServer, ThreadingHTTPServer]]:
+    fast, slow = start_mirror(), start_mirror(delay=0.5)
+    yield fast, slow
+    fast.shutdown()
+    slow.shutdown()
+
+
+def test_probe_prefer_priority(mirrors):
+    fast, slow = mirrors
+    candidates = [
+        ("bad", "not-exist.invalid/pypi"),
+        ("slow", host_of(slow)),
+        ("fast", host_of(fast)),
+    ]
+    assert pip_conf.MirrorProbe(candidates, timeout=3).run() == "slow"
+
+
+def test_probe_cost_one_timeout(mirrors):
+    fast, slow = mirrors
+    candidates = [("slow", host_of(slow)), ("fast", host_of(fast))]
+    start = time.time()
+    assert pip_conf.MirrorProbe(candidates, timeout=0.2).run() == "fast"
+    assert time.time() - start < 0.5
+
+
+def test_probe_strict_deadline(monkeypatch, mirrors):
+    fast, _ = mirrors
+    monkeypatch.setenv("PIP_CONF_STRICT_PROBE", "1")
+    monkeypatch.setattr(pip_conf.MirrorProbe, "strict_factor", 20)
+    # Slower than one timeout, as the subprocess of pip download is
+    monkeypatch.setattr(
+        pip_conf.MirrorProbe, "pip_download", lambda self, host: time.sleep(0.3) or True
+    )
+    candidates = [("fast", host_of(fast))]
+    assert pip_conf.MirrorProbe(candidates, timeout=0.1).run() == "fast"
+
+
+def test_probe_nothing_reachable():
+    candidates = [("a", "not-exist.invalid"), ("b", "127.0.0.1:1/pypi")]
+    assert pip_conf.MirrorProbe(candidates, timeout=1).run() is None
+
+
+def index_url_of(server: ThreadingHTTPServer) -> str:
+    return f"http://{host_of(server)}/simple/"
+
+
+def test_rank_mirrors(mirrors):
+    fast, slow = mirrors
+    candidates = [
+        ("bad", "http://127.0.0.1:1/simple/"),
+        ("slow", index_url_of(slow)),
+        ("fast", index_url_of(fast)),
+    ]
+    ranked = pip_conf.rank_mirrors(candidates, timeout=3)
+    assert [i.name for i in ranked] == ["fast", "slow", "bad"]
+    assert ranked[0].throughput > 0 and ranked[-1].error
+
+
+def test_speed_test_candidates():
+    candidates = pip_conf.speed_test_candidates("https://example.com/simple/")
+    names = [name for name, _ in candidates]
+    assert "hw_inner" in names
+    assert "aliyun" not in names  # alias of ali
+    assert candidates[-1] == ("extra", "https://example.com/simple/")
+
+
+def test_probe_cache(mirrors, probe_cache):
+    fast, slow = mirrors
+    candidates = [("slow", host_of(slow)), ("fast", host_of(fast))]
+    assert pip_conf.MirrorProbe(candidates, timeout=3).run() == "slow"
+    probe_cache.save()
+    probe_cache._data = None  # Load from disk as a new process does
+    slow.shutdown()
+    start = time.time()
+    assert pip_conf.MirrorProbe(candidates, timeout=3).run() == "slow"
+    assert time.time() - start < 0.1
+    probe_cache.set("probe", "down.example.com", {"ok": False}, failed=True)
+    assert probe_cache.get("probe", "down.example.com") == {"ok": False}
+    key = probe_cache.build_key("probe", "down.example.com")
+    probe_cache._data[key]["time"] -= 100  # Older than negative_ttl
+    assert probe_cache.get("probe", "down.example.com") is None
+    assert probe_cache.get("probe", host_of(slow))["ok"] is True
+    probe_cache.ttl = 0
+    assert probe_cache.get("probe", host_of(slow)) is None
+
+
+def test_resolve_host_cached(probe_cache):
+    assert "127.0.0.1" in pip_conf.resolve_host("localhost")
+    probe_cache.set("dns", "pypi.example.invalid", ["10.0.0.1"])
+    assert pip_conf.resolve_host("pypi.example.invalid") == ["10.0.0.1"]
+
+
+def test_mirror_watcher(mirrors):
+    fast, slow = mirrors
+    active = start_mirror()
+    servers = {"active": active, "fast": fast, "slow": slow}
+    candidates = [(name, index_url_of(i)) for name, i in servers.items()]
+    applied: list[str] = []
+    watcher = pip_conf.MirrorWatcher(
+        index_url_of(active).rstrip("/"), candidates, applied.append, 0, timeout=3
+    )
+    watcher.run(rounds=2)
+    assert not applied  # Healthy, though not the fastest
+    active.shutdown()
+    active.server_close()
+    for _ in range(watcher.patience - 1):
+        assert watcher.step() is None
+    assert watcher.step() == index_url_of(fast)
+    assert applied == [index_url_of(fast)]
+    # Fast one becomes slower than the slow one: no flapping during cooldown
+    fast.RequestHandlerClass.delay = 1.0
+    for _ in range(3):
+        assert watcher.step() is None
+    assert watcher.switches == [(index_url_of(active), index_url_of(fast))]
+
+
+def test_freshness(monkeypatch, mirrors):
+    _, slow = mirrors
+    reference = start_mirror(serial=120)
+    monkeypatch.setenv("PIP_CONF_REFERENCE", index_url_of(reference))
+    stale = start_mirror(serial=None, releases=2)  # No serial, miss one release
+    assert pip_conf.Freshness.behind(index_url_of(slow)) == 20
+    assert pip_conf.Freshness.behind(index_url_of(stale)) == 1
+    assert not pip_conf.Freshness.is_stale(index_url_of(reference))
+    # Lag of normal sync delay is tolerated, serials by a much larger limit
+    assert not pip_conf.Freshness.is_stale(index_url_of(slow))
+    monkeypatch.setattr(pip_conf.Freshness, "max_lag", None)
+    monkeypatch.setattr(pip_conf.Freshness, "max_serial_lag", None)
+    monkeypatch.setenv("PIP_CONF_MAX_LAG", "1")
+    monkeypatch.setenv("PIP_CONF_MAX_SERIAL_LAG", "10")
+    assert not pip_conf.Freshness.is_stale(index_url_of(stale))
+    assert pip_conf.Freshness.is_stale(index_url_of(slow))
+    pip_conf.Freshness.max_lag = pip_conf.Freshness.max_serial_lag = 0
+    assert pip_conf.Freshness.is_stale(index_url_of(stale))
+    # Bad json page is treated as unknown instead of breaking the probe
+    portal = start_mirror(
+        reply_pip_page=lambda self: self.reply(200, b"<html>", "application/json")
+    )
+    assert pip_conf.Freshness.snapshot(index_url_of(portal)) is None
+    for server in (reference, stale, portal):
+        server.shutdown()
+
+
+def test_probe_prefer_fresh(monkeypatch, mirrors):
+    fast, _ = mirrors
+    fast.RequestHandlerClass.serial = 119
+    reference, stale = start_mirror(serial=120), start_mirror(serial=None, releases=2)
+    monkeypatch.setenv("PIP_CONF_REFERENCE", index_url_of(reference))
+    monkeypatch.setattr(pip_conf.Freshness, "max_lag", 0)
+    monkeypatch.setattr(pip_conf.Freshness, "max_serial_lag", 0)
+    monkeypatch.setenv("PIP_CONF_CHECK_FRESH", "1")
+    # Stale mirrors lose to the fresh ones, even if they come first or faster
+    candidates = [("fast", host_of(fast)), ("stale", host_of(stale))]
+    candidates.append(("reference", host_of(reference)))
+    assert pip_conf.MirrorProbe(candidates, timeout=3).run() == "reference"
+    ranked = pip_conf.rank_mirrors(
+        [("fast", index_url_of(fast)), ("ref", index_url_of(reference))], timeout=3
+    )
+    assert [i.name for i in ranked] == ["ref", "fast"]
+    # Stale mirror still wins when no fresh one reachable
+    assert pip_conf.MirrorProbe(candidates[:2], timeout=3).run() == "fast"
+    reference.shutdown()
+    stale.shutdown()
+
+
+def test_proxy_cache_lru(tmp_path):
+    cache = pip_conf.ProxyCache(str(tmp_path), max_bytes=250)
+    for key in "abc":
+        cache.set(key, key.encode() * 100, {})
+        if key == "b":
+            assert cache.get("a") is not None  # "b" is the least recently used
+    assert cache.get("b") is None
+    assert cache.size == 200
+    meta, body = pip_conf.ProxyCache(str(tmp_path), max_bytes=250).get("a") or ({}, b"")
+    assert body == b"a" * 100
+    assert meta["etag"] == hashlib.sha256(body).hexdigest()[:32]
+
+
+def test_proxy(tmp_path):
+    down, upstream = start_mirror(), start_mirror()
+    down.shutdown()
+    down.server_close()
+    cache = pip_conf.ProxyCache(str(tmp_path), max_bytes=1024 * 1024)
+    upstreams = [index_url_of(down), index_url_of(upstream)]
+    proxy = pip_conf.PypiProxy(upstreams, cache, timeout=3)
+    server = pip_conf.build_proxy_server(proxy, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    status, _, body, url = pip_conf.http_get(base + "/simple/Six/")
+    assert (status, url) == (200, base + "/simple/six/")
+    assert f'"/packages/six/{WHEEL}#sha256=' in body.decode()
+    wheel_path = "/packages/six/" + WHEEL
+    assert pip_conf.http_get(base + wheel_path)[2] == WHEEL_BODY
+    etag = proxy.handle(wheel_path)[1]["ETag"]
+    headers = {"If-None-Match": etag}
+    assert pip_conf.http_get(base + wheel_path, headers=headers)[0] == 304
+    # Served from cache when upstreams are gone
+    upstream.shutdown()
+    upstream.server_close()
+    assert pip_conf.http_get(base + wheel_path)[2] == WHEEL_BODY
+    assert pip_conf.http_get(base + "/simple/six/")[0] == 200
+    assert pip_conf.http_get(base + "/simple/nothing/")[0] == 404
+    server.shutdown()
+    server.server_close()
+
+
+def test_proxy_wheelhouse(tmp_path):
+    (tmp_path / "wheels").mkdir()
+    (tmp_path / "wheels" / WHEEL).write_bytes(WHEEL_BODY)
+    cache = pip_conf.ProxyCache(str(tmp_path / "cache"), max_bytes=1024)
+    proxy = pip_conf.PypiProxy([], cache, wheelhouse=str(tmp_path / "wheels"))
+    server = pip_conf.build_proxy_server(proxy, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    assert pip_conf.http_get(base + "/packages/six/" + WHEEL)[2] == WHEEL_BODY
+    assert cache.size == 0
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("configure", [False, True])
+def test_serve_configure_opt_in(monkeypatch, configure):
+    class Server:
+        server_address = ("127.0.0.1", 3141)
+
+        def serve_forever(self):
+            raise KeyboardInterrupt
+
+        def server_close(self):
+            pass
+
+    calls = []
+    monkeypatch.setattr(pip_conf, "rank_mirrors", lambda *a, **kw: [])
+    monkeypatch.setattr(pip_conf, "build_proxy_server", lambda *a: Server())
+    monkeypatch.setattr(pip_conf, "configure_all", lambda *a, **kw: calls.append(a))
+    assert pip_conf.serve(configure=configure) is None
+    assert calls == ([("http://127.0.0.1:3141/simple/",)] if configure else [])
+
+
+@pytest.mark.parametrize("broken", [{"wheel_status": 503}, {"wheel_body": b"bad"}])
+def test_proxy_file_failover(tmp_path, broken):
+    first, second = start_mirror(**broken), start_mirror()
+    cache = pip_conf.ProxyCache(str(tmp_path), max_bytes=1024 * 1024)
+    upstreams = [index_url_of(first), index_url_of(second)]
+    proxy = pip_conf.PypiProxy(upstreams, cache, timeout=3)
+    meta, fileobj = proxy.get_file("six", WHEEL) or ({}, None)
+    with fileobj:
+        assert fileobj.read() == WHEEL_BODY
+    assert cache.get("file:" + WHEEL) is not None
+    for server in (first, second):
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize(
+    "filename,expected",
+    [
+        ("six-1.17.0-py2.py3-none-any.whl", True),
+        ("x-1.0-cp311-cp311-manylinux_2_17_x86_64.manylinux2014_x86_64.whl", True),
+        ("x-1.0-cp39-abi3-manylinux_2_28_x86_64.whl", True),
+        ("x-1.0-cp312-cp312-manylinux_2_17_x86_64.whl", False),
+        ("x-1.0-cp311-cp311-win_amd64.whl", False),
+    ],
+)
+def test_is_compatible_wheel(filename, expected):
+    compatible = pip_conf.is_compatible_wheel(filename, (3, 11), "linux-x86_64")
+    assert compatible is expected
+
+
+UV_LOCK = """\
+version = 1
+
+[[package]]
+name = "six"
+version = "1.17.0"
+source = {{ registry = "https://pypi.org/simple" }}
+wheels = [
+    {{ url = "https://files.example.invalid/{1}", hash = "sha256:{2}", size = 10240 }},
+    {{ url = "https://files.example.invalid/six-1.17.0-cp27-cp27m-win32.whl", hash = "sha256:{0}" }},
+]
+
+[[package]]
+name = "Missing_Name"
+version = "1.0"
+source = {{ registry = "https://pypi.org/simple" }}
+wheels = [
+    {{ url = "http://127.0.0.1:1/missing-1.0-py3-none-any.whl", hash = "sha256:{0}" }},
+]
+"""
+POETRY_LOCK = """\
+[[package]]
+name = "six"
+version = "1.17.0"
+files = [
+    {{file = "six-1.17.0.tar.gz", hash = "sha256:{0}"}},
+    {{file = "{1}", hash = "sha256:{2}"}},
+]
+
+[metadata]
+content-hash = "{0}"
+"""
+
+
+def test_prefetch(tmp_path, mirrors):
+    fast, _ = mirrors
+    lock_file = tmp_path / "uv.lock"
+    lock_file.write_text(UV_LOCK.format("0" * 64, WHEEL, SHA256))
+    poetry_lock = tmp_path / "poetry.lock"
+    poetry_lock.write_text(POETRY_LOCK.format("0" * 64, WHEEL, SHA256))
+    items = pip_conf.parse_lock_file(str(poetry_lock))
+    assert [(i.project, i.filename, i.url) for i in items] == [("six", WHEEL, "")]
+    assert pip_conf.find_lock_file(str(tmp_path)) == str(lock_file)
+    dest = tmp_path / "wheels"
+    dest.mkdir()
+    (dest / (WHEEL + ".part")).write_bytes(WHEEL_BODY[:100])
+    prefetch = pip_conf.Prefetch(str(lock_file), index_url_of(fast), str(dest))
+    assert [i.project for i in prefetch.items] == ["six", "missing-name"]
+    assert prefetch.run() == 1
+    assert prefetch.items[1].status.startswith("failed: ")  # Fallback to lock url
+    assert fast.RequestHandlerClass.ranges == ["bytes=100-"]  # Resumed
+    assert (dest / WHEEL).read_bytes() == WHEEL_BODY
+    prefetch = pip_conf.Prefetch(str(lock_file), index_url_of(fast), str(dest))
+    prefetch.run()
+    assert prefetch.items[0].status == "cached"
+
+
+def test_trace(tmp_path, monkeypatch, mirrors):
+    monkeypatch.setattr(pip_conf.Tracer, "path", "trace.jsonl")
+    monkeypatch.setattr(pip_conf.Tracer, "spans", [])
+    pip_conf.http_get(index_url_of(mirrors[0]))
+    assert pip_conf.capture_output("echo hello") == "hello"
+    pip_conf.do_write(str(tmp_path / "pip.conf"), "[global]")
+    with pytest.raises(ZeroDivisionError), pip_conf.Tracer.span("probe", "x"):
+        1 / 0  # noqa: B018
+    spans = [json.loads(i) for i in pip_conf.Tracer.dumps().splitlines()]
+    assert [i["kind"] for i in spans] == ["http", "subprocess", "write", "probe"]
+    assert spans[1]["rc"] == 0 and spans[1]["name"] == "echo hello"
+    assert spans[3]["error"].startswith("ZeroDivisionError")
+    # Chrome trace format
+    monkeypatch.setattr(pip_conf.Tracer, "path", "trace.json")
+    events = json.loads(pip_conf.Tracer.dumps())["traceEvents"]
+    assert events[0]["args"] == {"name": "MainThread"}
+    assert [i["cat"] for i in events[1:]] == [i["kind"] for i in spans]
+
+
+def test_trace_cli(tmp_path):
+    env = dict(os.environ, HOME=str(tmp_path), XDG_CONFIG_HOME=str(tmp_path))
+    env.pop("PIP_CONFIG_FILE", None)
+    trace = tmp_path / "trace.jsonl"
+    r = subprocess.run(
+        [sys.executable, str(ROOT / "pip_conf.py"), "qh", "-f"]
+        + ["--trace-file", str(trace)],
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        encoding="utf-8",
+    )
+    assert "Trace of" in r.stdout, r.stderr
+    spans = [json.loads(i) for i in trace.read_text().splitlines()]
+    assert [i["kind"] for i in spans] == ["write"]
+    assert spans[0]["name"] == str(tmp_path / "pip" / "pip.conf")
+
+
+@pytest.mark.parametrize("flag", ["--prefetch", "--trace", "--recursive"])
+def test_flag_before_name(tmp_path, flag):
+    r = subprocess.run(
+        [sys.executable, str(ROOT / "pip_conf.py"), flag, "qh", "--url", "-f"],
+        cwd=tmp_path,
+        capture_output=True,
+        encoding="utf-8",
+    )
+    url = "https://pypi.tuna.tsinghua.edu.cn/simple/"
+    assert r.stdout.splitlines()[0] == url, r.stderr
+
+
+def fake_lookup(delays: dict[int, float], calls: list[str]):
+    answers: dict[int, list[str]] = {
+        socket.AF_INET: ["10.0.0.1"],
+        socket.AF_INET6: ["fd00::1"],
+    }
+
+    def lookup(domain: str, family: int) -> list[str]:
+        calls.append(domain)
+        if family not in delays:
+            return []
+        time.sleep(delays[family])
+        return answers[family]
+
+    return lookup
+
+
+def test_resolver_race(monkeypatch):
+    calls: list[str] = []
+    delays = {socket.AF_INET: 0.0, socket.AF_INET6: 0.01}
+    monkeypatch.setattr(pip_conf.Resolver, "lookup", fake_lookup(delays, calls))
+    threads = [
+        threading.Thread(target=pip_conf.resolve_host, args=("a.test",))
+        for _ in range(5)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert pip_conf.resolve_host("a.test") == ["fd00::1", "10.0.0.1"]
+    assert calls == ["a.test", "a.test"]  # Resolved once for all callers
+    # Expired after the TTL, both in memory and on disk
+    ttl = pip_conf.ProbeCache.get_ttl()
+    resolved_at, ips = pip_conf.Resolver._answers["a.test"]
+    pip_conf.Resolver._answers["a.test"] = (resolved_at - ttl - 1, ips)
+    pip_conf.ProbeCache.load()[pip_conf.ProbeCache.build_key("dns", "a.test")][
+        "time"
+    ] -= ttl + 1
+    assert pip_conf.resolve_host("a.test") == ["fd00::1", "10.0.0.1"]
+    assert calls == ["a.test"] * 4
+    # Slow AAAA does not block the A answer for long
+    delays = {socket.AF_INET: 0.0, socket.AF_INET6: 3.0}
+    monkeypatch.setattr(pip_conf.Resolver, "lookup", fake_lookup(delays, calls))
+    start = time.time()
+    assert pip_conf.resolve_host("slow.test") == ["10.0.0.1"]
+    assert time.time() - start < 0.5
+
+
+def test_resolver_timeout(monkeypatch, probe_cache):
+    delays = {socket.AF_INET: 1.0, socket.AF_INET6: 1.0}
+    monkeypatch.setattr(pip_conf.Resolver, "lookup", fake_lookup(delays, []))
+    monkeypatch.setattr(pip_conf.Resolver, "timeout", 0.1)
+    start = time.time()
+    assert pip_conf.resolve_host("timeout.test") == []
+    assert time.time() - start < 0.5
+    assert probe_cache.get("dns", "timeout.test") is None
+
+
+def test_check_mirror_by_http(mirrors):
+    fast, _ = mirrors
+    assert pip_conf.check_mirror_by_http(host_of(fast), timeout=3)
+    assert not pip_conf.check_mirror_by_http("127.0.0.1:1/pypi", timeout=3)
+    url = f"http://127.0.0.1:{fast.server_address[1]}/nothing/"
+    assert not pip_conf.check_mirror_by_http(url, timeout=3)  # 404 of project page
+
+
+def run_with_importtime(*args: str, cwd: Path = ROOT, **env: str):
+    environ = dict(os.environ, **env)
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=cwd,
+        env=environ,
+        capture_output=True,
+        encoding="utf-8",
+    )
+
+
+@pytest.mark.parametrize("args", ["--version", "--list", "-l --verbose", "--url -f"])
+def test_fast_path_lazy_import(args):
+    r = run_with_importtime("pip_conf.py", *args.split())
+    assert r.returncode == 0
+    assert r.stdout
+    imported = {line.split("|")[-1].strip() for line in r.stderr.splitlines()}
+    assert not imported & HEAVY_MODULES
+
+
+def test_import_time_budget(tmp_path):
+    env = {"PYTHONDONTWRITEBYTECODE": "", "PYTHONPYCACHEPREFIX": str(tmp_path)}
+    run_with_importtime("-c", "import pip_conf", **env)  # Compile to .pyc
+    cost = min(
+        int(
+            run_with_importtime("-c", "import pip_conf", **env)
+            .stderr.splitlines()[-1]
+            .split("|")[1]
+        )
+        for _ in range(3)
+    )
+    print(f"`import pip_conf` cost {cost}us, budget: {IMPORT_TIME_BUDGET}us")
+    assert cost < IMPORT_TIME_BUDGET
+
+
+def test_configure_all_tools(tmp_path):
+    bin_dir, home = tmp_path / "bin", tmp_path / "home"
+    bin_dir.mkdir()
+    home.mkdir()
+    fake_command(bin_dir, "uv", "0.9.0")
+    fake_command(bin_dir, "pdm", "2.26.0")
+    env = dict(
+        os.environ,
+        HOME=str(home),
+        XDG_CONFIG_HOME=str(home / ".config"),
+        PATH=f"{bin_dir}{os.pathsep}{os.environ['PATH']}",
+    )
+    cmd = [sys.executable, str(ROOT / "pip_conf.py"), "--tool=all", "-f", "qh"]
+    r = subprocess.run(
+        cmd + ["--dry"], cwd=tmp_path, env=env, capture_output=True, encoding="utf-8"
+    )
+    assert r.returncode == 0, r.stderr
+    assert not (home / ".config").exists()
+    assert "uv      0.9.0     dry-run" in r.stdout
+    r = subprocess.run(
+        cmd, cwd=tmp_path, env=env, capture_output=True, encoding="utf-8"
+    )
+    assert r.returncode == 0, r.stderr
+    url = "https://pypi.tuna.tsinghua.edu.cn/simple/"
+    assert url in (home / ".config" / "pip" / "pip.conf").read_text()
+    assert "pdm config pypi.url " + url in (bin_dir / "calls.log").read_text()
+    assert "poetry  -         skipped: not installed" in r.stdout
+
+
+def test_poetry_checks_run_concurrently(tmp_path, monkeypatch, capsys):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    fake_command(bin_dir, "pipx", "1.8.0")
+    poetry = bin_dir / "poetry"
+    poetry.write_text(
+        "#!/bin/sh\nsleep 0.5\n"
+        '[ "$1" = "self" ] && echo "  - poetry-plugin-pypi-mirror (0.6.1)"\n'
+        "exit 0\n"
+    )
+    poetry.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(pip_conf.System, "is_mac", staticmethod(lambda: True))
+    mirror = pip_conf.PoetryMirror("https://mirror.example.com/simple/", False, False)
+    start = time.time()
+    dirpath = mirror.get_dirpath(False, mirror.url)
+    assert time.time() - start < 1.2  # Not 3 x 0.5 seconds
+    assert dirpath and "pypoetry" in dirpath
+    assert capsys.readouterr().out.count("--> ") == 4
+
+
+def test_pyproject_scanner(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(pip_conf, "is_command_exists", lambda tool: True)
+    monkeypatch.setattr(os, "listdir", None)  # Locks are found by stat
+
+    def detect() -> list[str]:
+        args = pip_conf.auto_detect_tool(Namespace(tool="auto", verbose=False))
+        return [i for i in ("uv", "pdm", "poetry") if getattr(args, i, False)]
+
+    path = tmp_path / "pyproject.toml"
+    path.write_text("[tool.uv]\n[tool.pdm.dev-dependencies]\n[[tool.uv.index]]\n")
+    assert detect() == []
+    (tmp_path / "pdm.lock").touch()
+    assert detect() == ["pdm"]
+    (tmp_path / "uv.lock").touch()
+    assert pip_conf.PyprojectScanner.find_locks() == ["uv.lock", "pdm.lock"]
+    assert detect() == []
+    # Stop reading once build-backend is found
+    path.write_bytes(b'[build-system]\nbuild-backend = "poetry.core.masonry.api"\n')
+    with path.open("ab") as f:
+        f.write(b"[tool.uv]\n\xff\xfe not utf-8\n" * 1000)
+    assert pip_conf.PyprojectScanner.scan() == ("poetry", set())
+    assert detect() == ["poetry"]
+    (tmp_path / "uv.lock").unlink()
+    assert detect() == ["pdm"]  # Lock file wins
+
+
+UV_TOML = """\
+# Managed by hand
+cache-dir = "/data/uv"  # big disk
+
+[[index]]
+name = "corp"
+url = "https://corp.example.com/simple/"
+explicit = true
+
+[[index]]
+url = "https://old.example.com/simple/"
+default = true
+"""
+
+
+def test_uv_mirror_keep_unrelated(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path))
+    path = tmp_path / "uv" / "uv.toml"
+    path.parent.mkdir()
+    path.write_text(UV_TOML)
+    url = "http://mirrors.tencentyun.com/pypi/simple/"
+    extra = ("pypi.org", "https://pypi.org/simple/")
+    uv = pip_conf.UvMirror(url, False, replace=False, extra_info=extra)
+    uv.detected = True
+    assert uv.set() is None
+    assert path.read_text() == UV_TOML  # Not replaced without -y
+    uv.replace = True
+    assert uv.set() is None
+    text = path.read_text()
+    assert text.startswith("# Managed by hand\ncache-dir")
+    assert 'name = "corp"\nurl = "https://corp.example.com/simple/"' in text
+    assert f'url = "{url}"\ndefault = true' in text
+    assert text.count("[[index]]") == 3
+    assert uv.plan().skip == "already set"
+
+
+def test_poetry_mirror_toml(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    path = tmp_path / ".config" / "pypoetry" / "config.toml"
+    path.parent.mkdir(parents=True)
+    content = '[virtualenvs]\nin-project = true\n\n[plugins.pypi_mirror]\nurl = "{}"\n'
+    path.write_text(content.format("a"))
+    poetry = pip_conf.PoetryMirror("https://b/simple/", False, replace=True)
+    poetry.detected = True
+    monkeypatch.setattr(pip_conf, "capture_status", lambda cmd: (0, poetry.plugin_name))
+    assert poetry.set() is None
+    assert path.read_text() == content.format("https://b/simple/")
+
+
+def test_pip_config_by_file(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path))
+    monkeypatch.delenv("PIP_CONFIG_FILE", raising=False)
+    monkeypatch.setattr(pip_conf.sys, "prefix", str(tmp_path / "venv"))
+    path = tmp_path / "pip" / "pip.conf"
+    assert pip_conf.PipConfig.target() == str(path)
+    path.parent.mkdir()
+    path.write_text("[global]\ntimeout = 60\n\n[install]\nuser = true\n")
+    url = "http://mirrors.tencentyun.com/pypi/simple/"
+    assert pip_conf.config_by_file(url, extra_info=("e.com", "http://e.com/simple"))
+    items = pip_conf.PipConfig.list()
+    assert items["global.index-url"] == url
+    assert items["global.extra-index-url"] == "http://e.com/simple"
+    assert items["global.trusted-host"] == "mirrors.tencentyun.com e.com"
+    assert items["install.user"] == "true"
+    assert pip_conf.PipConfig.plan(url).skip == "already set"
+    site_file = tmp_path / "venv" / "pip.conf"
+    site_file.parent.mkdir()
+    site_file.touch()
+    assert pip_conf.PipConfig.target() == str(site_file)
+
+
+def test_fleet(tmp_path):
+    bin_dir, hosts = tmp_path / "bin", tmp_path / "hosts"
+    bin_dir.mkdir()
+    (bin_dir / "python3").symlink_to(sys.executable)
+    ssh = bin_dir / "fake-ssh"
+    # Stand-in of `ssh [-p port] host command`: every host is a home directory
+    ssh.write_text(
+        "#!/bin/sh\n"
+        '[ "$1" = "-p" ] && echo "port $2" && shift 2\n'
+        '[ "$1" = "down" ] && echo "Connection refused" && exit 255\n'
+        f"export HOME={hosts}/$1 XDG_CONFIG_HOME={hosts}/$1/.config\n"
+        'mkdir -p "$HOME" && exec sh -c "$2"\n'
+    )
+    ssh.chmod(0o755)
+    inventory = tmp_path / "inventory.txt"
+    inventory.write_text("# hosts\nh1\nh2:2222 -f ali --pip\n\ndown\nh3  # last\n")
+    report = tmp_path / "report.json"
+    env = dict(
+        os.environ,
+        PIP_CONF_SSH=str(ssh),
+        PATH=f"{bin_dir}{os.pathsep}{os.environ['PATH']}",
+    )
+    cmd = [sys.executable, str(ROOT / "pip_conf.py"), "--fleet", str(inventory)]
+    cmd += ["--jobs=2", "-f", "qh", "--pip", "--report", str(report)]
+    r = subprocess.run(cmd, env=env, capture_output=True, encoding="utf-8")
+    assert r.returncode == 1, r.stderr
+    assert "Summary: 4 hosts, 1 failed" in r.stdout
+    for host, source in [("h1", "tsinghua"), ("h2", "aliyun"), ("h3", "tsinghua")]:
+        assert source in (hosts / host / ".config" / "pip" / "pip.conf").read_text()
+    results = {i["host"]: i for i in json.loads(report.read_text())}
+    assert list(results) == ["h1", "h2:2222", "down", "h3"]
+    assert results["h2:2222"]["output"].startswith("port 2222")
+    assert results["down"]["returncode"] == 255
+
+
+def test_monorepo(tmp_path, monkeypatch, capsys):
+    projects = {
+        "svc/api": '[project]\nname = "api"\n\n[tool.uv]\ndev-dependencies = []\n',
+        "svc/worker": '[build-system]\nbuild-backend = "pdm.backend"\n',
+        "libs/core": '[build-system]\nbuild-backend = "poetry.core.masonry.api"\n',
+        "libs/plain": '[project]\nname = "plain"\n',
+        "web/node_modules/pkg": "[tool.uv]\n",
+        ".venv/lib/pkg": "[tool.uv]\n",
+    }
+    for name, content in projects.items():
+        (tmp_path / name).mkdir(parents=True)
+        (tmp_path / name / "pyproject.toml").write_text(content)
+    (tmp_path / "svc/api/uv.lock").touch()
+    (tmp_path / "svc/api/pdm.lock").touch()  # Both locks, decided by pyproject
+    url = "http://mirrors.tencentyun.com/pypi/simple/"
+    repo = pip_conf.Monorepo(str(tmp_path), url, extra_info=None, jobs=2)
+    found = [os.path.relpath(i, tmp_path) for i, _ in repo.find_projects()]
+    assert found == ["libs/core", "libs/plain", "svc/api", "svc/worker"]
+    origin = (tmp_path / "svc/api/pyproject.toml").read_text()
+    with monkeypatch.context() as m:
+        m.setattr(sys, "argv", ["pip_conf.py", "--recursive", "--dry"])
+        assert repo.run() is None
+    assert capsys.readouterr().out.count("dry-run") == 2
+    assert (tmp_path / "svc/api/pyproject.toml").read_text() == origin
+    assert not (tmp_path / "svc/worker/pdm.toml").exists()
+    assert repo.run() is None
+    summary = capsys.readouterr().out.split("Summary:")[-1]
+    assert "svc/api                                 uv      written" in summary
+    assert "libs/core                               poetry  skipped" in summary
+    api = (tmp_path / "svc/api/pyproject.toml").read_text()
+    assert api.startswith('[project]\nname = "api"\n\n[tool.uv]\ndev-dependencies')
+    assert f'[[tool.uv.index]]\nurl = "{url}"\ndefault = true\n' in api
+    pdm = (tmp_path / "svc/worker/pdm.toml").read_text()
+    assert pdm == f'[pypi]\nurl = "{url}"\nverify_ssl = false\n'
+    assert repo.run() is None
+    assert capsys.readouterr().out.count("skipped: already set") == 2
+    other = pip_conf.Monorepo(str(tmp_path), "https://pypi.org/simple/")
+    assert other.plan_pdm(str(tmp_path / "svc/worker")).skip == "exists: " + url
+    other.replace = True
+    assert other.plan_uv(str(tmp_path / "svc/api")).text.count("[[tool.uv.index]]") == 1
+    plain = other.plan_uv(str(tmp_path / "libs/plain")).text
+    assert "[[tool.uv.index]]" in plain
+    assert "[tool.uv]" not in plain  # No empty parent table
@@ -0,0 +1,268 @@
+from __future__ import annotations
+
+import io
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import rstrip
+
+ROOT = Path(__file__).parent.parent
+
+
+def run_main(monkeypatch, capsys, *args: str) -> str:
+    monkeypatch.setattr(sys, "argv", ["rstrip.py", *args])
+    rstrip.main()
+    return capsys.readouterr().out
+
+
+@pytest.fixture(autouse=True)
+def sniffer(monkeypatch):
+    monkeypatch.setattr(rstrip.BinarySniffer, "seen", {})
+    monkeypatch.setattr(rstrip.BinarySniffer, "attributes", {})
+    return rstrip.BinarySniffer
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch) -> Path:
+    monkeypatch.chdir(tmp_path)
+    src = tmp_path / "src"
+    (src / "pkg").mkdir(parents=True)
+    for i in range(20):
+        (src / "pkg" / f"m{i}.py").write_text("a = 1  \n\n\n")
+    (src / "clean.py").write_bytes(b"a = 1\n")
+    (src / "empty.txt").write_bytes(b"")
+    (src / "image.bin").write_bytes(b"\xff\xd8\xff\xe0 jpeg")
+    return src
+
+
+def test_rstrip_file(tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_bytes(b"x  \r\ny\t\n\n\n")
+    rstrip.rstrip_file(str(path), linesep="\n")
+    assert path.read_bytes() == b"x\ny\n"
+    with pytest.raises(rstrip.ContentException, match="Already"):
+        rstrip.rstrip_file(str(path), linesep="\n")
+    rstrip.rstrip_file(str(path), newlines=2, linesep="\r\n")
+    assert path.read_bytes() == b"x\r\ny\r\n\r\n"
+
+
+@pytest.mark.parametrize("threshold", [1, rstrip.MMAP_THRESHOLD])
+@pytest.mark.parametrize(
+    "content, expected",
+    [
+        ("a  \r\n\x0c\n\rb\x1c\n\n", "a\n\n\nb\n"),
+        ("caf\u00e9\u3000\nb\xa0\t\n\u2028", "caf\u00e9\nb\n"),  # Not ascii
+        ("x \xe9\n\n", "x \xe9\n"),  # Dirty before the first non-ascii char
+        (" \t\n", "\n"),
+        ("\n", None),
+        ("caf\u00e9\n", None),
+    ],
+)
+def test_rstrip_file_engines(tmp_path, monkeypatch, threshold, content, expected):
+    monkeypatch.setattr(rstrip, "MMAP_THRESHOLD", threshold)
+    path = tmp_path / "a.txt"
+    path.write_bytes(content.encode())
+    if expected is None:
+        with pytest.raises(rstrip.ContentException, match="Already"):
+            rstrip.rstrip_file(str(path), linesep="\n")
+        assert path.read_bytes() == content.encode()
+    else:
+        rstrip.rstrip_file(str(path), linesep="\n")
+        assert path.read_bytes() == expected.encode()
+    path.write_bytes(b"\xff\xd8\xff\xe0 jpeg")
+    with pytest.raises(UnicodeDecodeError):
+        rstrip.rstrip_file(str(path), linesep="\n")
+
+
+@pytest.mark.parametrize("jobs", ["1", "4", "0"])
+def test_main_jobs(tree, monkeypatch, capsys, jobs):
+    out = run_main(monkeypatch, capsys, "-b", "n", "-r", "-j", jobs, "src")
+    lines = out.splitlines()
+    assert lines[-1] == "Done! 3 skiped, 20 rstriped."
+    assert "src/clean.py: skip! Already meet requirement." in lines
+    assert "src/empty.txt: skip! Empty file." in lines
+    assert any(i.startswith("src/image.bin: failed! ") for i in lines)
+    assert (tree / "pkg" / "m7.py").read_bytes() == b"a = 1\n"
+    out = run_main(monkeypatch, capsys, "-b", "n", "-r", "-j", jobs, "src")
+    assert out.splitlines()[-1] == "Done! 23 skiped, 0 rstriped."
+
+
+def test_process_files_keep_order(tree):
+    files = sorted(str(i) for i in tree.rglob("*.py"))
+    results = list(rstrip.process_files(files, "\n", jobs=3))
+    assert [i[0] for i in results] == files
+
+
+def test_incremental(tree, monkeypatch, capsys):
+    monkeypatch.setenv("RSTRIP_CACHE_DIR", str(tree.parent / "cache"))
+    args = ("-b", "n", "-i", "-r", "src")
+    hashed: list[str] = []
+    sha1 = rstrip.FileIndex.sha1
+    monkeypatch.setattr(
+        rstrip.FileIndex, "sha1", staticmethod(lambda fn: hashed.append(fn) or sha1(fn))
+    )
+    out = run_main(monkeypatch, capsys, *args)
+    assert out.splitlines()[-1] == "Done! 3 skiped, 20 rstriped."
+    # Content that has been read by rstrip is not read again to be hashed
+    assert sorted(hashed) == ["src/empty.txt", "src/image.bin"]
+    out = run_main(monkeypatch, capsys, *args)
+    assert out == "Done! 23 skiped, 0 rstriped.\n"  # Nothing was read
+    index = rstrip.FileIndex()
+    record = index.files[str(tree / "clean.py")]
+    assert record[1:] == [6, index.sha1(tree / "clean.py"), "\n", "skip"]
+    os.utime(tree / "clean.py", (1, 1))  # Touched, content is the same
+    (tree / "pkg" / "m1.py").write_text("b = 2 \n")
+    out = run_main(monkeypatch, capsys, *args)
+    assert out == "src/pkg/m1.py: rstriped.\nDone! 22 skiped, 1 rstriped.\n"
+    assert rstrip.FileIndex().files[str(tree / "clean.py")][0] == 1_000_000_000
+    # Another line break is not the same requirement
+    out = run_main(monkeypatch, capsys, "-b", "rn", "-i", "-r", "src")
+    assert out.splitlines()[-1] == "Done! 2 skiped, 21 rstriped."
+
+
+def test_changed(tree, monkeypatch, capsys):
+    git = ["git", "-c", "user.name=a", "-c", "user.email=a@b.c"]
+    subprocess.run(git + ["init", "-q"], check=True)
+    subprocess.run(git + ["add", "."], check=True)
+    subprocess.run(git + ["commit", "-q", "-m", "init"], check=True)
+    (tree / "pkg" / "m2.py").write_text("changed = 1  \n")
+    (tree / "new.py").write_text("new = 1  \n")
+    (tree / "new.txt").write_text("new = 1  \n")
+    (tree / "\u4e2d\u6587.py").write_text("new = 1  \n")
+    out = run_main(monkeypatch, capsys, "-b", "n", "--changed", "-t", "py")
+    assert sorted(out.splitlines()) == [
+        "Done! 0 skiped, 3 rstriped.",
+        "src/new.py: rstriped.",
+        "src/pkg/m2.py: rstriped.",
+        "src/\u4e2d\u6587.py: rstriped.",
+    ]
+
+
+def test_changed_without_head(tree, monkeypatch, capsys):
+    monkeypatch.setattr(sys, "argv", ["rstrip.py", "--changed"])
+    assert rstrip.main() == 1
+    assert capsys.readouterr().out == "--changed only works in a git repository.\n"
+    subprocess.run(["git", "init", "-q"], check=True)
+    subprocess.run(["git", "add", "src/pkg/m1.py"], check=True)
+    out = run_main(monkeypatch, capsys, "-b", "n", "--changed", "-t", "py")
+    assert "src/pkg/m1.py: rstriped." in out  # Staged before the first commit
+    assert out.endswith("Done! 1 skiped, 20 rstriped.\n")  # And untracked ones
+
+
+def test_get_filepaths(tree, monkeypatch):
+    (tree / ".venv" / "lib").mkdir(parents=True)
+    (tree / ".venv" / "lib" / "x.py").write_text("x = 1 \n")
+    (tree / "pkg" / "sub").mkdir()
+    (tree / "pkg" / "sub" / "deep.py").write_text("")
+    (tree.parent / "top.py").write_text("")
+
+    def find(*files: str, **kw) -> list[str]:
+        parser_args = dict(R=False, type="*", dir="", files=list(files))
+        parser_args.update(kw)
+        args = rstrip.argparse.Namespace(**parser_args)
+        return list(rstrip.get_filepaths(args))
+
+    all_files = find("src", R=True)
+    assert not any(".venv" in i for i in all_files)
+    assert len(all_files) == len(set(all_files)) == 24
+    assert find("src", "src/**", "src/pkg/m1.py", R=True) == [
+        "src/pkg/m1.py",
+        *(i for i in all_files if i != "src/pkg/m1.py"),
+    ]
+    assert find("src", type="py") == ["src/clean.py"]
+    assert find("src/*.py") == ["src/clean.py"]
+    assert find("src/*/") == ["src/clean.py", "src/empty.txt", "src/image.bin"]
+    assert find("*.py") == ["top.py"]
+    assert find("*/*.py") == ["top.py", "src/clean.py"]
+    assert find("**/deep.py") == ["src/pkg/sub/deep.py"]
+    assert find("src/**/m1?.py")[:2] == ["src/pkg/m10.py", "src/pkg/m11.py"]
+    modules = [i for i in all_files if i.startswith("src/pkg/m")]
+    assert find("clean.py", "pkg", dir="src") == ["src/clean.py", *modules]
+    with pytest.raises(Exception, match="not exists"):
+        find("a.py", dir="missing")
+
+
+@pytest.mark.parametrize("chunk", [1, 3, rstrip.STREAM_CHUNK])
+def test_rstrip_stream(tmp_path, monkeypatch, capsysbinary, chunk):
+    monkeypatch.setattr(rstrip, "STREAM_CHUNK", chunk)
+    monkeypatch.setattr(rstrip, "MMAP_THRESHOLD", 1)
+    content = "café \r\n\r\n  b　\r\r\n \t\n\n".encode()
+    expected = "café\n\n  b\n".encode()
+    monkeypatch.setattr(sys, "stdin", io.TextIOWrapper(io.BytesIO(content)))
+    assert run_main(monkeypatch, capsysbinary, "-b", "n", "-") == expected
+    path = tmp_path / "a.log"
+    path.write_bytes(content)
+    path.chmod(0o640)
+    rstrip.rstrip_file(str(path), newlines=2, linesep="\r\n")
+    assert path.read_bytes() == expected.replace(b"\n", b"\r\n") + b"\r\n"
+    assert path.stat().st_mode & 0o777 == 0o640
+    assert os.listdir(tmp_path) == ["a.log"]  # Temp file is replaced/removed
+    with pytest.raises(rstrip.ContentException, match="Already"):
+        rstrip.rstrip_file(str(path), newlines=2, linesep="\r\n")
+    assert os.listdir(tmp_path) == ["a.log"]
+
+
+def test_binary_sniffer(tmp_path, sniffer):
+    def check(name: str, content: bytes) -> str:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+        try:
+            rstrip.rstrip_file(str(path), linesep="\n")
+        except rstrip.ContentException as e:
+            return str(e)
+        return "rstriped"
+
+    assert check("a.pyc", b"a = 1  \n") == "Binary file extension."
+    for i in range(sniffer.learn + 1):
+        utf16 = "a\n".encode("utf-16")
+        assert check(f"{i}.txt", utf16) == "Not utf8 file(UTF-16/32 BOM)."
+    assert check("bom.txt", "\ufeffa  \n".encode()) == "rstriped"
+    for i in range(sniffer.learn):
+        assert check(f"{i}.dat", b"a  \x00\n") == "Binary file."
+    assert check("text.dat", b"a  \n") == "Binary file extension(learned)."
+    assert check("text.bin", b"a  \n") == "rstriped"
+    for i in range(sniffer.learn + 1):  # Text file of .bin was seen
+        assert check(f"{i}.bin", b"a  \x00\n") == "Binary file."
+    (tmp_path / ".gitattributes").write_text("*.txt text\n*.csv -text\n")
+    (tmp_path / "data" / ".gitattributes").parent.mkdir()
+    (tmp_path / "data" / ".gitattributes").write_text("*.txt binary\n/keep/* text\n")
+    sniffer.attributes.clear()
+    assert check("a.csv", b"a  \n") == "Binary file by .gitattributes."
+    assert check("data/sub/a.txt", b"a  \n") == "Binary file by .gitattributes."
+    assert check("data/keep/a.txt", b"a  \n") == "rstriped"
+    assert check("other/a.txt", b"a  \n") == "rstriped"
+    # Rejected by the first bytes, the rest is not read
+    content = b"\xff\xd8" + b"a  \n" * rstrip.MMAP_THRESHOLD
+    with pytest.raises(UnicodeDecodeError, match="position 0"):
+        check("image.raw", content)
+
+
+def test_get_filepaths_roots(tmp_path, monkeypatch):
+    for name in ("repo/a.txt", "repo/.github/ci.yml", "other/b.txt"):
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_text("")
+    monkeypatch.chdir(tmp_path / "repo")
+
+    def find(*files: str) -> list[str]:
+        args = rstrip.argparse.Namespace(R=True, type="*", dir="", files=list(files))
+        return list(rstrip.get_filepaths(args))
+
+    other = str(tmp_path / "other")
+    assert find(".", "../other") == ["a.txt", "../other/b.txt"]
+    assert find(".", other) == ["a.txt", other + "/b.txt"]
+    assert find(".", ".github") == ["a.txt", ".github/ci.yml"]
+
+
+@pytest.mark.parametrize("threshold", [1, rstrip.MMAP_THRESHOLD])
+def test_rstrip_file_locale_encoding(tmp_path, monkeypatch, threshold):
+    monkeypatch.setattr(rstrip, "MMAP_THRESHOLD", threshold)
+    monkeypatch.setattr(rstrip, "decode_order", lambda: ["latin-1", "utf8"])
+    path = tmp_path / "a.txt"
+    path.write_bytes("café  \n".encode("latin-1"))
+    rstrip.rstrip_file(str(path), linesep="\n")
+    assert path.read_bytes() == "café\n".encode()  # Same for both paths
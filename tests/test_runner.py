@@ -0,0 +1,70 @@
+import asyncio
+import sys
+import time
+
+from runner import Buffer, arun, arun_many, capture_output, run, run_and_echo, run_many
+
+PY = sys.executable
+
+
+def test_run():
+    r = run("echo hello && echo oops >&2 && exit 3")
+    assert (r.rc, r.stdout, r.stderr) == (3, "hello\n", "oops\n")
+    assert not r.ok and not r.timed_out
+    assert 0 < r.elapsed < 5
+    assert run([PY, "-c", "print(1 + 1)"]).stdout.strip() == "2"
+    assert run(["command-not-exists-" + "x" * 8]).rc == 127
+    assert capture_output("echo ' hi '") == "hi"
+
+
+def test_run_timeout():
+    start = time.time()
+    r = run("sleep 10; echo done", timeout=0.3)
+    assert r.timed_out and not r.ok
+    assert time.time() - start < 5
+    assert not run("true", timeout=5).timed_out
+
+
+def test_bounded_output():
+    lines: list[str] = []
+    code = "for i in range(100000): print(i)"
+    r = run([PY, "-c", code], max_output=1000, on_line=lines.append)
+    assert r.ok
+    assert len(r.stdout) <= 1000
+    assert r.stdout.endswith("99999\n")
+    assert len(lines) == 100000 and lines[-1] == "99999"
+    buffer = Buffer(10)
+    for chunk in (b"12345", b"67890", b"abc"):
+        buffer.add(chunk)
+    assert buffer.getvalue() == b"67890abc"
+    assert buffer.dropped == 5
+
+
+def test_run_many():
+    code = "import time; time.sleep(0.5); print({})"
+    cmds = [[PY, "-c", code.format(i)] for i in range(4)]
+    start = time.time()
+    results = run_many(cmds)
+    assert time.time() - start < 1.8  # Not 4 x 0.5 seconds
+    assert [r.stdout.strip() for r in results] == ["0", "1", "2", "3"]
+    assert all(r.elapsed >= 0.5 for r in results)
+    start = time.time()
+    run_many(cmds[:2], jobs=1)
+    assert time.time() - start >= 1.0
+
+
+def test_async():
+    async def main():
+        one = await arun("echo one")
+        many = await arun_many(["echo two", "exit 1"], timeout=5)
+        return one, many
+
+    one, (two, failed) = asyncio.run(main())
+    assert one.stdout == "one\n" and two.stdout == "two\n"
+    assert failed.rc == 1
+
+
+def test_run_and_echo(capfd):
+    assert run_and_echo("exit 2") == 2
+    assert run_and_echo("exit 2", dry=True) == 0
+    assert capfd.readouterr().out == "--> exit 2\n--> exit 2\n"
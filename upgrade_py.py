@@ -22,6 +22,10 @@ import sys
 import time
 from datetime import date
 
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Optional, Union  # NOQA:F401
+
 try:
     from enum import StrEnum  # ty: ignore[unresolved-import]
 except ImportError:
@@ -113,10 +117,14 @@ def is_pingable(domain):
     if "/" in domain:
         domain = domain.split("/")[0]
     try:
-        socket.gethostbyname(domain)
-    except Exception:
-        return False
-    return True
+        from pip_conf import resolve_host
+    except ImportError:
+        try:
+            socket.getaddrinfo(domain, None)  # Both IPv4 and IPv6
+        except Exception:
+            return False
+        return True
+    return bool(resolve_host(domain))
 
 
 def fetch_html(url):
@@ -174,25 +182,35 @@ def default_python_version():
     return v
 
 
-def silently_run(cmd):
-    # type: (str) -> str
-    with os.popen(cmd) as fp:
-        if not hasattr(fp, "_stream"):  # For python2
-            return fp.read().strip()
-        buffer = getattr(fp._stream, "buffer", None)
-        if buffer is None:
-            return ""
-        bf = buffer.read().strip()
-    try:
-        return bf.decode()
-    except UnicodeDecodeError:
-        return bf.decode("gbk")
-
-
-def run_and_echo(cmd):
-    # type: (str) -> int
-    print("--> " + cmd)
-    return os.system(cmd)
+try:
+    from runner import capture_output as silently_run
+    from runner import run_and_echo
+except ImportError:  # Downloaded alone by did_upgrade_py.sh
+
+    def silently_run(cmd, verbose=False, timeout=None):
+        # type: (Union[str, list[str]], bool, Optional[float]) -> str
+        if not isinstance(cmd, str):
+            cmd = " ".join(cmd)
+        if verbose:
+            print("--> " + cmd)
+        with os.popen(cmd) as fp:
+            if not hasattr(fp, "_stream"):  # For python2
+                return fp.read().strip()
+            buffer = getattr(fp._stream, "buffer", None)
+            if buffer is None:
+                return ""
+            bf = buffer.read().strip()
+        try:
+            return bf.decode()
+        except UnicodeDecodeError:
+            return bf.decode("gbk")
+
+    def run_and_echo(cmd, dry=False):
+        # type: (str, bool) -> int
+        print("--> " + cmd)
+        if dry:
+            return 0
+        return os.system(cmd)
 
 
 class Options(StrEnum):